@@ -0,0 +1,118 @@
+"""
+Compare the bytecode-rewriting and sys.monitoring capture backends.
+
+Generates a target package, then imports and exercises it in a fresh
+interpreter per backend (plain python, bytecode, monitoring) and reports
+import time and steady-state throughput. The monitoring backend needs
+Python 3.12+.
+
+Usage: python3 bench_backends.py [modules] [functions_per_module] [rounds]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+FUNC_TEMPLATE = '''
+def f{j}(x, y=1):
+    total = 0
+    for i in range(x):
+        total += helper(i, y)
+    return total
+'''
+
+MODULE_FOOTER = '''
+def helper(a, b):
+    return a * b + {i}
+
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+'''
+
+def generate_target(root, modules, functions):
+    pkg = os.path.join(root, 'benchpkg')
+    os.makedirs(pkg, exist_ok=True)
+    open(os.path.join(pkg, '__init__.py'), 'w').close()
+    for i in range(modules):
+        with open(os.path.join(pkg, f'm{i}.py'), 'w') as f:
+            for j in range(functions):
+                f.write(FUNC_TEMPLATE.format(j=j))
+            f.write(MODULE_FOOTER.format(i=i))
+    return pkg
+
+def child(backend, root, modules, functions, rounds):
+    import importlib
+    wdir = tempfile.mkdtemp(prefix='axolotl_bench_')
+    os.environ['WDIR'] = wdir
+    for d in ('instrumented', 'patch_file'):
+        os.makedirs(os.path.join(wdir, d), exist_ok=True)
+    sys.path.insert(0, SRC_DIR)
+    sys.path.insert(0, root)
+
+    import axolotl.mode as mc
+    from axolotl.loader import RuntimeAPRFileMatcher, RuntimeAPRImportManager
+    from axolotl.instrumenter import Instrumenter
+    from axolotl.monitoring import MonitoringBackend
+    mc.init_mode(wdir)
+
+    file_matcher = RuntimeAPRFileMatcher()
+    file_matcher.addSource(os.path.join(root, 'benchpkg'))
+    if backend == 'bytecode':
+        capture = RuntimeAPRImportManager(Instrumenter(), file_matcher)
+    elif backend == 'monitoring':
+        capture = MonitoringBackend(file_matcher)
+    else:
+        capture = None
+
+    if capture:
+        capture.__enter__()
+    start = time.perf_counter()
+    mods = [importlib.import_module(f'benchpkg.m{i}') for i in range(modules)]
+    import_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for m in mods:
+            for j in range(functions):
+                getattr(m, f'f{j}')(20)
+            m.fib(12)
+    run_time = time.perf_counter() - start
+    if capture:
+        capture.__exit__(None, None, None)
+
+    print(json.dumps({'import': import_time, 'run': run_time}))
+
+def main():
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    functions = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    root = tempfile.mkdtemp(prefix='axolotl_bench_target_')
+    generate_target(root, modules, functions)
+    print(f"python {sys.version.split()[0]}, {modules} modules x {functions} functions, {rounds} rounds")
+    print(f"{'backend':<12} {'import (s)':>12} {'run (s)':>12}")
+
+    for backend in ('plain', 'bytecode', 'monitoring'):
+        if backend == 'monitoring' and not hasattr(sys, 'monitoring'):
+            print(f"{backend:<12} {'needs python 3.12+':>25}")
+            continue
+        res = subprocess.run([sys.executable, __file__, '--child', backend, root,
+                              str(modules), str(functions), str(rounds)],
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            print(f"{backend:<12} failed: {res.stderr.strip().splitlines()[-1]}")
+            continue
+        result = json.loads(res.stdout.strip().splitlines()[-1])
+        print(f"{backend:<12} {result['import']:>12.3f} {result['run']:>12.3f}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]), int(sys.argv[6]))
+    else:
+        main()
@@ -0,0 +1,79 @@
+"""
+Cost of control-flow exceptions propagating through instrumented frames.
+
+A KeyError raised `depth` frames below the `except KeyError` that handles it,
+the way parsers and event loops use exceptions, timed uninstrumented, with the
+previous except path (mode read + print at every frame) and with triage.
+
+Usage: python3 bench_exceptions.py [iterations] [depth]
+"""
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+wdir = tempfile.mkdtemp(prefix='axolotl_bench_')
+os.environ['WDIR'] = wdir
+os.makedirs(os.path.join(wdir, 'patch_file'), exist_ok=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import axolotl.mode as mc
+import axolotl.patch as pc
+import axolotl.triage as tr
+from axolotl.instrumenter import Instrumenter, bind_runtime_globals
+
+mc.init_mode(wdir)
+pc.init_patch_generation(wdir)
+
+SOURCE = '''
+def lookup(table, key, depth):
+    if depth:
+        return lookup(table, key, depth - 1)
+    return table[key]
+
+def parse(tokens, table, depth):
+    found = 0
+    for token in tokens:
+        try:
+            found += lookup(table, token, depth)
+        except KeyError:
+            pass
+    return found
+'''
+
+def legacy_on_exception(exc):
+    """The except path before triage: every frame reads the mode and prints."""
+    mode = mc.mode_check()
+    print('Exception occur')
+    if mode == '-1':
+        print('Mode is repair mode')
+
+def run(namespace, iterations, depth):
+    tokens = list(range(iterations))
+    table = {i: 1 for i in range(0, iterations, 10)}
+    start = time.perf_counter()
+    namespace['parse'](tokens, table, depth)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    plain = {'__name__': 'bench_exceptions_target'}
+    exec(compile(SOURCE, 'bench_exceptions_target.py', 'exec'), plain)
+    instrumented = {'__name__': 'bench_exceptions_target'}
+    bind_runtime_globals(instrumented)
+    exec(Instrumenter().insert_try_except(compile(SOURCE, 'bench_exceptions_target.py', 'exec')), instrumented)
+
+    print(f"python {sys.version.split()[0]}, {iterations} lookups (90% miss), raised {depth} frames deep")
+    print(f"{'except path':<14} {'time (s)':>10}")
+    print(f"{'none':<14} {run(plain, iterations, depth):>10.3f}")
+
+    on_exception = tr.on_exception
+    tr.on_exception = legacy_on_exception
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        legacy = run(instrumented, iterations, depth)
+    tr.on_exception = on_exception
+    print(f"{'legacy':<14} {legacy:>10.3f}")
+    print(f"{'triage':<14} {run(instrumented, iterations, depth):>10.3f}")
@@ -0,0 +1,102 @@
+"""
+Import time through RuntimeAPRMetaPathFinder over a large dependency tree.
+
+Generates a package whose modules import a broad slice of the standard library
+and probe optional dependencies that aren't installed (the usual
+`try: import x / except ImportError` pattern), then imports it in a fresh
+interpreter with no finder, with the previous finder (no lookup cache) and with
+the current one. The matcher targets another directory, so nothing is
+instrumented and only lookup overhead is measured.
+
+Usage: python3 bench_import.py [modules] [optional_probes_per_module]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+STDLIB = ['asyncio', 'email.mime.multipart', 'http.server', 'xml.etree.ElementTree', 'unittest.mock',
+          'logging.handlers', 'multiprocessing.pool', 'concurrent.futures', 'json', 'csv', 'decimal',
+          'argparse', 'sqlite3', 'urllib.request', 'zipfile', 'tarfile', 'difflib', 'pydoc', 'statistics',
+          'fractions', 'shelve', 'configparser', 'ipaddress', 'uuid', 'smtplib', 'imaplib', 'xmlrpc.client']
+
+def generate_tree(root, modules, probes):
+    pkg = os.path.join(root, 'deptree')
+    os.makedirs(pkg, exist_ok=True)
+    open(os.path.join(pkg, '__init__.py'), 'w').close()
+    for i in range(modules):
+        lines = [f'import {STDLIB[(i + j) % len(STDLIB)]}' for j in range(3)]
+        for j in range(probes):
+            lines += ['try:', f'    import optional_dep_{j}', 'except ImportError:', f'    optional_dep_{j} = None']
+        if i:
+            lines.append(f'from deptree import m{i - 1}')
+        with open(os.path.join(pkg, f'm{i}.py'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+def child(kind, root, modules):
+    sys.path.insert(0, SRC_DIR)
+    sys.path.insert(0, root)
+    import importlib
+    from importlib import machinery
+    from axolotl.instrumenter import Instrumenter
+    from axolotl.loader import RuntimeAPRFileMatcher, RuntimeAPRImportManager, RuntimeAPRMetaPathFinder
+
+    class LegacyFinder(RuntimeAPRMetaPathFinder):
+        """find_spec before the lookup cache."""
+        def find_spec(self, fullname, path, target=None):
+            for f in sys.meta_path:
+                if isinstance(f, RuntimeAPRMetaPathFinder) or not hasattr(f, "find_spec"):
+                    continue
+                spec = f.find_spec(fullname, path, target)
+                if spec is None or spec.loader is None:
+                    continue
+                if isinstance(spec.loader, machinery.ExtensionFileLoader):
+                    return None
+                return spec
+            return None
+
+    matcher = RuntimeAPRFileMatcher()
+    matcher.addSource(os.path.join(root, 'elsewhere'))
+    manager = None
+    if kind != 'none':
+        manager = RuntimeAPRImportManager(Instrumenter(), matcher)
+        if kind == 'legacy':
+            manager.mpf = LegacyFinder(manager.mpf.sci, matcher)
+        manager.__enter__()
+
+    start = time.perf_counter()
+    for i in range(modules):
+        importlib.import_module(f'deptree.m{i}')
+    elapsed = time.perf_counter() - start
+    if manager:
+        manager.__exit__(None, None, None)
+    print(json.dumps({'import': elapsed}))
+
+def main():
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    probes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    root = tempfile.mkdtemp(prefix='axolotl_bench_import_')
+    generate_tree(root, modules, probes)
+
+    # warm-up: writes the generated modules' __pycache__ so every timed run starts alike
+    subprocess.run([sys.executable, __file__, '--child', 'none', root, str(modules)], capture_output=True)
+
+    print(f"python {sys.version.split()[0]}, {modules} modules, {probes} optional imports each")
+    print(f"{'finder':<10} {'import (s)':>12}")
+    for kind in ('none', 'legacy', 'cached'):
+        res = subprocess.run([sys.executable, __file__, '--child', kind, root, str(modules)],
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            print(f"{kind:<10} failed: {res.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{kind:<10} {json.loads(res.stdout.strip().splitlines()[-1])['import']:>12.3f}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,84 @@
+"""
+Call-overhead benchmark for instrumented code.
+
+Runs a tight recursive function and, when black's blib2to3 is importable, the
+blib2to3 tokenizer (a small-function-heavy workload) both uninstrumented and
+instrumented by axolotl's Instrumenter, and prints the per-run time of each.
+
+Usage: python3 bench_instrumentation.py [repeat]
+"""
+import os
+import sys
+import tempfile
+import timeit
+import importlib.util
+
+wdir = tempfile.mkdtemp(prefix='axolotl_bench_')
+os.environ['WDIR'] = wdir
+os.makedirs(os.path.join(wdir, 'patch_file'), exist_ok=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import axolotl.mode as mc
+from axolotl import instrumenter
+from axolotl.instrumenter import Instrumenter
+
+mc.init_mode(wdir)
+
+FIB_SOURCE = '''
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+'''
+
+def load(source, filename, instrument, package=None):
+    code = compile(source, filename, 'exec')
+    namespace = {'__name__': 'bench_target', '__file__': filename, '__package__': package}
+    if instrument:
+        code = Instrumenter().insert_try_except(code)
+        if hasattr(instrumenter, 'bind_runtime_globals'):
+            instrumenter.bind_runtime_globals(namespace)
+    exec(code, namespace)
+    return namespace
+
+def bench(label, stmt, repeat):
+    best = min(timeit.repeat(stmt, number=1, repeat=repeat))
+    print(f"{label:<40} {best * 1e3:10.2f} ms")
+    return best
+
+def bench_fib(repeat):
+    plain = load(FIB_SOURCE, 'fib.py', False)['fib']
+    inst = load(FIB_SOURCE, 'fib.py', True)['fib']
+    base = bench('fib(22) plain', lambda: plain(22), repeat)
+    cost = bench('fib(22) instrumented', lambda: inst(22), repeat)
+    print(f"{'  overhead':<40} {cost / base:10.2f} x")
+
+def bench_tokenizer(repeat):
+    try:
+        spec = importlib.util.find_spec('blib2to3.pgen2.tokenize')
+    except ModuleNotFoundError:
+        spec = None
+    if spec is None or not spec.origin:
+        print('blib2to3 not importable, skipping tokenizer benchmark')
+        return
+    origin = os.path.splitext(spec.origin)[0].split('.cpython')[0] + '.py'   # mypyc builds ship the .py too
+    with open(origin) as f:
+        source = f.read()
+    text = source * 4
+
+    def tokenize_all(ns):
+        readline = iter(text.splitlines(keepends=True)).__next__
+        for _ in ns['generate_tokens'](readline):
+            pass
+
+    plain = load(source, origin, False, spec.parent)
+    inst = load(source, origin, True, spec.parent)
+    base = bench('blib2to3 tokenize plain', lambda: tokenize_all(plain), repeat)
+    cost = bench('blib2to3 tokenize instrumented', lambda: tokenize_all(inst), repeat)
+    print(f"{'  overhead':<40} {cost / base:10.2f} x")
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"python {sys.version.split()[0]}")
+    bench_fib(repeat)
+    bench_tokenizer(repeat)
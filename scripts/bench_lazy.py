@@ -0,0 +1,65 @@
+"""
+Import latency of eager vs lazy (first-call) instrumentation.
+
+Generates one large module, instruments and executes it with Instrumenter in
+eager and lazy mode, then calls a fraction of its functions and reports both
+times.
+
+Usage: python3 bench_lazy.py [functions] [called_fraction]
+"""
+import os
+import sys
+import time
+import tempfile
+
+wdir = tempfile.mkdtemp(prefix='axolotl_bench_')
+os.environ['WDIR'] = wdir
+os.makedirs(os.path.join(wdir, 'patch_file'), exist_ok=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import axolotl.mode as mc
+import axolotl.patch as pc
+from axolotl import lazy
+from axolotl.instrumenter import Instrumenter, bind_runtime_globals
+
+mc.init_mode(wdir)
+pc.init_patch_generation(wdir)
+
+FUNC_TEMPLATE = '''
+def f{i}(items, scale=1, *, default=None):
+    total = 0
+    for item in items:
+        try:
+            total += item * scale
+        except TypeError:
+            total += default or 0
+    return total
+'''
+
+def run(source, is_lazy, functions, called):
+    sci = Instrumenter(lazy=is_lazy)
+    lazy.set_instrumenter(sci)
+    start = time.perf_counter()
+    code = sci.insert_try_except(compile(source, 'bench_lazy_target.py', 'exec'))
+    namespace = {'__name__': 'bench_lazy_target'}
+    bind_runtime_globals(namespace)
+    exec(code, namespace)
+    import_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, functions, max(functions // max(called, 1), 1)):
+        namespace[f'f{i}'](range(10))
+    call_time = time.perf_counter() - start
+    return import_time, call_time
+
+if __name__ == '__main__':
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    source = ''.join(FUNC_TEMPLATE.format(i=i) for i in range(functions))
+    called = int(functions * fraction)
+
+    print(f"python {sys.version.split()[0]}, {functions} functions, {called} called")
+    print(f"{'mode':<8} {'import (s)':>12} {'calls (s)':>12}")
+    for label, is_lazy in (('eager', False), ('lazy', True)):
+        import_time, call_time = run(source, is_lazy, functions, called)
+        print(f"{label:<8} {import_time:>12.3f} {call_time:>12.3f}")
@@ -0,0 +1,128 @@
+"""
+Matcher cost during imports of a large package.
+
+Generates a package with thousands of modules, imports all of them with a
+RuntimeAPRImportManager active (the matcher targets another directory, so no
+module is instrumented and only lookup overhead is measured), and reports the
+time spent in RuntimeAPRFileMatcher.matches against the previous uncompiled
+implementation. Each run uses a fresh interpreter.
+
+Usage: python3 bench_matcher.py [modules] [lookups_per_module]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from fnmatch import fnmatch
+from pathlib import Path
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+class LegacyFileMatcher:
+    """RuntimeAPRFileMatcher.matches before compilation/memoisation."""
+    def __init__(self, matcher):
+        self.__dict__.update({k: v for k, v in matcher.__dict__.items() if not k.startswith('_')})
+
+    def matches(self, filename):
+        if filename is None:
+            return False
+        if isinstance(filename, str):
+            if filename == 'built-in': return False
+            filename = Path(filename)
+        if filename.suffix in ('.pyd', '.so'): return False
+        if not filename.is_absolute():
+            filename = self.cwd / filename
+        if self.omit:
+            if any(fnmatch(filename, o) for o in self.omit):
+                return False
+        if any(keyword in str(filename) for keyword in self.exclude_keywords):
+            return False
+        if self.sources:
+            return any(s == filename or s in filename.parents for s in self.sources)
+        if any(p in self.pylib_paths for p in filename.parents):
+            return False
+        return self.cwd in filename.parents
+
+def generate_package(root, modules):
+    pkg = os.path.join(root, 'bigpkg')
+    per_dir = 100
+    for i in range(modules):
+        sub = os.path.join(pkg, f'sub{i // per_dir}')
+        if not os.path.exists(sub):
+            os.makedirs(sub)
+            open(os.path.join(sub, '__init__.py'), 'w').close()
+        with open(os.path.join(sub, f'm{i}.py'), 'w') as f:
+            f.write(f'VALUE = {i}\n')
+    open(os.path.join(pkg, '__init__.py'), 'w').close()
+    return pkg
+
+def child(kind, root, modules, lookups):
+    sys.path.insert(0, SRC_DIR)
+    sys.path.insert(0, root)
+    import importlib
+    from axolotl.instrumenter import Instrumenter
+    from axolotl.loader import RuntimeAPRFileMatcher, RuntimeAPRImportManager
+    from axolotl.submodule import INST_BLACKLIST
+
+    matcher = RuntimeAPRFileMatcher()
+    matcher.addSource(os.path.join(root, 'elsewhere'))
+    matcher.addOmit('*/vendored/*')
+    matcher.addOmit('*_pb2.py')
+    for kw in INST_BLACKLIST:
+        matcher.addExcludeKeyword(kw)
+    if kind == 'legacy':
+        matcher = LegacyFileMatcher(matcher)
+
+    timed = {'calls': 0, 'time': 0.0}
+    matches = matcher.matches
+    def timed_matches(filename):
+        start = time.perf_counter()
+        try:
+            return matches(filename)
+        finally:
+            timed['time'] += time.perf_counter() - start
+            timed['calls'] += 1
+    matcher.matches = timed_matches
+
+    names = [f'bigpkg.sub{i // 100}.m{i}' for i in range(modules)]
+    start = time.perf_counter()
+    with RuntimeAPRImportManager(Instrumenter(), matcher):
+        for name in names:
+            importlib.import_module(name)
+    import_time = time.perf_counter() - start
+
+    # repeated lookups of the same origins (e.g. monitoring / profiler callbacks)
+    origins = [sys.modules[name].__file__ for name in names]
+    start = time.perf_counter()
+    for _ in range(lookups):
+        for origin in origins:
+            matches(origin)
+    repeat_time = time.perf_counter() - start
+
+    print(json.dumps({'import': import_time, 'matcher': timed['time'], 'calls': timed['calls'],
+                      'repeat': repeat_time}))
+
+def main():
+    modules = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    root = tempfile.mkdtemp(prefix='axolotl_bench_matcher_')
+    generate_package(root, modules)
+
+    print(f"python {sys.version.split()[0]}, {modules} modules, {lookups} repeated lookups per module")
+    print(f"{'matcher':<10} {'import (s)':>12} {'matches (s)':>12} {'calls':>8} {'repeat (s)':>12}")
+    for kind in ('legacy', 'compiled'):
+        res = subprocess.run([sys.executable, __file__, '--child', kind, root, str(modules), str(lookups)],
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            print(f"{kind:<10} failed: {res.stderr.strip().splitlines()[-1]}")
+            continue
+        r = json.loads(res.stdout.strip().splitlines()[-1])
+        print(f"{kind:<10} {r['import']:>12.3f} {r['matcher']:>12.3f} {r['calls']:>8} {r['repeat']:>12.3f}")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        child(sys.argv[2], sys.argv[3], int(sys.argv[4]), int(sys.argv[5]))
+    else:
+        main()
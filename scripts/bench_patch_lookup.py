@@ -0,0 +1,50 @@
+"""
+Microbenchmark for the per-call patch lookup done by every instrumented prologue.
+
+Compares the previous filesystem probe (os.path.exists per call) against the
+in-memory registry in axolotl.patch.
+
+Usage: python3 bench_patch_lookup.py [number_of_calls]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+wdir = tempfile.mkdtemp(prefix='axolotl_bench_')
+os.environ['WDIR'] = wdir
+os.makedirs(os.path.join(wdir, 'patch_file'), exist_ok=True)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import axolotl.patch as pc
+
+PATCH_FOLDER = os.path.join(wdir, 'patch_file')
+
+def legacy_func_patch_exist(func_name):
+    if os.path.exists(os.path.join(PATCH_FOLDER, f"{func_name}_patch")):
+        return True
+    else:
+        return False
+
+def report(label, seconds, number):
+    print(f"{label:<28} {seconds / number * 1e9:10.1f} ns/call")
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    pc.init_patch_generation(wdir)
+
+    legacy = timeit.timeit(lambda: legacy_func_patch_exist('hot_func'), number=number)
+    registry = timeit.timeit(lambda: pc.func_patch_exist('hot_func'), number=number)
+    baseline = timeit.timeit(lambda: None, number=number)
+
+    print(f"calls: {number}")
+    report("empty lambda (baseline)", baseline, number)
+    report("os.path.exists probe", legacy, number)
+    report("generation registry", registry, number)
+    report("saved per call", legacy - registry, number)
+
+    # publishing a patch costs one rescan on the next call only
+    open(os.path.join(PATCH_FOLDER, 'hot_func_patch'), 'wb').close()
+    pc.publish_patches(wdir)
+    assert pc.func_patch_exist('hot_func')
+    assert not pc.func_patch_exist('cold_func')
@@ -73,6 +73,10 @@ setuptools.setup(
         "dill",
         "psutil"
     ],
+    extras_require={
+        # faster checkpoint chunk compression than the zlib fallback (--chunk-store)
+        "compression": ["zstandard", "lz4"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
@@ -1,6 +1,10 @@
+__version__ = '0.1.0'
+
 from .logger import setup_logger, get_logger, AxolotlReporter, get_reporter
 from .checkpoint import Checkpoint
+from .events import checkpoint_hint
 from .instrumenter import Instrumenter
+from .monitoring import MonitoringBackend
 from .loader import RuntimeAPRLoader,RuntimeAPRMetaPathFinder,RuntimeAPRFileMatcher,RuntimeAPRImportManager
 from .mode import safe_mode, repair_mode, validation_mode, validation_fail_mode, mode_check
 from .patch import func_patch_exist, patched_func
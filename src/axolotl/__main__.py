@@ -11,6 +11,24 @@ import argparse
 from .loader import RuntimeAPRFileMatcher
 from .checkpoint import Checkpoint
 from .logger import setup_logger, get_reporter
+from .patch import init_patch_generation
+from .mode import init_mode
+from .artifacts import disasm_main, ARTIFACT_MODES
+from .monitoring import BACKENDS, monitoring_available
+from .plan import DEFAULT_HOT_THRESHOLD
+from .rules import init_exception_sites
+from .scheduler import DEFAULT_BUDGET, DEFAULT_MIN_INTERVAL, DEFAULT_MAX_INTERVAL
+from .snapshot import SNAPSHOT_BACKENDS
+from .imagestore import DEFAULT_HOT_KEEP
+from .chunkstore import CHUNK_CODECS, DEFAULT_CHUNK_SIZE
+from .retention import DEFAULT_KEEP, DEFAULT_MAX_CHAIN, DEFAULT_DISK_BUDGET
+
+# subcommands: python -m axolotl disasm ... / python -m axolotl instrument ...
+if len(sys.argv) > 1 and sys.argv[1] == 'disasm':
+    sys.exit(disasm_main(sys.argv[2:]))
+if len(sys.argv) > 1 and sys.argv[1] == 'instrument':
+    from .aot import instrument_main
+    sys.exit(instrument_main(sys.argv[2:]))
 
 # The intended usage is:
 #
@@ -32,6 +50,56 @@ g.add_argument('-m', dest='module', nargs=1, help="run given module as __main__"
 g.add_argument('script', nargs='?', type=Path, help="the script to run")
 ap.add_argument('script_or_module_args', nargs=argparse.REMAINDER)
 ap.add_argument('--ignore-repair', action='store_true', help="run the input file as the basic interpreter")
+ap.add_argument('--backend', type=str, default='bytecode', choices=BACKENDS,
+                help="exception capture: bytecode rewriting (default) or sys.monitoring events (Python 3.12+)")
+ap.add_argument('--code-cache', type=Path, help="instrumented code cache directory (default: WDIR/code_cache)")
+ap.add_argument('--no-code-cache', action='store_true', help="always re-instrument modules on import")
+ap.add_argument('--debug-artifacts', type=str, default='off', choices=ARTIFACT_MODES,
+                help="instrumented code dumps: off (default), lazy (marshalled code, see 'axolotl disasm') or background")
+ap.add_argument('--mode-backend', type=str, default='shm', choices=['shm', 'file'],
+                help="where the process mode lives: shared mmap'd word (default) or the process_mode file")
+ap.add_argument('--plan', type=Path, help="instrumentation plan written by a --profile-plan run")
+ap.add_argument('--profile-plan', type=Path, metavar='PLAN',
+                help="warm-up run: record call/raise counts (no instrumentation, no repair) and write a plan")
+ap.add_argument('--plan-hot-threshold', type=int, default=DEFAULT_HOT_THRESHOLD,
+                help=f"--profile-plan: skip functions called at least this often (default {DEFAULT_HOT_THRESHOLD})")
+ap.add_argument('--plan-keep-never-raised', action='store_true',
+                help="--profile-plan: keep instrumenting functions that never raised during the warm-up run")
+ap.add_argument('--lazy-instrumentation', action='store_true',
+                help="instrument module-level functions on their first call instead of at import")
+ap.add_argument('--exception-rules', type=Path, metavar='RULES',
+                help="JSON allow/deny rules and per-site repair limits for exceptions (see axolotl.rules)")
+ap.add_argument('--resume-in-place', action='store_true',
+                help="after a validated repair, retry the failing call with the patch in the running target "
+                     "and carry on from there; restore a checkpoint only if that fails. For functions whose "
+                     "failing call can safely run again")
+ap.add_argument('--snapshot-backend', type=str, default='criu', choices=SNAPSHOT_BACKENDS,
+                help="checkpoint the target with criu (needs root) or with paused fork() children "
+                     "(unprivileged, single-process single-threaded targets only)")
+ap.add_argument('--image-hot-dir', type=Path, metavar='DIR',
+                help="write checkpoint images to a memory-backed directory (e.g. /dev/shm) first "
+                     "and move older ones to WDIR in the background")
+ap.add_argument('--image-hot-keep', type=int, default=DEFAULT_HOT_KEEP,
+                help=f"--image-hot-dir: newest checkpoints kept there (default {DEFAULT_HOT_KEEP})")
+ap.add_argument('--chunk-store', type=Path, metavar='DIR',
+                help="store the page data of checkpoint images deduplicated and compressed in DIR, "
+                     "which can be shared between runs (criu backend)")
+ap.add_argument('--chunk-codec', type=str, default='auto', choices=CHUNK_CODECS,
+                help="--chunk-store: compression; auto picks zstd, lz4 or zlib, whichever is installed")
+ap.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, metavar='BYTES',
+                help=f"--chunk-store: bytes of page data per chunk (default {DEFAULT_CHUNK_SIZE})")
+ap.add_argument('--checkpoint-budget', type=float, default=DEFAULT_BUDGET,
+                help=f"fraction of run time the target may spend frozen in checkpoints (default {DEFAULT_BUDGET})")
+ap.add_argument('--checkpoint-min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                help=f"minimum seconds between checkpoints (default {DEFAULT_MIN_INTERVAL})")
+ap.add_argument('--checkpoint-max-interval', type=float, default=DEFAULT_MAX_INTERVAL,
+                help=f"maximum seconds between checkpoints (default {DEFAULT_MAX_INTERVAL})")
+ap.add_argument('--checkpoint-keep', type=int, default=DEFAULT_KEEP,
+                help=f"restore points kept on disk (default {DEFAULT_KEEP})")
+ap.add_argument('--checkpoint-max-chain', type=int, default=DEFAULT_MAX_CHAIN,
+                help=f"incremental checkpoints before the next full one (default {DEFAULT_MAX_CHAIN})")
+ap.add_argument('--checkpoint-disk-budget', type=float, default=DEFAULT_DISK_BUDGET, metavar='MIB',
+                help="disk space for checkpoint images in MiB; older restore points are dropped to fit (default: unlimited)")
 
 if '-m' in sys.argv:  # work around exclusive group not handled properly
     minus_m = sys.argv.index('-m')
@@ -44,6 +112,39 @@ wdir = args.wdir.resolve()
 if args.llm_model:
     wdir = wdir / args.llm_model
 os.environ["WDIR"] = str(wdir)
+os.environ["AXOLOTL_MODE_BACKEND"] = args.mode_backend
+os.environ["AXOLOTL_DEBUG_ARTIFACTS"] = args.debug_artifacts
+if args.backend == 'monitoring' and not monitoring_available():
+    print("[!] --backend monitoring needs Python 3.12+, using the bytecode backend", file=sys.stderr)
+    args.backend = 'bytecode'
+os.environ["AXOLOTL_BACKEND"] = args.backend
+if args.lazy_instrumentation:
+    os.environ["AXOLOTL_LAZY"] = "1"
+if args.exception_rules:
+    os.environ["AXOLOTL_EXCEPTION_RULES"] = str(args.exception_rules.resolve())
+if args.resume_in_place:
+    os.environ["AXOLOTL_RESUME_IN_PLACE"] = "1"
+os.environ["AXOLOTL_SNAPSHOT_BACKEND"] = args.snapshot_backend
+if args.image_hot_dir:
+    os.environ["AXOLOTL_IMAGE_HOT_DIR"] = str(args.image_hot_dir.resolve())
+    os.environ["AXOLOTL_IMAGE_HOT_KEEP"] = str(args.image_hot_keep)
+if args.chunk_store:
+    os.environ["AXOLOTL_CHUNK_STORE"] = str(args.chunk_store.resolve())
+    os.environ["AXOLOTL_CHUNK_CODEC"] = args.chunk_codec
+    os.environ["AXOLOTL_CHUNK_SIZE"] = str(args.chunk_size)
+os.environ["AXOLOTL_CHECKPOINT_BUDGET"] = str(args.checkpoint_budget)
+os.environ["AXOLOTL_CHECKPOINT_MIN_INTERVAL"] = str(args.checkpoint_min_interval)
+os.environ["AXOLOTL_CHECKPOINT_MAX_INTERVAL"] = str(args.checkpoint_max_interval)
+os.environ["AXOLOTL_CHECKPOINT_KEEP"] = str(args.checkpoint_keep)
+os.environ["AXOLOTL_CHECKPOINT_MAX_CHAIN"] = str(args.checkpoint_max_chain)
+os.environ["AXOLOTL_CHECKPOINT_DISK_BUDGET"] = str(args.checkpoint_disk_budget)
+if args.plan:
+    os.environ["AXOLOTL_PLAN"] = str(args.plan.resolve())
+if args.profile_plan:
+    os.environ["AXOLOTL_PROFILE_PLAN"] = str(args.profile_plan.resolve())
+    os.environ["AXOLOTL_PLAN_HOT_THRESHOLD"] = str(args.plan_hot_threshold)
+    if args.plan_keep_never_raised:
+        os.environ["AXOLOTL_PLAN_KEEP_NEVER_RAISED"] = "1"
 os.makedirs(wdir, exist_ok=True)
 
 def clean_and_create_directory(dir):
@@ -61,6 +162,12 @@ clean_and_create_directory(f'{wdir}/instrumented')
 clean_and_create_directory(f'{wdir}/patch_file')
 clean_and_create_directory(f'{wdir}/log')
 
+# instrumented code cache, kept across runs
+if args.no_code_cache:
+    os.environ["AXOLOTL_CODE_CACHE"] = ""
+else:
+    os.environ["AXOLOTL_CODE_CACHE"] = str((args.code_cache or wdir / 'code_cache').resolve())
+
 logger = setup_logger(str(wdir), vars(args)) 
 reporter = get_reporter()
 
@@ -92,9 +199,13 @@ with open(file_matcher_path, "wb") as f:
 os.environ["AXOLOTL_FILE_MATCHER"] = file_matcher_path
 
 # initialize mode
-with open(f'{wdir}/process_mode', 'w') as f:
-    f.write('0')
-os.chmod(f'{wdir}/process_mode', 0o666)
+init_mode(str(wdir))
+
+# initialize patch generation counter
+init_patch_generation(str(wdir))
+
+# initialize per exception site counters
+init_exception_sites(str(wdir))
 
 # initialize mutation_count## 필요한지 확인필요 대기 TODO
 # with open(f'{wdir}/mutation/mutation_count', 'w') as f:
@@ -121,15 +232,24 @@ else:
     module_name = args.module[0]
     module_args = args.script_or_module_args
     proc = subprocess.Popen(['python3', str(submodule_script), 'module', module_name, *module_args], env=env)
+
+if args.profile_plan:
+    # warm-up run only: no checkpoints, no repair
+    logger.info(f"[Plan] Profiling run, plan will be written to {args.profile_plan}")
+    proc.wait()
+    logger.info("[Main] Axolotl process completed.")
+    sys.exit(proc.returncode)
+
 proc = psutil.Process(proc.pid)
 
 
 logger.info(f"[CRIU] Storing initial checkpoint for PID: {proc.pid}")
-criu.store_checkpoint(proc,f'{wdir}/checkpoints{criu.restore_num}')
+criu.store_checkpoint(proc)
 
 logger.info("[CRIU] Entering CRIU monitoring loop...")
     
 criu.criu_loop(proc)
+criu.close()
 
 if reporter:
     reporter.end_after_validate_timer()
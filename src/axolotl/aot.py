@@ -0,0 +1,95 @@
+import os
+import sys
+import ast
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from .cache import InstrumentedCodeCache
+from .instrumenter import Instrumenter
+from .loader import RuntimeAPRFileMatcher
+from .plan import InstrumentationPlan
+
+# directories never holding target modules
+SKIP_DIRS = {'__pycache__', '.git', '.hg', '.svn', '.tox', '.nox', 'node_modules'}
+
+_worker = None      # (Instrumenter, InstrumentedCodeCache) of a pool process
+
+def _init_worker(cache_dir: str, plan_path: str, lazy: bool):
+    global _worker
+    sci = Instrumenter(plan=InstrumentationPlan.load(plan_path) if plan_path else None, lazy=lazy)
+    _worker = (sci, InstrumentedCodeCache(cache_dir, sci.cache_key()))
+
+def _instrument_file(origin: str):
+    """Compile and instrument one module the way RuntimeAPRLoader does, and store it in the cache."""
+    sci, code_cache = _worker
+    origin = Path(origin)
+    try:
+        start = time.perf_counter()
+        st = os.stat(origin)
+        code = compile(ast.parse(origin.read_bytes()), str(origin), "exec")
+        code = sci.insert_try_except(code)
+        code_cache.store(origin, code, time.perf_counter() - start, st)
+        return str(origin), None
+    except Exception as e:
+        return str(origin), f"{type(e).__name__}: {e}"
+
+def find_sources(file_matcher, root: Path):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for filename in filenames:
+            if filename.endswith('.py'):
+                path = Path(dirpath) / filename
+                if file_matcher.matches(path):
+                    yield path
+
+def instrument_main(argv):
+    """python -m axolotl instrument --wdir DIR --source SRC [--jobs N] ..."""
+    from .submodule import INST_BLACKLIST
+
+    ap = argparse.ArgumentParser(prog='axolotl instrument',
+                                 description="instrument a source tree ahead of time into the code cache")
+    ap.add_argument('--wdir', type=Path, required=True, help="working directory of the later run")
+    ap.add_argument('--source', type=Path, required=True, help="target project root directory to instrument")
+    ap.add_argument('--llm_model', type=str, default='gpt5', help="LLM model sub-directory of the later run")
+    ap.add_argument('--code-cache', type=Path, help="instrumented code cache directory (default: WDIR/code_cache)")
+    ap.add_argument('--plan', type=Path, help="instrumentation plan the later run will use")
+    ap.add_argument('--lazy-instrumentation', action='store_true', help="the later run uses --lazy-instrumentation")
+    ap.add_argument('--no-blacklist', action='store_true',
+                    help="also instrument modules module-mode runs never instrument (tests, __init__, ...)")
+    ap.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help="worker processes (default: CPU count)")
+    ap.add_argument('--force', action='store_true', help="re-instrument modules that have a valid cache entry")
+    args = ap.parse_args(argv)
+
+    root = args.source.resolve()
+    if not root.is_dir():
+        print(f"Source directory does not exist: {root}", file=sys.stderr)
+        return 1
+    cache_dir = str((args.code_cache or args.wdir.resolve() / args.llm_model / 'code_cache').resolve())
+    plan_path = str(args.plan.resolve()) if args.plan else None
+
+    file_matcher = RuntimeAPRFileMatcher()
+    file_matcher.addSource(str(root))
+    if not args.no_blacklist:
+        for kw in INST_BLACKLIST:
+            file_matcher.addExcludeKeyword(kw)
+
+    _init_worker(cache_dir, plan_path, args.lazy_instrumentation)
+    sources = [str(path) for path in find_sources(file_matcher, root)]
+    if not args.force:
+        code_cache = _worker[1]
+        sources = [origin for origin in sources if not code_cache.is_fresh(Path(origin))]
+
+    start = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1), initializer=_init_worker,
+                             initargs=(cache_dir, plan_path, args.lazy_instrumentation)) as pool:
+        for origin, error in pool.map(_instrument_file, sources, chunksize=4):
+            if error:
+                failed += 1
+                print(f"[!] {origin}: {error}", file=sys.stderr)
+
+    print(f"Instrumented {len(sources) - failed} modules into {cache_dir} "
+          f"in {time.perf_counter() - start:.1f}s ({failed} failed)")
+    return 1 if failed and failed == len(sources) else 0
@@ -0,0 +1,102 @@
+import os
+import sys
+import dis
+import queue
+import atexit
+import marshal
+import argparse
+import threading
+from pathlib import Path
+from types import CodeType
+
+# off        : write nothing (default, cheapest)
+# lazy       : store the marshalled instrumented code, disassemble on demand
+#              with `python -m axolotl disasm`
+# background : disassemble into WDIR/instrumented/<module> on a writer thread
+ARTIFACT_MODES = ('off', 'lazy', 'background')
+ARTIFACT_MODE_ENV = "AXOLOTL_DEBUG_ARTIFACTS"
+CODE_SUFFIX = '.code'
+
+_writer = None
+
+class DebugArtifactWriter:
+    def __init__(self, mode: str, out_dir: str):
+        if mode not in ARTIFACT_MODES:
+            mode = 'off'
+        self.mode = mode
+        self.out_dir = out_dir
+        self._queue = None
+        self._thread = None
+
+        if self.mode == 'background':
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='axolotl-artifacts', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def record(self, module_name: str, code: CodeType):
+        if self.mode == 'off':
+            return
+        if self.mode == 'lazy':
+            try:
+                with open(os.path.join(self.out_dir, module_name + CODE_SUFFIX), 'wb') as f:
+                    marshal.dump(code, f)
+            except OSError:
+                pass
+        else:
+            self._queue.put((module_name, code))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            module_name, code = item
+            try:
+                with open(os.path.join(self.out_dir, module_name), 'w') as f:
+                    dis.dis(code, file=f)
+            except Exception:
+                pass
+
+    def close(self):
+        """Flush pending disassembly (background mode)."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+def get_artifact_writer() -> DebugArtifactWriter:
+    global _writer
+    if _writer is None:
+        _writer = DebugArtifactWriter(os.getenv(ARTIFACT_MODE_ENV, 'off'),
+                                      f'{os.getenv("WDIR")}/instrumented')
+    return _writer
+
+def disassemble(instrumented_dir: str, module_name: str, file=None):
+    """Disassemble a module stored in lazy mode."""
+    with open(os.path.join(instrumented_dir, module_name + CODE_SUFFIX), 'rb') as f:
+        code = marshal.load(f)
+    dis.dis(code, file=file or sys.stdout)
+
+def disasm_main(argv):
+    """python -m axolotl disasm --wdir DIR [--llm_model M] [module ...]"""
+    ap = argparse.ArgumentParser(prog='axolotl disasm')
+    ap.add_argument('--wdir', type=Path, required=True, help="working directory of the run")
+    ap.add_argument('--llm_model', type=str, default='gpt5', help="LLM model sub-directory of the run")
+    ap.add_argument('modules', nargs='*', help="modules to disassemble (lists stored modules if omitted)")
+    args = ap.parse_args(argv)
+
+    instrumented_dir = args.wdir.resolve() / args.llm_model / 'instrumented'
+    if not args.modules:
+        for entry in sorted(os.listdir(instrumented_dir)):
+            if entry.endswith(CODE_SUFFIX):
+                print(entry[:-len(CODE_SUFFIX)])
+        return 0
+
+    for module_name in args.modules:
+        try:
+            disassemble(str(instrumented_dir), module_name)
+        except FileNotFoundError:
+            print(f"No stored code for '{module_name}' (was the run started with --debug-artifacts lazy?)",
+                  file=sys.stderr)
+            return 1
+    return 0
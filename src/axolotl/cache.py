@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import struct
+import marshal
+import hashlib
+import tempfile
+import importlib.util
+from pathlib import Path
+from types import CodeType
+from typing import Optional
+
+import bytecode
+
+from . import __version__
+
+CODE_CACHE_ENV = "AXOLOTL_CODE_CACHE"   # cache directory; empty disables the cache
+
+class InstrumentedCodeCache:
+    """
+    On-disk cache of instrumented module code objects, similar to __pycache__.
+
+    One entry per source file, named after the source path and the interpreter
+    cache tag. An entry is a fixed header followed by the marshalled code:
+
+        magic | python magic | sha1(axolotl version, bytecode version, options)[:16]
+              | source mtime_ns | source size | instrumentation cost (float)
+
+    Validation reads the header and compares it against a stat() of the source,
+    so a hit costs one stat, one small read and marshal.loads.
+    """
+    MAGIC = b'AXLC'
+    _KEY = struct.Struct('<4s4s16sQQ')
+    _COST = struct.Struct('<d')
+
+    def __init__(self, cache_dir: str, options: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.options = options
+        digest = f"{__version__}|{bytecode.__version__}|{options}".encode()
+        self._fingerprint = hashlib.sha1(digest).digest()[:16]
+
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+        self.instrument_time = 0.0
+        self.saved_time = 0.0
+
+    @classmethod
+    def from_env(cls, sci) -> Optional["InstrumentedCodeCache"]:
+        cache_dir = os.getenv(CODE_CACHE_ENV)
+        if not cache_dir:
+            return None
+        try:
+            return cls(cache_dir, sci.cache_key())
+        except OSError:
+            return None
+
+    def entry_path(self, origin: Path) -> Path:
+        name = hashlib.sha1(str(origin).encode()).hexdigest()
+        return self.cache_dir / f"{origin.stem}.{name[:16]}.{sys.implementation.cache_tag}.axl"
+
+    def _key(self, st: os.stat_result) -> bytes:
+        return self._KEY.pack(self.MAGIC, importlib.util.MAGIC_NUMBER, self._fingerprint,
+                              st.st_mtime_ns, st.st_size)
+
+    def is_fresh(self, origin: Path) -> bool:
+        """True if the entry for `origin` is valid (header check only, the code is not loaded)."""
+        try:
+            key = self._key(os.stat(origin))
+            with open(self.entry_path(origin), 'rb') as f:
+                return f.read(self._KEY.size) == key
+        except OSError:
+            return False
+
+    def load(self, origin: Path) -> Optional[CodeType]:
+        start = time.perf_counter()
+        try:
+            key = self._key(os.stat(origin))
+            with open(self.entry_path(origin), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+
+        header_size = self._KEY.size + self._COST.size
+        if data[:self._KEY.size] != key:
+            self.misses += 1
+            return None
+        try:
+            code = marshal.loads(data[header_size:])
+        except (EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+
+        cost, = self._COST.unpack_from(data, self._KEY.size)
+        self.hits += 1
+        self.saved_time += cost
+        self.load_time += time.perf_counter() - start
+        return code
+
+    def store(self, origin: Path, code: CodeType, cost: float = 0.0, st: os.stat_result = None):
+        """Write an entry atomically (temp file + rename). `st` is the stat taken before compiling."""
+        self.instrument_time += cost
+        try:
+            if st is None:
+                st = os.stat(origin)
+            payload = self._key(st) + self._COST.pack(cost) + marshal.dumps(code)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.entry_path(origin))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (OSError, ValueError):
+            pass
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "load_time": self.load_time,
+            "instrument_time": self.instrument_time,
+            # instrumentation time recorded in the hit entries minus the time spent loading them
+            "startup_time_saved": max(self.saved_time - self.load_time, 0.0),
+        }
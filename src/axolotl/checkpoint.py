@@ -1,13 +1,40 @@
-import subprocess
-import shutil
 import os
+import mmap
 import time
+import signal
 import psutil
+from typing import Optional
 
 import axolotl.mode as mc
+import axolotl.patch as pc
+from .events import SupervisorEvents, wait_until_stopped, EXIT, HINT, DUMP, MODE, RESUMED
+from .scheduler import CheckpointScheduler
+from .retention import CheckpointChain
+from .imagestore import ImageStore
+from .metrics import CheckpointMetrics
+from .snapshot import get_snapshot_backend, reap_children, SnapshotError, RESTORE_TIMEOUT
 from .validation import Validater
+from .monitoring import BACKEND_ENV, PATCH_SIGNAL
 from .logger import get_logger, get_reporter
 
+# supervisor states (Checkpoint.state)
+RUNNING = 'running'                 # safe mode, next checkpoint on a timer
+CHECKPOINTING = 'checkpointing'     # safe mode, a dump in flight
+REPAIRING = 'repairing'             # the target is repairing an exception (mode -1)
+VALIDATED = 'validated'             # a patch passed validation (mode 1), the target finishes or resumes in place
+RESTORING = 'restoring'             # restoring the latest checkpoint with the patches published
+DONE = 'done'
+
+class PendingDump:
+    """A snapshot being taken in the background (see Checkpoint.store_checkpoint)."""
+    def __init__(self, handle, proc: psutil.Process, num: int, parent, images_dir: str):
+        self.handle = handle        # what SnapshotBackend.dump returned
+        self.proc = proc
+        self.num = num
+        self.parent = parent
+        self.images_dir = images_dir
+        self.start = time.monotonic()
+
 class Checkpoint:
     def __init__(self, wdir):
         self.checkpoint_num=0
@@ -18,6 +45,8 @@ class Checkpoint:
         self.val = Validater()
         self.val_part1 = False
         self.val_part2_count = 0
+        # the last patch generation the supervisor published (a newer one was the target's)
+        self.patch_generation = 0
         self.mutate_num = 0
         self.wdir = wdir
 
@@ -26,80 +55,203 @@ class Checkpoint:
         self.logger = get_logger()
         self.reporter = get_reporter()
 
-    def store_checkpoint(self, proc:psutil.Process, file_path:str):
+        # criu, or fork snapshots of the target
+        self.backend = get_snapshot_backend(self.wdir, self.main_pid)
+
+        # mode changes and target exits wake the supervisor loop
+        self.events = SupervisorEvents()
+        self.events.export()
+        # when the next safe-mode checkpoint is due
+        self.scheduler = CheckpointScheduler.from_env()
+        # where the images of each checkpoint live
+        self.store = ImageStore.from_env(f'{self.wdir}/checkpoints{self.restore_num}', self.backend.movable_images)
+        # which checkpoints are kept, and which dumps are full ones
+        self.chain = CheckpointChain.from_env(self.store, self.backend.discard)
+        # per-dump and per-restore measurements, WDIR/log/checkpoint_events.jsonl
+        self.metrics = CheckpointMetrics(os.path.join(self.wdir, 'log'))
+        # the dump in flight, if any
+        self.dump = None
+        self.state = RUNNING
+        self.exited = False
+
+    def store_checkpoint(self, proc:psutil.Process):
+        """
+        Start an incremental checkpoint of `proc` in the background.
+
+        Only one dump is in flight at a time. criu_loop keeps reacting to mode
+        changes while it runs and calls dump_finished, which commits the
+        checkpoint index, once the snapshot backend reports it done.
+        """
+        if self.dump is not None:
+            return
         if self.restore_occur == True:
              self.checkpoint_num = 0
              self.restore_occur = False
         
         if self.checkpoint_num == 0:
-            shutil.rmtree(file_path, ignore_errors=True)
-            os.makedirs(file_path, exist_ok=True)
-
-        os.makedirs(f'{file_path}/{self.checkpoint_num}', exist_ok=True)
-
-        cmd = ['criu', 'dump','--tree',str(proc.pid),
-               '--images-dir',f'{file_path}/{self.checkpoint_num}',
-               '--leave-running', '--track-mem','--shell-job','-v1','--tcp-established']
+            self.store.reset()
+            self.chain.reset()
 
-        cmd.append('--external')
-        cmd.append(f'/proc/{self.main_pid}/ns/time')
+        images_dir = self.store.create(self.checkpoint_num)
+        parent = self.chain.parent_for(self.checkpoint_num) if self.backend.incremental else None
 
-        if self.checkpoint_num != 0:
-            cmd.append('--prev-images-dir')
-            cmd.append(f'../{self.checkpoint_num-1}')
-
-        self.logger.info(f'[CRIU] Checkpointing {self.checkpoint_num} checkpoint for process {proc.pid}...')
-        res=subprocess.run(cmd)
-        if res.returncode != 0:
-            self.logger.error(f'[CRIU] Checkpoint error: {res.stdout.decode()}')
+        self.logger.info(f'[CRIU] Checkpointing {self.checkpoint_num} checkpoint for process {proc.pid}'
+                         f'{" (full dump)" if parent is None and self.backend.incremental else ""}...')
+        # until dump_finished / cancel_dump: the parent chain stays where the dump reads it
+        self.store.begin_dump()
+        try:
+            handle = self.backend.dump(proc, images_dir,
+                                       self.store.parent_link(self.checkpoint_num, parent) if parent is not None else None)
+        except (OSError, SnapshotError) as e:
+            self.store.end_dump()
+            self.logger.error(f'[CRIU] Checkpoint error: {e}')
             proc.kill()
             exit(1)
+        self.dump = PendingDump(handle, proc, self.checkpoint_num, parent, images_dir)
+        if handle is not None:
+            self.events.watch(handle.pid, DUMP)
+
+    def dump_finished(self):
+        """Completion of the in-flight dump: commit the checkpoint index."""
+        dump = self.dump
+        if dump is None:
+            return
+        done = self.backend.dump_done(dump.handle, dump.images_dir)
+        if done is None:
+            return
+        self.dump = None
+        self.events.unwatch(DUMP)
+        self.store.end_dump()
+        wall_time = time.monotonic() - dump.start
+        if not done:
+            self.metrics.emit("dump_failed", num=dump.num, wall_time=wall_time)
+            if not dump.proc.is_running() or dump.proc.status() == psutil.STATUS_ZOMBIE:
+                # the target exited during the dump
+                self.backend.discard(dump.images_dir)
+                return
+            self.logger.error(f'[CRIU] Checkpoint error: {self.backend.name} dump of {dump.num} failed')
+            dump.proc.kill()
+            exit(1)
+        nbytes = self.backend.dumped_bytes(dump.images_dir)
+        stats = self.backend.dump_stats(dump.images_dir)
+        self.scheduler.record(wall_time, nbytes)
+        self.chain.add(dump.num, dump.parent)
+        self.metrics.emit("dump", num=dump.num, parent=dump.parent, wall_time=wall_time,
+                          frozen_time=stats.get("frozen_time"),
+                          pages_written=stats.get("pages_written",
+                                                  nbytes // mmap.PAGESIZE if nbytes is not None else None),
+                          pages_skipped=stats.get("pages_skipped_parent"),
+                          image_bytes=self.chain.sizes.get(dump.num), chain_depth=self.chain.depth(dump.num))
+        if self.reporter:
+            self.reporter.set_result("checkpoint_schedule", self.scheduler.stats())
+            self.reporter.set_result("checkpoint_chain", self.chain.stats())
+            self.reporter.set_result("checkpoint_images", self.store.stats())
+            self.reporter.record_checkpoints(self.metrics.summary())
         
-        self.logger.info(f'[CRIU] Checkpoint {self.checkpoint_num} for process {proc.pid} stored successfully.')
-        self.checkpoint_num+=1
-
-
-    def restore_checkpoint(self, file_path:str):        
-        cmd=['criu','restore','-v1','--shell-job','-D',f'{file_path}',
-             '--tcp-established'
-            ]
-
-        cmd.append('-J')
-        cmd.append(f'time:/proc/{self.main_pid}/ns/time')
+        self.logger.info(f'[CRIU] Checkpoint {dump.num} for process {dump.proc.pid} stored successfully '
+                         f'({wall_time:.3f}s).')
+        self.checkpoint_num = dump.num + 1
+
+    def cancel_dump(self, reason: str):
+        """
+        Abort the in-flight dump and discard its images: a checkpoint finished
+        after repair started could already hold the failing state.
+        """
+        dump, self.dump = self.dump, None
+        self.events.unwatch(DUMP)
+        if dump is None:
+            return
+        self.backend.cancel(dump.handle, dump.proc, dump.images_dir)
+        self.store.end_dump()
+        self.metrics.emit("dump_cancelled", num=dump.num, reason=reason, wall_time=time.monotonic() - dump.start)
+        self.logger.info(f'[CRIU] Checkpoint {dump.num} cancelled ({reason})')
+
+    def restore_checkpoint(self, file_path:str) -> Optional[psutil.Process]:
+        """Bring the checkpoint at `file_path` back and resume it; the restored target, None if that failed."""
+        # the target comes back stopped; sys.monitoring targets are then
+        # signalled to install the published patches (they have no per-call
+        # patch check) before they continue
+        notify_patch = os.getenv(BACKEND_ENV) == 'monitoring'
 
         self.logger.info(f'[CRIU] Restoring checkpoint {self.validate_checkpoint_num}...')
 
-        proc = subprocess.Popen(cmd)
-        if mc.mode_check() == '0':
-            time.sleep(1.0)
-
-        self.logger.info('[CRIU] Restore Success, Program Continue\n')
-
-        restored_pid = None
-        for child in psutil.Process(proc.pid).children():
-            restored_pid = child.pid
-            break
-
+        start = time.monotonic()
+        # the chain stays where it is (its pages unpacked) until the restore has read it
+        try:
+            with self.store.unpacked(file_path):
+                unpacked = time.monotonic()
+                restored_pid = self.backend.restore(file_path)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            # page data that can't be rebuilt: a chunk gone, a manifest or codec this run can't read
+            self.metrics.emit("restore_failed", num=self.validate_checkpoint_num,
+                              unpack_time=time.monotonic() - start)
+            self.logger.error(f'[CRIU] Restore of {file_path} failed: {e}')
+            return None
+        restored = time.monotonic()
+        timings = {"num": self.validate_checkpoint_num, "unpack_time": unpacked - start,
+                   "restore_time": restored - unpacked}
         if restored_pid is None:
-            self.criu_loop(psutil.Process(proc.pid))
-        else:
-            self.criu_loop(psutil.Process(restored_pid))
+            self.metrics.emit("restore_failed", **timings)
+            self.logger.error(f'[CRIU] Restore of {file_path} failed')
+            return None
+        if not wait_until_stopped(restored_pid, RESTORE_TIMEOUT):
+            self.logger.warning(f'[CRIU] Restored process {restored_pid} did not report a finished restore')
 
+        self.logger.info('[CRIU] Restore Success, Program Continue\n')
 
+        try:
+            proc = psutil.Process(restored_pid)
+            if notify_patch:
+                os.kill(restored_pid, PATCH_SIGNAL)
+            os.kill(restored_pid, signal.SIGCONT)
+        except (ProcessLookupError, psutil.NoSuchProcess):
+            self.metrics.emit("restore_failed", **timings)
+            self.logger.error(f'[CRIU] Restored process {restored_pid} is gone')
+            return None
+        self.metrics.emit("restore", **timings, resume_time=time.monotonic() - restored,
+                          **{f'criu_{k}': v for k, v in self.backend.restore_stats(file_path).items()})
+        if self.reporter:
+            self.reporter.record_checkpoints(self.metrics.summary())
+        return proc
+
+    def close(self):
+        """End of the run: release the kept snapshots (fork snapshots are paused processes)."""
+        self.backend.close([self.store.path(num) for num in self.chain.parents])
+        self.store.close()
+        if self.reporter:
+            # dedup and compression of what close() packed
+            self.reporter.set_result("checkpoint_images", self.store.stats())
+            self.reporter.record_checkpoints(self.metrics.summary())
 
 # validation_mode(1)
 # validation_fail_mode(2) 
 # safe mode(0)
 # repair mode(-1)
     def criu_loop(self, proc:psutil.Process):
-        # crash_recorded = False
-        while True:
-            try:
-                state = proc.is_running()
-            except:
-                pass
-        
+        """
+        Supervise the target until it finishes, across any number of repair
+        cycles.
+
+        A state machine (see the states above Checkpoint) driven by the mode
+        the target publishes and by SupervisorEvents: the target pushes every
+        mode change and checkpoint hint, its exit and the end of a background
+        dump are reported by pidfds, and in RUNNING the next checkpoint is a
+        timer set by the CheckpointScheduler. Nothing is polled in the other
+        states. A dump still running when the target leaves safe mode is
+        cancelled, unless no checkpoint has been committed yet. A validated patch restores the latest checkpoint and the
+        loop carries on with the restored target: one frame and one
+        psutil.Process however many cycles a long-lived service goes through.
+        """
+        self.state = RUNNING
+        self._attach(proc)
+
+        while self.state != DONE:
             mode = mc.mode_check()
+            if self.dump is not None and self.exited:
+                self.cancel_dump('process exited')
+            elif self.dump is not None and mode != '0' and self.chain.parents:
+                # with no checkpoint committed yet the dump is kept: it is the only restore point
+                self.cancel_dump(f'mode {mode}')
 
             if mode == '2':      # validation fail 
                 try:
@@ -123,16 +275,30 @@ class Checkpoint:
                     self.reporter.save_report()
 
                 self.logger.info('Test Done')
-                break
+                self.state = DONE
+
+            elif mode == '1' and not self.exited:
+                # the validated target finishes on its own
+                self.state = VALIDATED
+
+            elif mode == '1' and self.checkpoint_num == 0:
+                # validated before any checkpoint was committed: nothing to restore
+                self.val_part1 = True
+                self.logger.error('Validation complete, but no checkpoint was stored to restore with the patch')
+                if self.reporter:
+                    self.reporter.set_result("status", "no_checkpoint")
+                    self.reporter.save_report()
+                self.state = DONE
 
-            elif mode == '1': 
-                if proc:
-                    proc.wait()
+            elif mode == '1':
+                self.state = RESTORING
                 self.val_part1 = True
                 self.validate_checkpoint_num = self.checkpoint_num-1
                 # self.validate_checkpoint_num += 1
 
                 self.logger.info(f'Validation complete! Returning to safe mode')
+                generation = self.patch_generation = pc.publish_patches(self.wdir)
+                self.logger.info(f'[Patch] Published patch generation {generation}')
                 mc.safe_mode()
                 if self.reporter:
                     # self.reporter.end_validation_timer(part=2)
@@ -140,45 +306,106 @@ class Checkpoint:
                     self.reporter.start_after_validate_timer()
                     self.reporter.save_report()
 
-                self.restore_checkpoint(f'{self.wdir}/checkpoints{self.restore_num}/{self.validate_checkpoint_num}')
-                # self.restore_checkpoint(f'{self.wdir}/checkpoints{self.restore_num}/{self.checkpoint_num-1}') 
-                break
+                reap_children()
+                proc = self.restore_checkpoint(self.store.path(self.validate_checkpoint_num))
+                if proc is None:
+                    self.state = DONE
+                    continue
+                self.state = RUNNING
+                self._attach(proc)
+                continue
+
+            elif self.exited:
+                # the target is gone without a validation verdict
+                self.logger.info(f"Process finished (mode {mode}).")
+                if self.reporter:
+                    self.reporter.end_after_validate_timer()
+                    self.reporter.save_report()
+                self.state = DONE
 
-            # reapir mode(-1)                
             elif mode == '-1':
-                time.sleep(1.)
-                continue
+                self.state = REPAIRING
+
+            elif self.dump is not None:
+                self.state = CHECKPOINTING
 
             # safe mode(0)
-            elif mode == '0':
-                try:
-                    state = proc.status()
-                    if state in ('running', 'sleeping', 'disk-sleep', 'tracing-stop'):
-                        self.store_checkpoint(proc,f'{self.wdir}/checkpoints{self.restore_num}')
-                    else:
-                        self.logger.debug(f'Process terminated. State: {state}')
-                        if self.reporter:
-                            self.reporter.end_after_validate_timer()
-                            self.reporter.save_report()
-                        break
-                except (psutil.NoSuchProcess, psutil.ZombieProcess):
-                    self.logger.info("Process finished (NoSuchProcess).")
-                    if self.reporter:
-                        self.reporter.end_after_validate_timer()
-                        self.reporter.save_report()
-                    break
-                except:
-                    self.logger.debug('subprocess state is NONE -> passing')
-                    pass
             else:
-                time.sleep(1.)
-                continue
+                self.state = RUNNING
+                if time.monotonic() >= self.scheduler.next_due():
+                    self._checkpoint(proc)
 
-            time.sleep(1.0)
+            if self.state == DONE:
+                break
+
+            # only RUNNING has a timer: the other states wait for events
+            timeout = max(self.scheduler.next_due() - time.monotonic(), 0) if self.state == RUNNING else None
+            events = self.events.wait(timeout)
+            if DUMP in events:
+                self.dump_finished()
+            if HINT in events:
+                self.scheduler.hint()
+            if EXIT in events:
+                self.exited = True
+            if RESUMED in events or MODE in events:
+                self._check_resumed()
         
+        if self.dump is not None:
+            # e.g. validation failed before the first checkpoint was committed
+            self.cancel_dump('supervision ended')
         self.logger.info("CRIU Loop Finished")
         try:
             proc.kill()
         except:
             pass
 
+    def _check_resumed(self):
+        """
+        A patch generation the supervisor didn't publish: the target retried
+        its repaired call and published the patch itself (--resume-in-place).
+        The RESUMED datagram only wakes the loop; the counter is the record.
+        """
+        generation = pc.patch_generation(self.wdir)
+        if generation > self.patch_generation:
+            self.patch_generation = generation
+            self._resumed_in_place()
+
+    def _resumed_in_place(self):
+        """The repair cycle ends without a restore: the target carries on in safe mode."""
+        self.val_part1 = True
+        self.logger.info('Validation complete! Resumed in place, no restore')
+        self.metrics.emit("resume_in_place")
+        if self.reporter:
+            self.reporter.set_result("status", "success")
+            self.reporter.start_after_validate_timer()
+            self.reporter.record_checkpoints(self.metrics.summary())
+            self.reporter.save_report()
+
+    def _attach(self, proc: psutil.Process):
+        """Supervise `proc` from now on (the first target, or a restored one)."""
+        self.exited = False
+        self.events.watch(proc.pid)
+        self.scheduler.reset()
+
+    def _checkpoint(self, proc: psutil.Process):
+        """RUNNING: take the checkpoint that is due (CHECKPOINTING), or notice the target is gone (DONE)."""
+        try:
+            state = proc.status()
+            if state in ('running', 'sleeping', 'disk-sleep', 'tracing-stop'):
+                self.store_checkpoint(proc)
+                self.state = CHECKPOINTING if self.dump is not None else RUNNING
+            else:
+                self.logger.debug(f'Process terminated. State: {state}')
+                if self.reporter:
+                    self.reporter.end_after_validate_timer()
+                    self.reporter.save_report()
+                self.state = DONE
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            self.logger.info("Process finished (NoSuchProcess).")
+            if self.reporter:
+                self.reporter.end_after_validate_timer()
+                self.reporter.save_report()
+            self.state = DONE
+        except:
+            self.logger.debug('subprocess state is NONE -> passing')
+            pass
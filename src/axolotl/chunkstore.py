@@ -0,0 +1,209 @@
+import os
+import json
+import zlib
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from .logger import get_logger
+
+CHUNK_STORE_ENV = "AXOLOTL_CHUNK_STORE"     # shared chunk directory; enables the stage
+CHUNK_CODEC_ENV = "AXOLOTL_CHUNK_CODEC"
+CHUNK_SIZE_ENV = "AXOLOTL_CHUNK_SIZE"
+
+CHUNK_CODECS = ('auto', 'zstd', 'lz4', 'zlib', 'none')
+DEFAULT_CHUNK_SIZE = 4 * 4096               # a few pages: small enough to share library pages
+MANIFEST_SUFFIX = '.chunks'                 # pages-N.img -> pages-N.img.chunks
+MANIFEST_VERSION = 1
+PARENT_LINK = 'parent'
+DIGEST_SIZE = 20
+
+# first byte of a stored chunk: how the rest is encoded
+_RAW, _ZLIB, _ZSTD, _LZ4 = b'r', b'z', b's', b'l'
+
+def available_codec(name: str = 'auto') -> str:
+    """`name` if its module is installed; 'auto' picks zstd, then lz4, then zlib."""
+    if name == 'auto':
+        return 'zstd' if zstandard is not None else 'lz4' if lz4 is not None else 'zlib'
+    if (name == 'zstd' and zstandard is None) or (name == 'lz4' and lz4 is None):
+        get_logger().warning(f"[Chunks] {name} is not installed, compressing with zlib")
+        return 'zlib'
+    return name
+
+class ChunkStore:
+    """
+    Content-addressed storage for the page data of checkpoint images.
+
+    pack() splits every pages-*.img of an images directory into `chunk_size`
+    pieces, stores each distinct piece once under `root` (named by its
+    BLAKE2b digest, compressed with zstd, lz4 or zlib) and replaces the file
+    with a manifest of digests. The store can be shared by all runs on a
+    host: the pages of the interpreter and of the libraries a target loads
+    are the same every time, and so are most pages of consecutive
+    checkpoints. unpack() rebuilds the files before a restore reads them.
+
+    Only page data is chunked; the other images are small. Chunks are never
+    deleted: remove the directory to reclaim the space.
+    """
+    def __init__(self, root: str, codec: str = 'auto', chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.root = root
+        self.codec = available_codec(codec)
+        self.chunk_size = chunk_size
+        self.logger = get_logger()
+        self._lock = threading.Lock()
+        self.logical_bytes = 0      # page data packed
+        self.new_bytes = 0          # of which not in the store yet
+        self.stored_bytes = 0       # what the new chunks take after compression
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ChunkStore"]:
+        root = os.getenv(CHUNK_STORE_ENV)
+        if not root:
+            return None
+        return cls(root, os.getenv(CHUNK_CODEC_ENV, 'auto'), int(os.getenv(CHUNK_SIZE_ENV, DEFAULT_CHUNK_SIZE)))
+
+    def pack(self, images_dir: str):
+        """Move the page data of `images_dir` into the store."""
+        for pages in sorted(Path(images_dir).glob('pages-*.img')):
+            digests = bytearray()
+            size = 0
+            with open(pages, 'rb') as f:
+                while True:
+                    data = f.read(self.chunk_size)
+                    if not data:
+                        break
+                    digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+                    self._put(digest.hex(), data)
+                    digests += digest
+                    size += len(data)
+            manifest = f'{pages}{MANIFEST_SUFFIX}'
+            header = {"version": MANIFEST_VERSION, "size": size, "chunk_size": self.chunk_size,
+                      "digest_size": DIGEST_SIZE}
+            with open(f'{manifest}.tmp', 'wb') as f:
+                f.write(json.dumps(header).encode() + b'\n')
+                f.write(digests)
+            os.replace(f'{manifest}.tmp', manifest)
+            os.remove(pages)
+            with self._lock:
+                self.logical_bytes += size
+
+    def unpack(self, images_dir: str):
+        """Rebuild the pages-*.img files of `images_dir` from its manifests."""
+        for manifest in sorted(Path(images_dir).glob(f'pages-*.img{MANIFEST_SUFFIX}')):
+            pages = str(manifest)[:-len(MANIFEST_SUFFIX)]
+            if os.path.exists(pages):
+                continue
+            with open(manifest, 'rb') as f:
+                header = json.loads(f.readline())
+                if header.get("version") != MANIFEST_VERSION:
+                    raise ValueError(f"unsupported chunk manifest version in {manifest}")
+                digests = f.read()
+            step = header["digest_size"]
+            try:
+                with open(f'{pages}.tmp', 'wb') as out:
+                    for i in range(0, len(digests), step):
+                        out.write(self._get(digests[i:i + step].hex()))
+            except BaseException:
+                try:
+                    os.remove(f'{pages}.tmp')
+                except OSError:
+                    pass
+                raise
+            os.replace(f'{pages}.tmp', pages)
+
+    def unpack_chain(self, images_dir: str) -> List[str]:
+        """
+        unpack() an images directory and every parent an incremental restore
+        reads; the directories. If one can't be rebuilt (a chunk is missing,
+        a codec isn't installed) the pages rebuilt so far are dropped again.
+        """
+        chain = []
+        path = os.path.realpath(images_dir)
+        try:
+            while path not in chain and os.path.isdir(path):
+                chain.append(path)
+                self.unpack(path)
+                parent = os.path.join(path, PARENT_LINK)
+                if not os.path.islink(parent):
+                    break
+                path = os.path.realpath(parent)
+        except BaseException:
+            for path in chain:
+                self.drop_unpacked(path)
+            raise
+        return chain
+
+    def drop_unpacked(self, images_dir: str):
+        """Remove the pages files unpack() rebuilt (their manifests stay)."""
+        for manifest in Path(images_dir).glob(f'pages-*.img{MANIFEST_SUFFIX}'):
+            try:
+                os.remove(str(manifest)[:-len(MANIFEST_SUFFIX)])
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            logical, new, stored = self.logical_bytes, self.new_bytes, self.stored_bytes
+        return {"chunk_store": self.root, "codec": self.codec, "logical_bytes": logical,
+                "stored_bytes": stored,
+                "dedup_ratio": logical / new if new else None,
+                "compression_ratio": new / stored if stored else None}
+
+    def _chunk_path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name[2:])
+
+    def _put(self, name: str, data: bytes):
+        path = self._chunk_path(name)
+        if os.path.exists(path):
+            return
+        encoded = self._encode(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # other runs may write the same chunk: publish it atomically
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(encoded)
+        os.replace(tmp, path)
+        with self._lock:
+            self.new_bytes += len(data)
+            self.stored_bytes += len(encoded)
+
+    def _get(self, name: str) -> bytes:
+        with open(self._chunk_path(name), 'rb') as f:
+            encoded = f.read()
+        tag, payload = encoded[:1], encoded[1:]
+        if tag == _RAW:
+            return payload
+        if tag == _ZLIB:
+            return zlib.decompress(payload)
+        if tag == _ZSTD:
+            if zstandard is None:
+                raise RuntimeError(f"chunk {name} is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        if tag == _LZ4:
+            if lz4 is None:
+                raise RuntimeError(f"chunk {name} is lz4-compressed but lz4 is not installed")
+            return lz4.frame.decompress(payload)
+        raise ValueError(f"unknown encoding of chunk {name}")
+
+    def _encode(self, data: bytes) -> bytes:
+        if self.codec == 'zstd':
+            tag, payload = _ZSTD, zstandard.ZstdCompressor(level=3).compress(data)
+        elif self.codec == 'lz4':
+            tag, payload = _LZ4, lz4.frame.compress(data)
+        elif self.codec == 'zlib':
+            tag, payload = _ZLIB, zlib.compress(data, 1)
+        else:
+            return _RAW + data
+        # incompressible pages are kept as they are
+        return tag + payload if len(payload) < len(data) else _RAW + data
@@ -0,0 +1,133 @@
+import os
+import time
+import socket
+import selectors
+from typing import Dict, Optional, Set, Tuple
+
+import psutil
+
+# abstract UNIX datagram socket the supervisor listens on, passed to the target
+EVENT_SOCKET_ENV = "AXOLOTL_EVENT_SOCKET"
+# without pidfd_open (Python < 3.9 / Linux < 5.3) process exits are polled
+EXIT_POLL_INTERVAL = 0.05
+
+# event names returned by SupervisorEvents.wait
+MODE = 'mode'               # the target changed the process mode
+HINT = 'checkpoint'         # the target asks for a checkpoint (checkpoint_hint)
+EXIT = 'exit'               # the target exited
+DUMP = 'dump'               # the in-flight snapshot finished
+RESUMED = 'resumed'         # the target published a patch itself and carries on (--resume-in-place)
+_DATAGRAMS = {MODE, HINT, DUMP, RESUMED}    # DUMP: a fork snapshot reports itself
+_SOCKET = 'socket'
+
+def notify(event: str):
+    """
+    Wake the supervisor (target side). Fire and forget: the shared state (e.g.
+    the mode word) stays the source of truth, the datagram only says "look".
+
+    No socket is kept open, so there is nothing for CRIU to dump.
+    """
+    address = os.getenv(EVENT_SOCKET_ENV)
+    if not address:
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(event.encode(), '\0' + address)
+    except OSError:
+        pass
+
+def checkpoint_hint():
+    """
+    Tell the supervisor this is a good moment for a checkpoint, e.g. between
+    two requests: the state is consistent and no work is half done. Cheap
+    enough to call on every request; the supervisor rate limits the dumps.
+    """
+    notify(HINT)
+
+class SupervisorEvents:
+    """
+    What the supervisor loop sleeps on: datagrams from the target (mode
+    changes, checkpoint hints) and the exit of watched processes - the target
+    and an in-flight `criu dump` - through a pidfd, or polling where
+    pidfd_open is missing. Timers are the caller's wait() timeouts.
+    """
+    def __init__(self, address: Optional[str] = None):
+        self.address = address or f"axolotl-{os.getpid()}"
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind('\0' + self.address)
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ, _SOCKET)
+        self._watched: Dict[str, Tuple[int, Optional[int]]] = {}    # event -> (pid, pidfd)
+
+    def export(self):
+        """Make targets started from now on report to this supervisor."""
+        os.environ[EVENT_SOCKET_ENV] = self.address
+
+    def watch(self, pid: int, event: str = EXIT):
+        """Report the exit of `pid` as `event` (replaces the process previously watched for it)."""
+        self.unwatch(event)
+        pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                # already gone, or no pidfd support in the kernel: polled instead
+                pass
+            else:
+                self.selector.register(pidfd, selectors.EVENT_READ, event)
+        self._watched[event] = (pid, pidfd)
+
+    def unwatch(self, event: str):
+        _, pidfd = self._watched.pop(event, (None, None))
+        if pidfd is not None:
+            self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Block until something happens or `timeout` (seconds, None = forever) passes; empty set on timeout."""
+        polled = {event: pid for event, (pid, pidfd) in self._watched.items() if pidfd is None}
+        if polled:
+            timeout = EXIT_POLL_INTERVAL if timeout is None else min(timeout, EXIT_POLL_INTERVAL)
+        events = {key.data for key, _ in self.selector.select(max(timeout, 0) if timeout is not None else None)}
+        if _SOCKET in events:
+            events.discard(_SOCKET)
+            events.update(self._drain())
+        events.update(event for event, pid in polled.items() if not self._alive(pid))
+        return events
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    def _drain(self) -> Set[str]:
+        received = set()
+        while True:
+            try:
+                event = self.sock.recv(64).decode(errors='replace')
+            except (BlockingIOError, InterruptedError):
+                return received
+            if event in _DATAGRAMS:
+                received.add(event)
+
+    def close(self):
+        for event in list(self._watched):
+            self.unwatch(event)
+        self.selector.close()
+        self.sock.close()
+
+def wait_until_stopped(pid: int, timeout: float, interval: float = 0.005) -> bool:
+    """Wait for a process restored with `criu restore --leave-stopped` to be fully restored (stopped)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if psutil.Process(pid).status() == psutil.STATUS_STOPPED:
+                return True
+        except psutil.NoSuchProcess:
+            return False
+        time.sleep(interval)
+    return False
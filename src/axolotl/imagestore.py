@@ -0,0 +1,242 @@
+import os
+import queue
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+from .chunkstore import ChunkStore
+from .logger import get_logger
+
+HOT_DIR_ENV = "AXOLOTL_IMAGE_HOT_DIR"
+HOT_KEEP_ENV = "AXOLOTL_IMAGE_HOT_KEEP"
+
+DEFAULT_HOT_KEEP = 2            # newest checkpoints kept in the hot tier
+PARENT_LINK = 'parent'          # CRIU's link from an incremental dump to its parent's images
+
+class ImageStore:
+    """
+    Where the images of checkpoint `num` live: WDIR/checkpoints<N>/<num>, or
+    with a hot tier (`--image-hot-dir /dev/shm`) in a memory-backed directory
+    first.
+
+    New dumps are written to the hot tier; once a checkpoint is no longer
+    among the `hot_keep` newest, a background thread moves it to WDIR. An
+    incremental dump refers to its parent through a `parent` symlink, kept
+    relative (`../<num>`) while both are in the same tier and absolute
+    across tiers; moving a checkpoint rewrites its own link and its
+    children's, so `--prev-images-dir` chains resolve across tiers.
+
+    With a ChunkStore (`--chunk-store DIR`) the same thread also moves the
+    page data of the checkpoints off the newest chain into it, before moving
+    them out of the hot tier: an incremental dump reads the pages of its
+    whole parent chain, so those stay in place until a full dump starts a
+    new chain (and at close()). Restores read a chain through unpacked().
+
+    The newest checkpoint, the parent of the next dump, is never moved.
+    Anything that reads or deletes a chain (restores, pruning, a dump in
+    flight, between begin_dump() and end_dump()) holds `lock`, which keeps
+    the mover off it.
+
+    Snapshot backends whose images refer to their own location (fork
+    snapshots) get a single tier and no chunk store.
+    """
+    def __init__(self, root: str, hot_root: Optional[str] = None, hot_keep: int = DEFAULT_HOT_KEEP,
+                 chunks: Optional[ChunkStore] = None):
+        self.root = root
+        self.hot_root = hot_root
+        self.hot_keep = max(hot_keep, 1)
+        self.chunks = chunks
+        self.lock = threading.RLock()
+        self.spilled = 0
+        self.logger = get_logger()
+        self._packed = set()        # checkpoints queued for the chunk store
+        self._queue = None
+        if hot_root is not None or chunks is not None:
+            self._queue = queue.Queue()
+            threading.Thread(target=self._spill_worker, name='axolotl-image-spill', daemon=True).start()
+
+    @classmethod
+    def from_env(cls, root: str, tiered: bool = True) -> "ImageStore":
+        hot_dir = os.getenv(HOT_DIR_ENV)
+        hot_root = None
+        if hot_dir and tiered:
+            # one directory per supervisor: several runs can share /dev/shm
+            hot_root = os.path.join(hot_dir, f'axolotl-{os.getpid()}', os.path.basename(root))
+        return cls(root, hot_root, int(os.getenv(HOT_KEEP_ENV, DEFAULT_HOT_KEEP)),
+                   ChunkStore.from_env() if tiered else None)
+
+    def reset(self):
+        """Start over with no checkpoints."""
+        with self.lock:
+            self._packed.clear()
+            for tier in self._tiers():
+                shutil.rmtree(tier, ignore_errors=True)
+                os.makedirs(tier, exist_ok=True)
+
+    def path(self, num: int) -> str:
+        """The images directory of checkpoint `num`, in whichever tier it is."""
+        if self.hot_root is not None:
+            hot = os.path.join(self.hot_root, str(num))
+            if os.path.isdir(hot):
+                return hot
+        return os.path.join(self.root, str(num))
+
+    def create(self, num: int) -> str:
+        """An empty images directory for a new dump, in the hot tier if there is one."""
+        path = os.path.join(self.hot_root if self.hot_root is not None else self.root, str(num))
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def parent_link(self, num: int, parent: int) -> str:
+        """The `--prev-images-dir` of dump `num` on top of `parent`."""
+        return self._link_target(os.path.join(self.hot_root or self.root, str(num)), parent)
+
+    def committed(self, nums: List[int]):
+        """After a dump: `nums` are the kept checkpoints; the older ones leave the hot tier and are packed."""
+        if self._queue is None:
+            return
+        nums = sorted(nums)
+        spill = set(nums[:-self.hot_keep]) if self.hot_root is not None else set()
+        live = self._chain(nums[-1]) if nums else set()
+        for num in nums[:-1]:
+            pack = self.chunks is not None and num not in self._packed and num not in live
+            if pack or (num in spill and os.path.isdir(os.path.join(self.hot_root, str(num)))):
+                if pack:
+                    self._packed.add(num)
+                self._queue.put((num, pack, num in spill))
+
+    def begin_dump(self):
+        """
+        A dump is starting: hold `lock` until end_dump(), so no checkpoint of
+        its parent chain is moved or packed while CRIU reads it (the dump runs
+        in the background, across supervisor loop iterations).
+        """
+        self.lock.acquire()
+
+    def end_dump(self):
+        """The dump started by begin_dump() finished or was cancelled."""
+        self.lock.release()
+
+    @contextmanager
+    def unpacked(self, images_dir: str):
+        """Hold `lock` with the page data of `images_dir` and its parents back in place."""
+        with self.lock:
+            if self.chunks is None:
+                yield
+                return
+            dirs = self.chunks.unpack_chain(images_dir)
+            try:
+                yield
+            finally:
+                for path in dirs:
+                    self.chunks.drop_unpacked(path)
+
+    def flush(self):
+        """Wait for the moves queued so far."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        """End of the run: pack and move everything to WDIR, drop the hot tier."""
+        if self._queue is None:
+            return
+        self.flush()
+        with self.lock:
+            for tier in self._tiers():
+                for name in os.listdir(tier) if self.chunks is not None and os.path.isdir(tier) else []:
+                    if name.isdigit():
+                        self._pack(int(name))
+            if self.hot_root is None:
+                return
+            for name in sorted(os.listdir(self.hot_root), key=lambda n: int(n) if n.isdigit() else -1):
+                if name.isdigit():
+                    self._spill(int(name))
+            shutil.rmtree(os.path.dirname(self.hot_root), ignore_errors=True)
+
+    def stats(self) -> dict:
+        hot = len([n for n in os.listdir(self.hot_root) if n.isdigit()]) \
+            if self.hot_root is not None and os.path.isdir(self.hot_root) else 0
+        stats = {"hot_dir": self.hot_root, "hot_checkpoints": hot, "spilled": self.spilled}
+        if self.chunks is not None:
+            stats["chunks"] = self.chunks.stats()
+        return stats
+
+    def _tiers(self) -> List[str]:
+        return [self.root] + ([self.hot_root] if self.hot_root is not None else [])
+
+    def _tier_of(self, path: str) -> str:
+        return os.path.dirname(os.path.abspath(path))
+
+    def _link_target(self, child_dir: str, parent: int) -> str:
+        parent_dir = self.path(parent)
+        if self._tier_of(parent_dir) == self._tier_of(child_dir):
+            return f'../{parent}'
+        return os.path.abspath(parent_dir)
+
+    def _relink(self, child_dir: str, parent: int):
+        link = os.path.join(child_dir, PARENT_LINK)
+        tmp = f'{link}.tmp'
+        os.symlink(self._link_target(child_dir, parent), tmp)
+        os.replace(tmp, link)
+
+    def _spill_worker(self):
+        while True:
+            num, pack, spill = self._queue.get()
+            try:
+                with self.lock:
+                    # packed first: less to copy
+                    if pack:
+                        self._pack(num)
+                    if spill and os.path.isdir(os.path.join(self.hot_root, str(num))):
+                        self._spill(num)
+            except OSError as e:
+                self.logger.error(f'[Images] {"Packing" if pack else "Moving"} checkpoint {num} failed: {e}')
+            finally:
+                self._queue.task_done()
+
+    def _pack(self, num: int):
+        """Move the page data of checkpoint `num` to the chunk store (holding `lock`)."""
+        path = self.path(num)
+        if os.path.isdir(path):
+            self.chunks.pack(path)
+
+    def _spill(self, num: int):
+        """Move checkpoint `num` from the hot tier to WDIR (holding `lock`)."""
+        hot = os.path.join(self.hot_root, str(num))
+        cold = os.path.join(self.root, str(num))
+        tmp = f'{cold}.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.copytree(hot, tmp, symlinks=True)
+        shutil.rmtree(cold, ignore_errors=True)
+        os.rename(tmp, cold)
+        shutil.rmtree(hot)
+
+        # its own link and its children's, now that it changed tier
+        parent = self._parent_of(cold)
+        if parent is not None:
+            self._relink(cold, parent)
+        for tier in self._tiers():
+            for name in os.listdir(tier):
+                child = os.path.join(tier, name)
+                if name.isdigit() and self._parent_of(child) == num:
+                    self._relink(child, num)
+        self.spilled += 1
+        self.logger.debug(f'[Images] Moved checkpoint {num} to {self.root}')
+
+    def _chain(self, num: int) -> set:
+        """`num` and its parents, following the `parent` links."""
+        chain = set()
+        while num is not None and num not in chain:
+            chain.add(num)
+            num = self._parent_of(self.path(num))
+        return chain
+
+    @staticmethod
+    def _parent_of(images_dir: str) -> Optional[int]:
+        try:
+            name = os.path.basename(os.readlink(os.path.join(images_dir, PARENT_LINK)).rstrip('/'))
+        except OSError:
+            return None
+        return int(name) if name.isdigit() else None
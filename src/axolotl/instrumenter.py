@@ -1,19 +1,114 @@
 from types import CodeType
 from bytecode import Instr, Bytecode, Label, dump_bytecode, Compare, bytecode
+from bytecode import CellVar, CompilerFlags
 import sys
 import marshal
 import os
+import importlib
+
+from .lazy import is_stub_candidate, make_stub
 
 PYTHON_VERSION = sys.version_info[:2]
 EXCLUDED_FUNC_NAMES = ["print", "len", "range", "set", "lru_cache", "kwlist", "DOTALL"]
 
+# globals referenced by instrumented code -> runtime module they are bound to
+RUNTIME_GLOBALS = {
+    '__ax_mc': 'axolotl.mode',
+    '__ax_re': 'axolotl.repair',
+    '__ax_pc': 'axolotl.patch',
+    '__ax_lz': 'axolotl.lazy',
+    '__ax_tr': 'axolotl.triage',
+}
+
+def bind_runtime_globals(namespace: dict):
+    """Bind the axolotl runtime modules into the globals an instrumented module executes in."""
+    for name, module_name in RUNTIME_GLOBALS.items():
+        module = importlib.import_module(module_name)
+        namespace[name] = module
+
+# 3.11+ : exceptions are dispatched through the code object's exception table
+# (bytecode's TryBegin/TryEnd pseudo instructions) instead of SETUP_FINALLY blocks
+USE_EXCEPTION_TABLE = PYTHON_VERSION >= (3, 11)
+if USE_EXCEPTION_TABLE:
+    from bytecode import TryBegin, TryEnd
+# bumped whenever the emitted code changes: entries of older layouts miss in InstrumentedCodeCache
+INSTRUMENTATION_LAYOUT = 2
+_NO_PATCH_PROLOGUE = CompilerFlags.GENERATOR | CompilerFlags.COROUTINE | CompilerFlags.ASYNC_GENERATOR
+
+def _load_global(name: str, push_null: bool, lineno: int) -> Instr:
+    if USE_EXCEPTION_TABLE:
+        return Instr('LOAD_GLOBAL', (push_null, name), lineno=lineno)
+    return Instr('LOAD_GLOBAL', name, lineno=lineno)
+
+def _call(argc: int, lineno: int, kwnames: tuple = ()) -> list:
+    """Call the callable (and NULL/self) below `argc` pushed arguments (3.11+)."""
+    instrs = []
+    if kwnames:
+        if PYTHON_VERSION >= (3, 13):
+            return [Instr('LOAD_CONST', kwnames, lineno=lineno), Instr('CALL_KW', argc, lineno=lineno)]
+        instrs.append(Instr('KW_NAMES', kwnames, lineno=lineno))
+    if PYTHON_VERSION < (3, 12):
+        instrs.append(Instr('PRECALL', argc, lineno=lineno))
+    instrs.append(Instr('CALL', argc, lineno=lineno))
+    return instrs
+
+def _call_runtime(module: str, method: str, args: list, lineno: int) -> list:
+    """module.method(*args) for a runtime module global, result left on the stack (3.11+)."""
+    instrs = [_load_global(module, False, lineno)]
+    if PYTHON_VERSION >= (3, 12):
+        instrs.append(Instr('LOAD_ATTR', (True, method), lineno=lineno))
+    else:
+        instrs.append(Instr('LOAD_METHOD', method, lineno=lineno))
+    return instrs + args + _call(len(args), lineno)
+
+def _call_print(args: list, lineno: int) -> list:
+    """print(*args), result discarded (3.11+)."""
+    return [_load_global('print', True, lineno)] + args + _call(len(args), lineno) + [Instr('POP_TOP', lineno=lineno)]
+
+def _load_arg(code: CodeType, name: str, lineno: int) -> Instr:
+    # arguments captured by inner functions live in cells
+    if name in code.co_cellvars:
+        return Instr('LOAD_DEREF', CellVar(name), lineno=lineno)
+    return Instr('LOAD_FAST', name, lineno=lineno)
+
+def _pop_jump_if_false(label: Label, lineno: int) -> Instr:
+    # 3.11 has directional jumps; every jump emitted here is forward
+    if PYTHON_VERSION[:2] == (3, 11):
+        return Instr('POP_JUMP_FORWARD_IF_FALSE', label, lineno=lineno)
+    return Instr('POP_JUMP_IF_FALSE', label, lineno=lineno)
+
+def _pop_jump_if_true(label: Label, lineno: int) -> Instr:
+    if PYTHON_VERSION[:2] == (3, 11):
+        return Instr('POP_JUMP_FORWARD_IF_TRUE', label, lineno=lineno)
+    return Instr('POP_JUMP_IF_TRUE', label, lineno=lineno)
+
+def _load_attr(name: str, lineno: int) -> Instr:
+    if PYTHON_VERSION >= (3, 12):
+        return Instr('LOAD_ATTR', (False, name), lineno=lineno)
+    return Instr('LOAD_ATTR', name, lineno=lineno)
+
 class Instrumenter:
-    def __init__(self, is_script_mode: bool = False, throw_exception_when_error: bool = False):
+    def __init__(self, is_script_mode: bool = False, throw_exception_when_error: bool = False, plan=None,
+                 lazy: bool = False):
         self.is_script_mode = is_script_mode
         self.throw_exception_when_error = throw_exception_when_error
+        self.plan = plan                # InstrumentationPlan: functions left unwrapped (optional)
+        self.lazy = lazy                # module-level functions get stubs, instrumented on first call
         self.code_stack = []
 
+    def cache_key(self) -> str:
+        """Options that change the instrumented output (part of the code cache key)."""
+        # is_script_mode / throw_exception_when_error don't affect the output, so
+        # script and module runs (and `axolotl instrument`) share cache entries
+        plan = self.plan.digest() if self.plan is not None else ''
+        return f"layout={INSTRUMENTATION_LAYOUT};plan={plan};lazy={self.lazy}"
+
     def insert_try_except(self, code: CodeType):
+        if self.plan is not None and code.co_name != '<module>' and not self.plan.should_instrument(code):
+            return self._instrument_consts(code)
+        if USE_EXCEPTION_TABLE:
+            return self._insert_try_except_exctable(code, patch_prologue=True)
+
         bc = Bytecode.from_code(code)
         cur_lineno = code.co_firstlineno
 
@@ -26,37 +121,8 @@ class Instrumenter:
 
         new_bc = [Instr('LOAD_CONST', '__axolotl__', lineno=1)]
 
-        # import axolotl.mode as mc
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.mode', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'mode', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_mc', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
-
-        # import axolotl.repair as re
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.repair', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'repair', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_re', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
-
-        # import axolotl.patch as pc
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.patch', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'patch', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_pc', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
-
-        # import axolotl.validation as val
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.validation', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'validation', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_val', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
+        # axolotl runtime modules (__ax_mc, __ax_re, __ax_pc, __ax_lz, __ax_tr) are module globals
+        # bound once by bind_runtime_globals(), not imported on every call
 
         # 단일 script일떄
         if not is_global:
@@ -70,7 +136,7 @@ class Instrumenter:
             safe_mode_label = Label()
 
             patch_block = [
-                Instr("LOAD_FAST", "__ax_pc", lineno=cur_lineno),
+                Instr("LOAD_GLOBAL", "__ax_pc", lineno=cur_lineno),
                 Instr("LOAD_METHOD", "func_patch_exist", lineno=cur_lineno),
                 Instr("LOAD_CONST", func_name, lineno=cur_lineno),
                 Instr("CALL_METHOD", 1, lineno=cur_lineno),
@@ -78,7 +144,7 @@ class Instrumenter:
 
                 ## 여기부터 mutation_input 적용추가
                 # mode = mc.mode_check()
-                Instr("LOAD_FAST", "__ax_mc", lineno=cur_lineno),
+                Instr("LOAD_GLOBAL", "__ax_mc", lineno=cur_lineno),
                 Instr("LOAD_METHOD", "mode_check", lineno=cur_lineno),
                 Instr("CALL_METHOD", 0, lineno=cur_lineno),
                 Instr("STORE_FAST", "mode", lineno=cur_lineno),
@@ -91,7 +157,7 @@ class Instrumenter:
             ]
             patch_block.extend([
                 safe_mode_label,
-                Instr("LOAD_FAST", "__ax_pc", lineno=cur_lineno),
+                Instr("LOAD_GLOBAL", "__ax_pc", lineno=cur_lineno),
                 Instr("LOAD_METHOD", "patched_func", lineno=cur_lineno),
                 Instr("LOAD_CONST", func_name, lineno=cur_lineno),
                 Instr("CALL_METHOD", 1, lineno=cur_lineno),
@@ -102,11 +168,11 @@ class Instrumenter:
             ])
 
             for i in range(argcount):
-                patch_block.append(Instr("LOAD_FAST", arg[i], lineno=cur_lineno))
+                patch_block.append(_load_arg(code, arg[i], cur_lineno))
 
             if kwargscount > 0:
                 for i in range(kwargscount):
-                    patch_block.append(Instr("LOAD_FAST", kwargs[i], lineno=cur_lineno))
+                    patch_block.append(_load_arg(code, kwargs[i], cur_lineno))
                 patch_block.append(Instr("LOAD_CONST", kwargs, lineno=cur_lineno))
                 patch_block.append(Instr("CALL_FUNCTION_KW", argcount + kwargscount, lineno=cur_lineno))
             else:
@@ -118,8 +184,8 @@ class Instrumenter:
 
             except_block = []
             except_label = Label()
-            repair_mode_label = Label()
             except_reraise_label = Label()
+            resume_label = Label()
 
             # Entry try block
             new_bc.append(Instr('SETUP_FINALLY', except_label, lineno=cur_lineno))  # Declare try block
@@ -152,67 +218,23 @@ class Instrumenter:
                     Instr('JUMP_IF_NOT_EXC_MATCH', except_reraise_label, lineno=cur_lineno)
                 )
 
-            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+            # __ax_exc = value, keeping (tb, value, type) on the stack for RERAISE
+            except_block.append(Instr('ROT_TWO', lineno=cur_lineno))
+            except_block.append(Instr('DUP_TOP', lineno=cur_lineno))
             except_block.append(Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno))
-            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
-            
-            # mode = mc.mode_check()
-            except_block.append(Instr('LOAD_FAST', '__ax_mc', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_METHOD', 'mode_check', lineno=cur_lineno))
-            except_block.append(Instr('CALL_METHOD', 0, lineno=cur_lineno))
-            except_block.append(Instr('STORE_FAST', '_ex_mode', lineno=cur_lineno))
-
-
-            # safe_mode_label
-            """
-                print(f'Exception occur : {_sc_e}')
-                print('Mode checking...')
-
-                if mode == '0':
-                    print('Mode is safe mode, change to repair mode')
-                    mc.repair_mode()
-                    print('First patch generate')
-                    re.except_handler(_sc_e)           # repair에 validation파트 포함      
-                    exit(1)  
-            """
-
-            except_block.append(Instr('LOAD_GLOBAL', 'print', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_CONST', 'Exception occur', lineno=cur_lineno))
-            except_block.append(Instr('CALL_FUNCTION', 1, lineno=cur_lineno))
-            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
-
-            except_block.append(Instr('LOAD_FAST', '_ex_mode', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_CONST', '0', lineno=cur_lineno))
-            except_block.append(Instr('COMPARE_OP', Compare.EQ, lineno=cur_lineno))
-            except_block.append(Instr('POP_JUMP_IF_FALSE', repair_mode_label, lineno=cur_lineno))
-
-            except_block.append(Instr('LOAD_FAST', '__ax_mc', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_METHOD', 'repair_mode', lineno=cur_lineno))
-            except_block.append(Instr('CALL_METHOD', 0, lineno=cur_lineno))
-            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+            except_block.append(Instr('ROT_TWO', lineno=cur_lineno))
 
-            except_block.append(Instr('LOAD_FAST', '__ax_re', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_METHOD', 'except_handler', lineno=cur_lineno))
+            # only exceptions nothing above handles reach repair: tr.on_exception(__ax_exc)
+            except_block.append(Instr('LOAD_GLOBAL', '__ax_tr', lineno=cur_lineno))
+            except_block.append(Instr('LOAD_METHOD', 'on_exception', lineno=cur_lineno))
             except_block.append(Instr('LOAD_FAST', '__ax_exc', lineno=cur_lineno))
             except_block.append(Instr('CALL_METHOD', 1, lineno=cur_lineno))
+            # a ResumeSignal: return its value (see axolotl.resume)
+            except_block.append(Instr('DUP_TOP', lineno=cur_lineno))
+            except_block.append(Instr('POP_JUMP_IF_TRUE', resume_label, lineno=cur_lineno))
             except_block.append(Instr('POP_TOP', lineno=cur_lineno))
-
-            # repair label
-            """
-                else if mode =='-1':
-                    print('Mode is repair')
-                    pass
-            """
-            except_block.append(repair_mode_label)
-            except_block.append(Instr('LOAD_FAST', '_ex_mode', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_CONST', '-1', lineno=cur_lineno))
-            except_block.append(Instr('COMPARE_OP', Compare.EQ, lineno=cur_lineno))
-            except_block.append(Instr('POP_JUMP_IF_FALSE', except_reraise_label, lineno=cur_lineno))
-
-            except_block.append(Instr('LOAD_GLOBAL', 'print', lineno=cur_lineno))
-            except_block.append(Instr('LOAD_CONST', 'Mode is repair mode', lineno=cur_lineno))
-            except_block.append(Instr('CALL_FUNCTION', 1, lineno=cur_lineno))
-            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+            except_block.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
+            except_block.append(Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno))
 
             # except reraise label
             except_block.append(except_reraise_label)
@@ -221,22 +243,27 @@ class Instrumenter:
             else:
                 except_block.append(Instr('RERAISE', 0, lineno=cur_lineno))            
 
+            # return signal.value, dropping (tb, value, type) and the saved exception state
+            except_block.extend([
+                resume_label,
+                Instr('LOAD_ATTR', 'value', lineno=cur_lineno),
+                Instr('ROT_FOUR', lineno=cur_lineno),
+                Instr('POP_TOP', lineno=cur_lineno),
+                Instr('POP_TOP', lineno=cur_lineno),
+                Instr('POP_TOP', lineno=cur_lineno),
+                Instr('ROT_FOUR', lineno=cur_lineno),
+                Instr('POP_EXCEPT', lineno=cur_lineno),
+                Instr('LOAD_CONST', None, lineno=cur_lineno),
+                Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno),
+                Instr('RETURN_VALUE', lineno=cur_lineno),
+            ])
+
             instrumented_bc = Bytecode(new_bc + except_block)
             instrumented_bc._copy_attr_from(bc)
    
         else:
             for instr in bc:
-                if (
-                    isinstance(instr, Instr)
-                    and instr.name == 'LOAD_CONST'
-                    and isinstance(instr.arg, CodeType)
-                    and '__axolotl__' not in instr.arg.co_consts
-                    and not self.is_class_code(instr.arg)
-                ):
-                    # Instrument nested CodeType
-                    new_bc.append(Instr('LOAD_CONST', self.insert_try_except(instr.arg), lineno=instr.lineno))
-                else:
-                    new_bc.append(instr)
+                new_bc.append(self._instrument_nested(instr, module_level=True))
             instrumented_bc = Bytecode(new_bc)
             instrumented_bc._copy_attr_from(bc)
 
@@ -252,6 +279,9 @@ class Instrumenter:
         return new_code
     
     def is_class_code(self, code_obj: CodeType) -> bool:
+        # function bodies are always optimized; skip decoding them
+        if code_obj.co_flags & CompilerFlags.OPTIMIZED:
+            return False
         bytecode = Bytecode.from_code(code_obj)
         instructions = list(bytecode)
 
@@ -260,6 +290,9 @@ class Instrumenter:
 
     
     def insert_try_except_for_patchcode(self, code: CodeType):
+        if USE_EXCEPTION_TABLE:
+            return self._insert_try_except_exctable(code, patch_prologue=False, verbose=True)
+
         bc = Bytecode.from_code(code)
         cur_lineno = code.co_firstlineno
 
@@ -271,29 +304,8 @@ class Instrumenter:
 
         new_bc = [Instr('LOAD_CONST', '__axolotl__', lineno=1)]
 
-        # import axolotl.mode as mc
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.mode', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'mode', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_mc', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
-
-        # import axolotl.repair as re
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.repair', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'repair', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_re', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
-
-        # import axolotl.patch as pc
-        new_bc.append(Instr('LOAD_CONST', 0, lineno=cur_lineno))
-        new_bc.append(Instr('LOAD_CONST', None, lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_NAME', 'axolotl.patch', lineno=cur_lineno))
-        new_bc.append(Instr('IMPORT_FROM', 'patch', lineno=cur_lineno))
-        new_bc.append(Instr('STORE_FAST', '__ax_pc', lineno=cur_lineno))
-        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
+        # axolotl runtime modules (__ax_mc, __ax_re, __ax_pc, __ax_lz, __ax_tr) are module globals
+        # bound once by bind_runtime_globals(), not imported on every call
 
 
         ## 이 밑으로 try-except 블록
@@ -333,12 +345,14 @@ class Instrumenter:
                 Instr('JUMP_IF_NOT_EXC_MATCH', except_reraise_label, lineno=cur_lineno)
             )
 
-        except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+        # __ax_exc = value, keeping (tb, value, type) on the stack for RERAISE
+        except_block.append(Instr('ROT_TWO', lineno=cur_lineno))
+        except_block.append(Instr('DUP_TOP', lineno=cur_lineno))
         except_block.append(Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno))
-        except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+        except_block.append(Instr('ROT_TWO', lineno=cur_lineno))
         
         # mode = mc.mode_check()
-        except_block.append(Instr('LOAD_FAST', '__ax_mc', lineno=cur_lineno))
+        except_block.append(Instr('LOAD_GLOBAL', '__ax_mc', lineno=cur_lineno))
         except_block.append(Instr('LOAD_METHOD', 'mode_check', lineno=cur_lineno))
         except_block.append(Instr('CALL_METHOD', 0, lineno=cur_lineno))
         except_block.append(Instr('STORE_FAST', 'mode', lineno=cur_lineno))
@@ -378,7 +392,7 @@ class Instrumenter:
         except_block.append(Instr('CALL_FUNCTION', 1, lineno=cur_lineno))
         except_block.append(Instr('POP_TOP', lineno=cur_lineno))
 
-        except_block.append(Instr('LOAD_FAST', '__ax_mc', lineno=cur_lineno))
+        except_block.append(Instr('LOAD_GLOBAL', '__ax_mc', lineno=cur_lineno))
         except_block.append(Instr('LOAD_METHOD', 'repair_mode', lineno=cur_lineno))
         except_block.append(Instr('CALL_METHOD', 0, lineno=cur_lineno))
         except_block.append(Instr('POP_TOP', lineno=cur_lineno))
@@ -388,7 +402,7 @@ class Instrumenter:
         except_block.append(Instr('CALL_FUNCTION', 1, lineno=cur_lineno))
         except_block.append(Instr('POP_TOP', lineno=cur_lineno))
 
-        except_block.append(Instr('LOAD_FAST', '__ax_re', lineno=cur_lineno))
+        except_block.append(Instr('LOAD_GLOBAL', '__ax_re', lineno=cur_lineno))
         except_block.append(Instr('LOAD_METHOD', 'except_handler', lineno=cur_lineno))
         except_block.append(Instr('LOAD_FAST', '__ax_exc', lineno=cur_lineno))
         except_block.append(Instr('CALL_METHOD', 1, lineno=cur_lineno))
@@ -449,4 +463,237 @@ class Instrumenter:
             dump_bytecode(instrumented_bc, lineno=True)
             raise
         
-        return new_code
\ No newline at end of file
+        return new_code
+
+    def _instrument_consts(self, code: CodeType) -> CodeType:
+        """Leave `code` itself unwrapped (see InstrumentationPlan) but instrument the functions it defines."""
+        consts = tuple(
+            self.insert_try_except(const)
+            if isinstance(const, CodeType) and '__axolotl__' not in const.co_consts and not self.is_class_code(const)
+            else const
+            for const in code.co_consts
+        )
+        return code.replace(co_consts=consts)
+
+    def _instrument_nested(self, instr, module_level: bool = False):
+        if (
+            isinstance(instr, Instr)
+            and instr.name == 'LOAD_CONST'
+            and isinstance(instr.arg, CodeType)
+            and '__axolotl__' not in instr.arg.co_consts
+            and not self.is_class_code(instr.arg)
+        ):
+            if module_level and self._defer(instr.arg):
+                # instrumented by axolotl.lazy.trampoline() on the first call
+                return Instr('LOAD_CONST', make_stub(instr.arg), lineno=instr.lineno)
+            # Instrument nested CodeType
+            return Instr('LOAD_CONST', self.insert_try_except(instr.arg), lineno=instr.lineno)
+        return instr
+
+    def _defer(self, code: CodeType) -> bool:
+        return (self.lazy and is_stub_candidate(code)
+                and (self.plan is None or self.plan.should_instrument(code)))
+
+    def _insert_try_except_exctable(self, code: CodeType, patch_prologue: bool, verbose: bool = False):
+        """
+        insert_try_except / insert_try_except_for_patchcode for Python 3.11+.
+
+        There is no block stack any more: the function body is wrapped by adding
+        exception table entries (TryBegin/TryEnd) that cover every instruction not
+        already covered by one of the function's own entries, all pointing at a
+        single axolotl handler. Exceptions the function handles itself never reach
+        it, exactly like the SETUP_FINALLY wrapper on older versions. The entry
+        stack depths are recomputed by bytecode when the code is assembled.
+        """
+        # Skip if already instrumented
+        if '__axolotl__' in code.co_consts:
+            return code
+
+        bc = Bytecode.from_code(code)
+        cur_lineno = code.co_firstlineno
+        is_global = code.co_name == '<module>'
+
+        # RETURN_GENERATOR / MAKE_CELL / COPY_FREE_VARS ... RESUME run before the body
+        instrs = list(bc)
+        body_start = next((i + 1 for i, instr in enumerate(instrs)
+                           if isinstance(instr, Instr) and instr.name == 'RESUME'), 0)
+        new_bc = instrs[:body_start]
+        new_bc.append(Instr('LOAD_CONST', '__axolotl__', lineno=cur_lineno))
+        new_bc.append(Instr('POP_TOP', lineno=cur_lineno))
+        body = [self._instrument_nested(instr, module_level=is_global) for instr in instrs[body_start:]]
+
+        if is_global:
+            instrumented_bc = Bytecode(new_bc + body)
+            instrumented_bc._copy_attr_from(bc)
+            return self._assemble(code, bc, instrumented_bc)
+
+        # a patched generator/coroutine can't be redirected by returning the call,
+        # and nameless code (<lambda>, <listcomp>, ...) never has a patch
+        if patch_prologue and not code.co_flags & _NO_PATCH_PROLOGUE and code.co_name.isidentifier():
+            new_bc.extend(self._patch_prologue(code, cur_lineno))
+
+        except_label = Label()
+        cleanup_label = Label()
+        repair_mode_label = Label()
+        except_reraise_label = Label()
+        resume_label = Label()
+
+        # cover the gaps between the function's own exception table entries
+        # (the 3.12 generator entry already starts before RESUME)
+        our_entry = None
+        in_user_entry = False
+        for instr in new_bc:
+            if isinstance(instr, TryBegin):
+                in_user_entry = True
+            elif isinstance(instr, TryEnd):
+                in_user_entry = False
+        for instr in body:
+            if isinstance(instr, TryBegin):
+                if our_entry is not None:
+                    new_bc.append(TryEnd(our_entry))
+                    our_entry = None
+                in_user_entry = True
+            elif isinstance(instr, TryEnd):
+                in_user_entry = False
+            elif isinstance(instr, Instr) and not in_user_entry and our_entry is None:
+                our_entry = TryBegin(except_label, push_lasti=False)
+                new_bc.append(our_entry)
+            new_bc.append(instr)
+        if our_entry is not None:
+            new_bc.append(TryEnd(our_entry))
+
+        handler_entry = TryBegin(cleanup_label, push_lasti=True)
+        except_block = [
+            except_label,
+            handler_entry,
+            Instr('PUSH_EXC_INFO', lineno=cur_lineno),
+            _load_global('Exception', False, cur_lineno),
+            Instr('CHECK_EXC_MATCH', lineno=cur_lineno),
+            _pop_jump_if_false(except_reraise_label, cur_lineno),
+            Instr('COPY', 1, lineno=cur_lineno),
+            Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno),
+        ]
+
+        if not verbose:
+            # triage decides whether anything above handles the exception (no mode
+            # read, no print on the hot path): tr.on_exception(__ax_exc)
+            except_block.extend(_call_runtime('__ax_tr', 'on_exception',
+                                              [Instr('LOAD_FAST', '__ax_exc', lineno=cur_lineno)], cur_lineno))
+            # a ResumeSignal: return its value (see axolotl.resume)
+            except_block.extend([
+                Instr('COPY', 1, lineno=cur_lineno),
+                _pop_jump_if_true(resume_label, cur_lineno),
+                Instr('POP_TOP', lineno=cur_lineno),
+            ])
+        else:
+            # mode = mc.mode_check()
+            except_block.extend(_call_runtime('__ax_mc', 'mode_check', [], cur_lineno))
+            except_block.append(Instr('STORE_FAST', '_ex_mode', lineno=cur_lineno))
+
+            except_block.extend(_call_print([Instr('LOAD_CONST', 'Exception occur :', lineno=cur_lineno),
+                                             Instr('LOAD_FAST', '__ax_exc', lineno=cur_lineno)], cur_lineno))
+            except_block.extend(_call_print([Instr('LOAD_CONST', 'Mode checking', lineno=cur_lineno)], cur_lineno))
+
+            # if mode == '0': mc.repair_mode(); re.except_handler(__ax_exc)
+            except_block.extend([
+                Instr('LOAD_FAST', '_ex_mode', lineno=cur_lineno),
+                Instr('LOAD_CONST', '0', lineno=cur_lineno),
+                Instr('COMPARE_OP', Compare.EQ, lineno=cur_lineno),
+                _pop_jump_if_false(repair_mode_label, cur_lineno),
+            ])
+            except_block.extend(_call_print([Instr('LOAD_CONST', 'Mode is safe mode, change to repair mode',
+                                                   lineno=cur_lineno)], cur_lineno))
+            except_block.extend(_call_runtime('__ax_mc', 'repair_mode', [], cur_lineno))
+            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+            except_block.extend(_call_print([Instr('LOAD_CONST', 'First patch generate', lineno=cur_lineno)],
+                                            cur_lineno))
+            except_block.extend(_call_runtime('__ax_re', 'except_handler',
+                                              [Instr('LOAD_FAST', '__ax_exc', lineno=cur_lineno)], cur_lineno))
+            except_block.append(Instr('POP_TOP', lineno=cur_lineno))
+
+            # elif mode == '-1': print('Mode is repair mode')
+            except_block.extend([
+                repair_mode_label,
+                Instr('LOAD_FAST', '_ex_mode', lineno=cur_lineno),
+                Instr('LOAD_CONST', '-1', lineno=cur_lineno),
+                Instr('COMPARE_OP', Compare.EQ, lineno=cur_lineno),
+                _pop_jump_if_false(except_reraise_label, cur_lineno),
+            ])
+            except_block.extend(_call_print([Instr('LOAD_CONST', 'Mode is repair mode', lineno=cur_lineno)],
+                                            cur_lineno))
+
+        # drop the frame -> traceback reference before re-raising
+        except_block.extend([
+            except_reraise_label,
+            Instr('LOAD_CONST', None, lineno=cur_lineno),
+            Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno),
+            Instr('RERAISE', 0, lineno=cur_lineno),
+            TryEnd(handler_entry),
+        ])
+        if not verbose:
+            # return signal.value, dropping the exception and restoring the saved
+            # one (outside the handler's entry, like a `return` in an except clause)
+            except_block.extend([
+                resume_label,
+                _load_attr('value', cur_lineno),
+                Instr('SWAP', 2, lineno=cur_lineno),
+                Instr('POP_TOP', lineno=cur_lineno),
+                Instr('SWAP', 2, lineno=cur_lineno),
+                Instr('POP_EXCEPT', lineno=cur_lineno),
+                Instr('LOAD_CONST', None, lineno=cur_lineno),
+                Instr('STORE_FAST', '__ax_exc', lineno=cur_lineno),
+                Instr('RETURN_VALUE', lineno=cur_lineno),
+            ])
+        except_block.extend([
+            cleanup_label,
+            Instr('COPY', 3, lineno=cur_lineno),
+            Instr('POP_EXCEPT', lineno=cur_lineno),
+            Instr('RERAISE', 1, lineno=cur_lineno),
+        ])
+
+        instrumented_bc = Bytecode(new_bc + except_block)
+        instrumented_bc._copy_attr_from(bc)
+        return self._assemble(code, bc, instrumented_bc)
+
+    def _patch_prologue(self, code: CodeType, cur_lineno: int) -> list:
+        """
+        if pc.func_patch_exist(name) and mc.mode_check() == '0':
+            name.__code__ = pc.patched_func(name)
+            return name(*args, **kwonly)
+        """
+        func_name = code.co_name
+        args = code.co_varnames[:code.co_argcount]
+        kwargs = code.co_varnames[code.co_argcount:code.co_argcount + code.co_kwonlyargcount]
+        patch_not_exist_label = Label()
+
+        patch_block = _call_runtime('__ax_pc', 'func_patch_exist',
+                                    [Instr('LOAD_CONST', func_name, lineno=cur_lineno)], cur_lineno)
+        patch_block.append(_pop_jump_if_false(patch_not_exist_label, cur_lineno))
+        patch_block.extend(_call_runtime('__ax_mc', 'mode_check', [], cur_lineno))
+        patch_block.extend([
+            Instr('LOAD_CONST', '0', lineno=cur_lineno),
+            Instr('COMPARE_OP', Compare.EQ, lineno=cur_lineno),
+            _pop_jump_if_false(patch_not_exist_label, cur_lineno),
+        ])
+        patch_block.extend(_call_runtime('__ax_pc', 'patched_func',
+                                         [Instr('LOAD_CONST', func_name, lineno=cur_lineno)], cur_lineno))
+        patch_block.extend([
+            _load_global(func_name, False, cur_lineno),
+            Instr('STORE_ATTR', '__code__', lineno=cur_lineno),
+            _load_global(func_name, True, cur_lineno),
+        ])
+        patch_block.extend(_load_arg(code, name, cur_lineno) for name in args + kwargs)
+        patch_block.extend(_call(len(args) + len(kwargs), cur_lineno, kwargs))
+        patch_block.append(Instr('RETURN_VALUE', lineno=cur_lineno))
+        patch_block.append(patch_not_exist_label)
+        return patch_block
+
+    def _assemble(self, code: CodeType, bc: Bytecode, instrumented_bc: Bytecode) -> CodeType:
+        try:
+            return instrumented_bc.to_code(compute_exception_stack_depths=True)
+        except:
+            print(code.co_filename)
+            dump_bytecode(bc, lineno=True)
+            print('------------------')
+            dump_bytecode(instrumented_bc, lineno=True)
+            raise
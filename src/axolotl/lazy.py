@@ -0,0 +1,103 @@
+import gc
+import os
+import sys
+import inspect
+from types import CodeType, FunctionType
+
+LAZY_ENV = "AXOLOTL_LAZY"
+
+_ORIGINAL = '__ax_original__'           # stub constant replaced by the original code object
+_STUB_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR | \
+              inspect.CO_ITERABLE_COROUTINE
+
+_instrumenter = None
+# keyed by id(original): code equality ignores co_filename, so equal functions of two
+# modules would share one instrumented code; the entries keep the originals alive
+_instrumented = {}                      # id(original) -> (original, instrumented code)
+
+def set_instrumenter(sci):
+    """Instrumenter used by trampoline(); stubs are instrumented with its options."""
+    global _instrumenter
+    _instrumenter = sci
+
+def lazy_enabled() -> bool:
+    return bool(os.getenv(LAZY_ENV))
+
+def is_stub_candidate(code: CodeType) -> bool:
+    """
+    Module-level functions only: no free variables to carry over, and not a
+    generator/coroutine, whose flags callers may inspect before the first call.
+    """
+    return not code.co_freevars and not code.co_flags & _STUB_FLAGS and code.co_name.isidentifier()
+
+def make_stub(code: CodeType) -> CodeType:
+    """
+    A code object with the signature of `code` that hands its arguments to
+    trampoline(). Defaults and annotations live on the function object, so the
+    stub only has to reproduce parameter names and kinds.
+    """
+    names = code.co_varnames
+    npos = code.co_argcount
+    nkw = code.co_kwonlyargcount
+    posonly = getattr(code, 'co_posonlyargcount', 0)
+    pos, kwonly = names[:npos], names[npos:npos + nkw]
+    rest = iter(names[npos + nkw:])
+    varargs = next(rest) if code.co_flags & inspect.CO_VARARGS else None
+    varkw = next(rest) if code.co_flags & inspect.CO_VARKEYWORDS else None
+
+    params = list(pos)
+    if posonly:
+        params.insert(posonly, '/')
+    if varargs:
+        params.append('*' + varargs)
+    elif kwonly:
+        params.append('*')
+    params.extend(kwonly)
+    if varkw:
+        params.append('**' + varkw)
+
+    args = list(pos) + (['*' + varargs] if varargs else [])
+    kwargs = [f'{name!r}: {name}' for name in kwonly] + (['**' + varkw] if varkw else [])
+    # functions take __doc__ from the first constant of their code
+    doc = code.co_consts[0] if code.co_consts and isinstance(code.co_consts[0], str) else None
+    source = (f"def stub({', '.join(params)}):\n"
+              f"    {doc!r}\n"
+              f"    return __ax_lz.trampoline({_ORIGINAL!r}, ({', '.join(args)}{',' if args else ''}), "
+              f"{{{', '.join(kwargs)}}})\n")
+
+    stub = next(c for c in compile(source, code.co_filename, 'exec').co_consts if isinstance(c, CodeType))
+    consts = tuple(code if c == _ORIGINAL else c for c in stub.co_consts)
+    replace = dict(co_consts=consts, co_name=code.co_name, co_firstlineno=code.co_firstlineno)
+    if sys.version_info >= (3, 11):
+        replace['co_qualname'] = code.co_qualname
+    return stub.replace(**replace)
+
+def _functions_using(stub: CodeType, namespace: dict):
+    # fast path: the module global of the same name, or what it wraps (functools.wraps)
+    func = namespace.get(stub.co_name)
+    while func is not None:
+        if isinstance(func, FunctionType) and func.__code__ is stub:
+            return [func]
+        func = getattr(func, '__wrapped__', None)
+    return [f for f in gc.get_referrers(stub) if isinstance(f, FunctionType) and f.__code__ is stub]
+
+def trampoline(original: CodeType, args: tuple, kwargs: dict):
+    """
+    First call of a stubbed function: instrument its original code (memoised per
+    code object), install it as the function's __code__ and run the call.
+    """
+    frame = sys._getframe(1)
+    stub, namespace = frame.f_code, frame.f_globals
+    del frame
+
+    from .instrumenter import Instrumenter, bind_runtime_globals
+    entry = _instrumented.get(id(original))
+    if entry is None:
+        sci = _instrumenter or Instrumenter()
+        entry = _instrumented[id(original)] = (original, sci.insert_try_except(original))
+    code = entry[1]
+    bind_runtime_globals(namespace)
+
+    for func in _functions_using(stub, namespace):
+        func.__code__ = code
+    return FunctionType(code, namespace, original.co_name)(*args, **kwargs)
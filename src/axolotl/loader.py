@@ -5,16 +5,22 @@ from pathlib import Path
 import sys
 from typing import Any
 import os
-import dis
-from io import StringIO
+import re
+import time
+from collections import OrderedDict
 
-from .instrumenter import Instrumenter
+from .instrumenter import Instrumenter, bind_runtime_globals
+from .cache import InstrumentedCodeCache
+from .plan import InstrumentationPlan
+from . import lazy
+from .artifacts import get_artifact_writer
 
 class RuntimeAPRLoader(Loader):
-    def __init__(self, sci: Instrumenter, orig_loader: Loader, origin: str):
+    def __init__(self, sci: Instrumenter, orig_loader: Loader, origin: str, code_cache: InstrumentedCodeCache = None):
         self.sci = sci                  # Instrumenter object
         self.orig_loader = orig_loader  # original loader we're wrapping
         self.origin = Path(origin)      # module origin (source file for a source loader)
+        self.code_cache = code_cache    # on-disk cache of instrumented code (optional)
         self.package = {}
         
 
@@ -37,31 +43,59 @@ class RuntimeAPRLoader(Loader):
         #     print(f"[*] Skipping exec for already loaded module: {module.__name__}")
         #     return
         
-        if isinstance(self.orig_loader, machinery.SourceFileLoader) and self.origin.exists():
-            code = compile(ast.parse(self.origin.read_text()), str(self.origin), "exec")
-        else:
-            code = self.orig_loader.get_code(module.__name__)
-
-        if '__axolotl__' not in code.co_consts and module.__name__:
+        is_source = isinstance(self.orig_loader, machinery.SourceFileLoader) and self.origin.exists()
+        code = None
+        if is_source and self.code_cache:
+            code = self.code_cache.load(self.origin)
+
+        if code is None:
+            start = time.perf_counter()
+            if is_source:
+                st = os.stat(self.origin)
+                code = compile(ast.parse(self.origin.read_text()), str(self.origin), "exec")
+            else:
+                code = self.orig_loader.get_code(module.__name__)
+
+            if '__axolotl__' in code.co_consts or not module.__name__:
+                return
             code = self.sci.insert_try_except(code)
-            dis_output = StringIO()
-            dis.dis(code, file=dis_output)
-            disassembled_code = dis_output.getvalue()
-            dis_output.close()
-            with open(f'{os.getenv("WDIR")}/instrumented/{module.__name__}', 'w') as file:
-                file.write(disassembled_code)     
-            exec(code, module.__dict__)
+            if is_source and self.code_cache:
+                self.code_cache.store(self.origin, code, time.perf_counter() - start, st)
+
+        get_artifact_writer().record(module.__name__, code)
+        bind_runtime_globals(module.__dict__)
+        exec(code, module.__dict__)
 
 class RuntimeAPRMetaPathFinder(MetaPathFinder):
-    def __init__(self, sci, file_matcher, debug=True):
+    """
+    Wraps the loader of specs whose origin the file matcher accepts.
+
+    Modules found but not instrumented (extension or builtin modules, origins
+    the matcher rejects) are remembered per (fullname, path): the next lookup
+    returns None straight away and lets the remaining finders do their usual
+    work, instead of running every finder twice. Lookups nothing found aren't
+    remembered, so a module that becomes importable after a later sys.path
+    change is still instrumented. importlib.invalidate_caches() clears the
+    cache.
+    """
+    def __init__(self, sci, file_matcher, debug=False, code_cache=None):
         self.debug = debug
         self.sci = sci
         self.file_matcher = file_matcher
+        self.code_cache = code_cache
+        self._skip = set()      # (fullname, path) lookups found but not instrumented
+
+    def invalidate_caches(self):
+        self._skip.clear()
 
     def find_spec(self, fullname, path, target=None):
         if self.debug:
             print(f"Looking for {fullname}")
 
+        key = (fullname, tuple(path) if path is not None else None)
+        if key in self._skip:
+            return None
+
         for f in sys.meta_path:
             # skip ourselves
             if isinstance(f, RuntimeAPRMetaPathFinder):
@@ -74,13 +108,15 @@ class RuntimeAPRMetaPathFinder(MetaPathFinder):
             if spec is None or spec.loader is None:
                 continue
 
-            # can't instrument extension files
-            if isinstance(spec.loader, machinery.ExtensionFileLoader):
-                return None
-
-            if self.file_matcher.matches(spec.origin):
+            # can't instrument extension files; already wrapped specs are left alone
+            if (
+                not isinstance(spec.loader, (machinery.ExtensionFileLoader, RuntimeAPRLoader))
+                and self.file_matcher.matches(spec.origin)
+            ):
                 # print(f"instrumenting {fullname} from {spec.origin}")
-                spec.loader = RuntimeAPRLoader(self.sci, spec.loader, spec.origin)
+                spec.loader = RuntimeAPRLoader(self.sci, spec.loader, spec.origin, self.code_cache)
+            else:
+                self._skip.add(key)
     
             return spec
 
@@ -93,7 +129,43 @@ class RuntimeAPRMatchEverything:
     def matches(self, filename : Path):
         return True
 
+class _PathTrie:
+    """Prefix trie over path components; answers "is one of the paths a prefix of this one?"."""
+    _END = object()
+
+    def __init__(self, paths=()):
+        self.root = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path: Path):
+        node = self.root
+        for part in path.parts:
+            node = node.setdefault(part, {})
+        node[self._END] = True
+
+    def prefix_of(self, parts, strict: bool = False) -> bool:
+        """True if some path equals parts[:i] (i < len(parts) when strict)."""
+        node = self.root
+        for i, part in enumerate(parts):
+            if self._END in node and i > 0:
+                return True
+            node = node.get(part)
+            if node is None:
+                return False
+        return not strict and self._END in node
+
 class RuntimeAPRFileMatcher:
+    """
+    Decides which files get instrumented.
+
+    Sources, omit patterns and exclude keywords are compiled on first use after a
+    change into prefix tries (sources, pylib paths, cwd) and one regex (omit
+    patterns anchored at the start, keywords anywhere), and decisions are
+    memoised per filename in a bounded LRU. Compiled state isn't pickled.
+    """
+    MEMO_SIZE = 8192
+
     def __init__(self):
         self.cwd = Path.cwd()
         self.sources = []
@@ -105,59 +177,128 @@ class RuntimeAPRFileMatcher:
 
         self.pylib_paths = [Path(inspect.__file__).parent] + \
                            [Path(p) for p in sys.path if (Path(p) / "pip").exists()]
-        
+        self._invalidate()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_memo', '_source_trie', '_pylib_trie', '_cwd_trie', '_exclude_re', '_compiled'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._memo = OrderedDict()
+        self._compiled = False
+
+    def _compile(self):
+        from fnmatch import translate
+
+        self._source_trie = _PathTrie(self.sources)
+        self._pylib_trie = _PathTrie(self.pylib_paths)
+        self._cwd_trie = _PathTrie([self.cwd])
+
+        alternatives = []
+        if self.omit:
+            alternatives.append(r'\A(?:' + '|'.join(translate(os.fspath(o)) for o in self.omit) + ')')
+        alternatives.extend(re.escape(keyword) for keyword in self.exclude_keywords)
+        self._exclude_re = re.compile('|'.join(alternatives)) if alternatives else None
+        self._compiled = True
+
     def addSource(self, source : Path):
         if isinstance(source, str):
             source = Path(source)
         if not source.is_absolute():
             source = self.cwd / source
         self.sources.append(source)
+        self._invalidate()
 
     def addOmit(self, omit):
         if not omit.startswith('*'):
             omit = self.cwd / omit
 
         self.omit.append(omit)
+        self._invalidate()
     
     def addExcludeKeyword(self, keyword: str):
         self.exclude_keywords.append(keyword)
+        self._invalidate()
 
     def matches(self, filename : Path):
         if filename is None:
             return False
 
+        memo = self._memo
+        hit = memo.get(filename)
+        if hit is not None:
+            try:
+                memo.move_to_end(filename)
+            except KeyError:    # evicted by another thread meanwhile
+                pass
+            return hit
+
+        hit = self._matches(filename)
+        memo[filename] = hit
+        if len(memo) > self.MEMO_SIZE:
+            try:
+                memo.popitem(last=False)
+            except KeyError:
+                pass
+        return hit
+
+    @staticmethod
+    def _is_plain_posix(filename: str) -> bool:
+        return (os.sep == '/' and filename.startswith('/') and not filename.startswith('//')
+                and '//' not in filename and '/./' not in filename and not filename.endswith(('/', '/.')))
+
+    def _matches(self, filename : Path):
+        if not self._compiled:
+            self._compile()
+
         if isinstance(filename, str):
             if filename == 'built-in': return False     # can't instrument
-            filename = Path(filename)
+            if self._is_plain_posix(filename):
+                # already in Path's normal form: skip building a Path
+                if os.path.splitext(filename)[1] in ('.pyd', '.so'): return False
+                path, parts = filename, ('/',) + tuple(filename[1:].split('/'))
+            else:
+                filename = Path(filename)
 
-        if filename.suffix in ('.pyd', '.so'): return False  # can't instrument DLLs
+        if isinstance(filename, Path):
+            if filename.suffix in ('.pyd', '.so'): return False  # can't instrument DLLs
 
-        if not filename.is_absolute():
-            filename = self.cwd / filename
+            if not filename.is_absolute():
+                filename = self.cwd / filename
+            path, parts = str(filename), filename.parts
 
-        if self.omit:
-            from fnmatch import fnmatch
-            if any(fnmatch(filename, o) for o in self.omit):
-                return False
-            
-        if any(keyword in str(filename) for keyword in self.exclude_keywords):
+        if self._exclude_re is not None and self._exclude_re.search(path):
             return False
 
         if self.sources:
-            return any(s==filename or s in filename.parents for s in self.sources)
+            return self._source_trie.prefix_of(parts)
 
-        if any(p in self.pylib_paths for p in filename.parents):
+        if self._pylib_trie.prefix_of(parts, strict=True):
             return False
 
-        return self.cwd in filename.parents
+        return self._cwd_trie.prefix_of(parts, strict=True)
 
 class RuntimeAPRImportManager:
     """A context manager that enables instrumentation while active."""
 
-    def __init__(self, sci: Instrumenter, file_matcher: RuntimeAPRFileMatcher = None, debug: bool = False):
-        self.mpf = RuntimeAPRMetaPathFinder(sci, file_matcher if file_matcher else RuntimeAPRMatchEverything(), debug)
+    def __init__(self, sci: Instrumenter, file_matcher: RuntimeAPRFileMatcher = None, debug: bool = False,
+                 code_cache: InstrumentedCodeCache = None, plan=None):
+        # plan: InstrumentationPlan or path to a plan file. Set it before building
+        # code_cache, whose key includes the plan (Instrumenter.cache_key()).
+        if plan is not None:
+            sci.plan = plan if isinstance(plan, InstrumentationPlan) else InstrumentationPlan.load(plan)
+        self.mpf = RuntimeAPRMetaPathFinder(sci, file_matcher if file_matcher else RuntimeAPRMatchEverything(), debug,
+                                            code_cache)
 
     def __enter__(self) -> "RuntimeAPRImportManager":
+        if self.mpf.sci.lazy:
+            lazy.set_instrumenter(self.mpf.sci)
         sys.meta_path.insert(0, self.mpf)
         return self
 
@@ -163,6 +163,28 @@ class AxolotlReporter:
         self.data["stats"][key] = value
         self._save_sync()
 
+    def record_code_cache(self, stats: Dict[str, Any]):
+        self._load_sync()
+        self.data["code_cache"] = stats
+        self._save_sync()
+
+    def record_checkpoints(self, summary: Dict[str, Any]):
+        """Totals of the supervisor's dumps and restores (see axolotl.metrics)."""
+        self._load_sync()
+        self.data["checkpoints"] = summary
+        self._save_sync()
+
+    def record_exception_sites(self, sites: Dict[str, Dict[str, Any]]):
+        """Per exception site counters of the rule engine (see axolotl.rules), plus totals in stats."""
+        self._load_sync()
+        self.data["exception_sites"] = {
+            site: {k: v for k, v in stats.items() if k != "recent"} for site, stats in sites.items()
+        }
+        for key, stat in (("repairs", "exceptions_repaired"), ("ignored", "exceptions_ignored"),
+                          ("demoted", "exceptions_demoted"), ("quarantined", "exceptions_quarantined")):
+            self.data["stats"][stat] = sum(stats.get(key, 0) for stats in sites.values())
+        self._save_sync()
+
     def increment_stat(self, key):
         self._load_sync()
         if key not in self.data["stats"]:
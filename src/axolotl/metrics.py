@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import struct
+from typing import Any, Dict, Tuple
+
+from .logger import get_logger
+
+# in WDIR/log: one JSON object per checkpoint event
+EVENTS_FILE = 'checkpoint_events.jsonl'
+
+# CRIU statistics images (images/stats.proto), written next to the images
+STATS_DUMP = 'stats-dump'
+STATS_RESTORE = 'stats-restore'
+_DUMP_STATS_FIELDS = {1: 'freezing_time', 2: 'frozen_time', 3: 'memdump_time', 4: 'memwrite_time',
+                      5: 'pages_scanned', 6: 'pages_skipped_parent', 7: 'pages_written'}
+_RESTORE_STATS_FIELDS = {1: 'pages_compared', 2: 'pages_skipped_cow', 3: 'forking_time',
+                         4: 'restore_time', 5: 'pages_restored'}
+_USEC_FIELDS = {'freezing_time', 'frozen_time', 'memdump_time', 'memwrite_time', 'forking_time', 'restore_time'}
+
+# fields summary() adds up, per event (None in the summary if no event had the field)
+_TOTALS = {"dump": ("wall_time", "frozen_time", "pages_written", "pages_skipped", "image_bytes"),
+           "restore": ("restore_time", "resume_time", "unpack_time")}
+
+def _varint(buf: bytes, pos: int):
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+def _fields(buf: bytes) -> Dict[int, Any]:
+    """The varint and length-delimited fields of one protobuf message (enough for StatsEntry)."""
+    fields = {}
+    pos = 0
+    while pos < len(buf):
+        key, pos = _varint(buf, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            fields[number], pos = _varint(buf, pos)
+        elif wire == 2:
+            size, pos = _varint(buf, pos)
+            fields[number], pos = buf[pos:pos + size], pos + size
+        elif wire == 1:
+            pos += 8
+        elif wire == 5:
+            pos += 4
+        else:
+            raise ValueError(f'unsupported wire type {wire}')
+    return fields
+
+def read_criu_stats(path: str) -> Dict[str, float]:
+    """
+    The dump or restore statistics CRIU leaves in its images directory, {}
+    if there are none. Times in seconds, counts in pages.
+
+    The image is the CRIU magic (two 32-bit words), a 32-bit length and one
+    StatsEntry message: field 1 holds the DumpStatsEntry, field 2 the
+    RestoreStatsEntry.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        size, = struct.unpack_from('<I', data, 8)
+        entry = _fields(data[12:12 + size])
+        if isinstance(entry.get(1), bytes):
+            names, stats = _DUMP_STATS_FIELDS, _fields(entry[1])
+        elif isinstance(entry.get(2), bytes):
+            names, stats = _RESTORE_STATS_FIELDS, _fields(entry[2])
+        else:
+            return {}
+    except (OSError, struct.error, ValueError, IndexError):
+        return {}
+    return {name: stats[number] / 1e6 if name in _USEC_FIELDS else stats[number]
+            for number, name in names.items() if isinstance(stats.get(number), int)}
+
+class CheckpointMetrics:
+    """
+    Per-checkpoint measurements of the supervisor.
+
+    Every dump and restore becomes one line of WDIR/log/checkpoint_events.jsonl
+    as it happens; summary() - recorded under "checkpoints" in
+    time_profile.json - is their running totals: how much of the run the
+    target spent frozen in dumps and down for restores.
+
+    Dump events: `wall_time` from starting the dump to seeing it finish,
+    `frozen_time` the target was stopped (CRIU's own statistics, None for
+    fork snapshots), `pages_written` / `pages_skipped` (pages unchanged since
+    the parent dump), `image_bytes` and `chain_depth`. Restore events split
+    `restore_time` (the backend bringing the images back, stopped) from
+    `resume_time` (waiting for it to stop, installing patches, resuming);
+    `unpack_time` is rebuilding page data from the chunk store. A repair
+    resumed in place (--resume-in-place) is a `resume_in_place` event.
+    """
+    def __init__(self, log_dir: str):
+        self.path = os.path.join(log_dir, EVENTS_FILE)
+        self.start = time.monotonic()
+        # running totals: a long-lived target dumps for days, the events file is the full record
+        self.counts: Dict[str, int] = {}
+        self.totals: Dict[Tuple[str, str], float] = {}     # (event, field) -> sum where present
+        self.dump_wall_time_max = 0.0
+        self.chain_depth_max = 0
+        self.logger = get_logger()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def emit(self, event: str, **fields):
+        record = {"event": event, "timestamp": time.time(),
+                  "run_time": round(time.monotonic() - self.start, 6), **fields}
+        self._add(event, fields)
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            self.logger.error(f'[Metrics] Could not write {self.path}: {e}')
+
+    def _add(self, event: str, fields: Dict[str, Any]):
+        self.counts[event] = self.counts.get(event, 0) + 1
+        for key in _TOTALS.get(event, ()):
+            if fields.get(key) is not None:
+                self.totals[event, key] = self.totals.get((event, key), 0) + fields[key]
+        if event == "dump":
+            self.dump_wall_time_max = max(self.dump_wall_time_max, fields.get("wall_time") or 0.0)
+            self.chain_depth_max = max(self.chain_depth_max, fields.get("chain_depth") or 0)
+
+    def summary(self) -> Dict[str, Any]:
+        run_time = time.monotonic() - self.start
+        frozen = self.totals.get(("dump", "frozen_time"))
+        return {
+            "dumps": self.counts.get("dump", 0),
+            "dumps_failed": self.counts.get("dump_failed", 0),
+            "dumps_cancelled": self.counts.get("dump_cancelled", 0),
+            "dump_wall_time": self.totals.get(("dump", "wall_time")),
+            "dump_wall_time_max": self.dump_wall_time_max,
+            "frozen_time": frozen,
+            "frozen_fraction": frozen / run_time if frozen is not None and run_time > 0 else None,
+            "pages_written": self.totals.get(("dump", "pages_written")),
+            "pages_skipped": self.totals.get(("dump", "pages_skipped")),
+            "image_bytes": self.totals.get(("dump", "image_bytes")),
+            "chain_depth_max": self.chain_depth_max,
+            "restores": self.counts.get("restore", 0),
+            "restores_failed": self.counts.get("restore_failed", 0),
+            "resumed_in_place": self.counts.get("resume_in_place", 0),
+            "restore_time": self.totals.get(("restore", "restore_time")),
+            "resume_time": self.totals.get(("restore", "resume_time")),
+            "unpack_time": self.totals.get(("restore", "unpack_time")),
+            "run_time": run_time,
+        }
@@ -1,21 +1,66 @@
 import os
 
-def safe_mode():
-    with open(f'{os.getenv("WDIR")}/process_mode', 'w') as f:
+from . import events
+from .shared import SharedWord
+
+# validation_mode(1)
+# validation_fail_mode(2)
+# safe mode(0)
+# repair mode(-1)
+MODE_FILE = 'process_mode'
+MODE_SHM_FILE = 'process_mode.shm'
+
+_MODE_NAMES = {0: '0', -1: '-1', 1: '1', 2: '2'}
+_word = None
+_resolved = False
+
+def init_mode(wdir: str):
+    """Create both mode backends in safe mode (supervisor side)."""
+    with open(f'{wdir}/{MODE_FILE}', 'w') as f:
         f.write('0')
+    os.chmod(f'{wdir}/{MODE_FILE}', 0o666)
+    SharedWord.create(f'{wdir}/{MODE_SHM_FILE}', 0).close()
+
+def _resolve_backend():
+    # AXOLOTL_MODE_BACKEND: 'shm' (shared mmap'd word, default) or 'file' (process_mode text file)
+    global _word, _resolved
+    _resolved = True
+    if os.getenv('AXOLOTL_MODE_BACKEND', 'shm') != 'shm':
+        return
+    try:
+        _word = SharedWord(f'{os.getenv("WDIR")}/{MODE_SHM_FILE}')
+    except (OSError, ValueError):
+        _word = None
+
+def _set_mode(mode: str):
+    if not _resolved:
+        _resolve_backend()
+    if _word is not None:
+        _word.view[0] = int(mode)
+    else:
+        with open(f'{os.getenv("WDIR")}/{MODE_FILE}', 'w') as f:
+            f.write(mode)
+    # wake the supervisor loop
+    events.notify(events.MODE)
+
+def safe_mode():
+    _set_mode('0')
 
 def repair_mode():
-    with open(f'{os.getenv("WDIR")}/process_mode', 'w') as f:
-        f.write('-1')
+    _set_mode('-1')
 
 def validation_mode():
-    with open(f'{os.getenv("WDIR")}/process_mode', 'w') as f:
-        f.write('1')
+    _set_mode('1')
 
 def validation_fail_mode():
-    with open(f'{os.getenv("WDIR")}/process_mode', 'w') as f:
-        f.write('2')
+    _set_mode('2')
 
 def mode_check():
-    with open(f'{os.getenv("WDIR")}/process_mode', 'r') as f:
-        return f.read().strip()
\ No newline at end of file
+    if _word is not None:
+        return _MODE_NAMES[_word.view[0]]
+    if not _resolved:
+        _resolve_backend()
+        if _word is not None:
+            return _MODE_NAMES[_word.view[0]]
+    with open(f'{os.getenv("WDIR")}/{MODE_FILE}', 'r') as f:
+        return f.read().strip()
@@ -0,0 +1,119 @@
+import sys
+import signal
+import threading
+from collections import OrderedDict
+from types import CodeType, FunctionType
+
+import axolotl.mode as mc
+import axolotl.patch as pc
+from . import triage
+from .instrumenter import bind_runtime_globals
+from .logger import get_logger
+
+# capture backends selectable from `python -m axolotl --backend ...`
+BACKENDS = ('bytecode', 'monitoring')
+BACKEND_ENV = "AXOLOTL_BACKEND"
+TOOL_NAME = 'axolotl'
+# sent by the supervisor to a restored (stopped) target to install published patches
+PATCH_SIGNAL = signal.SIGUSR1
+
+def monitoring_available() -> bool:
+    return hasattr(sys, 'monitoring')
+
+class MonitoringBackend:
+    """
+    Exception capture through sys.monitoring (PEP 669, Python 3.12+).
+
+    Instead of rewriting every code object with Instrumenter.insert_try_except,
+    PY_UNWIND events (an exception leaving a frame) drive repair.except_handler,
+    so code that doesn't raise pays nothing for capture.
+
+    Patch dispatch has no per-call hook either: the supervisor restores the
+    target stopped, sends PATCH_SIGNAL and resumes it, and the handler swaps the
+    __code__ of the patched module-level functions before the program continues.
+    """
+    def __init__(self, file_matcher):
+        self.file_matcher = file_matcher
+        self.tool_id = None
+        self._targets = OrderedDict()   # id(code) -> (code, matched by file_matcher), triage.CACHE_SIZE at most
+        self._prev_handler = None
+        self.logger = get_logger()
+
+    def start(self):
+        mon = sys.monitoring
+        for tool_id in range(6):
+            if mon.get_tool(tool_id) is None:
+                break
+        else:
+            raise RuntimeError("no free sys.monitoring tool id")
+
+        mon.use_tool_id(tool_id, TOOL_NAME)
+        mon.register_callback(tool_id, mon.events.PY_UNWIND, self._on_unwind)
+        mon.set_events(tool_id, mon.events.PY_UNWIND)
+        self.tool_id = tool_id
+
+        if threading.current_thread() is threading.main_thread():
+            self._prev_handler = signal.signal(PATCH_SIGNAL, self._on_patch_signal)
+        self.logger.info(f"[Monitoring] sys.monitoring backend active (tool id {tool_id})")
+
+    def stop(self):
+        if self.tool_id is None:
+            return
+        mon = sys.monitoring
+        mon.set_events(self.tool_id, mon.events.NO_EVENTS)
+        mon.register_callback(self.tool_id, mon.events.PY_UNWIND, None)
+        mon.free_tool_id(self.tool_id)
+        self.tool_id = None
+        if self._prev_handler is not None:
+            signal.signal(PATCH_SIGNAL, self._prev_handler)
+            self._prev_handler = None
+
+    def __enter__(self) -> "MonitoringBackend":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _is_target(self, code: CodeType) -> bool:
+        entry = triage._cached(self._targets, code)
+        if entry is None:
+            entry = triage._cache(self._targets, code, (code, bool(self.file_matcher.matches(code.co_filename))))
+        return entry[1]
+
+    def _on_unwind(self, code: CodeType, instruction_offset: int, exception: BaseException):
+        if not isinstance(exception, Exception) or not self._is_target(code):
+            return
+        if mc.mode_check() == '0':
+            # the unwinding frame is the callback's caller
+            frame = sys._getframe(1)
+            try:
+                if not triage.should_repair(exception, frame):
+                    return
+            finally:
+                del frame
+            from .repair import except_handler
+            mc.repair_mode()
+            except_handler(exception)
+
+    def _on_patch_signal(self, signum, frame):
+        if mc.mode_check() == '0':
+            self.install_patches()
+
+    def install_patches(self):
+        """Swap __code__ of every loaded target function that has a published patch."""
+        names = set(pc.published_patches())
+        if not names:
+            return
+        for module in list(sys.modules.values()):
+            namespace = getattr(module, '__dict__', None)
+            if not namespace or not self.file_matcher.matches(getattr(module, '__file__', None)):
+                continue
+            for name in names & namespace.keys():
+                func = namespace[name]
+                code = getattr(func, '__code__', None)
+                if not isinstance(func, FunctionType) or code.co_name != name or '__axolotl__' in code.co_consts:
+                    continue
+                bind_runtime_globals(func.__globals__)
+                func.__code__ = pc.patched_func(name)
+                self.logger.info(f"[Monitoring] Installed patch for '{module.__name__}.{name}'")
@@ -1,15 +1,196 @@
 import os
+import gc
+import json
 import marshal
+from types import CodeType, FunctionType
+from typing import List, Tuple
+
+from .shared import SharedWord
+from .instrumenter import bind_runtime_globals
+from .logger import get_logger
 
 PATCH_FOLDER = f"{os.getenv('WDIR')}/patch_file"  # file_path
+GENERATION_FILE = "patch_generation"
+TARGET_SUFFIX = "_target.json"      # where a qualified patch goes: {name}_target.json
+
+# Process-local patch registry.
+# The supervisor bumps a shared generation counter whenever it publishes a patch,
+# so the instrumented prologue only compares two integers until that happens.
+_patches = {}               # patch name -> code object (None until first loaded)
+_installed = {}             # qualified patch name -> (mtime_ns, size) of the patch file install_patch() last ran for
+_seen_generation = 0
+_generation = (-1,)         # replaced by the shared counter's view on first refresh
+_generation_word = None
+_attached = False
+
+def _generation_path(wdir=None):
+    return os.path.join(wdir or os.getenv('WDIR'), GENERATION_FILE)
+
+def init_patch_generation(wdir):
+    """Create the shared generation counter (supervisor side)."""
+    SharedWord.create(_generation_path(wdir), 0).close()
+
+def publish_patches(wdir=None):
+    """Bump the shared generation counter so running targets rescan the patch folder."""
+    word = SharedWord(_generation_path(wdir))
+    generation = word.get() + 1
+    word.set(generation)
+    word.close()
+    return generation
+
+def patch_generation(wdir=None):
+    """The shared generation counter's current value (supervisor side)."""
+    word = SharedWord(_generation_path(wdir))
+    generation = word.get()
+    word.close()
+    return generation
+
+def _attach_generation():
+    global _generation, _generation_word, _attached
+    _attached = True
+    try:
+        _generation_word = SharedWord(_generation_path())
+        _generation = _generation_word.view
+    except (OSError, ValueError, TypeError):
+        # no supervisor (e.g. plain script run): scan the patch folder once
+        _generation = (0,)
+
+def _refresh():
+    global _seen_generation
+    if not _attached:
+        _attach_generation()
+
+    generation = _generation[0]
+    _patches.clear()
+    if os.path.isdir(PATCH_FOLDER):
+        for entry in os.listdir(PATCH_FOLDER):
+            if entry.endswith('_patch') and not entry.endswith('_val1_patch'):
+                _patches[entry[:-len('_patch')]] = None
+    _seen_generation = generation
+    # the prologue only redirects module functions: methods and closures are swapped here,
+    # once per patch file (installing scans the heap)
+    for name in list(_patches):
+        if not is_qualified(name):
+            continue
+        try:
+            st = os.stat(os.path.join(PATCH_FOLDER, f"{name}_patch"))
+        except OSError:
+            continue
+        if _installed.get(name) == (st.st_mtime_ns, st.st_size):
+            continue
+        _installed[name] = (st.st_mtime_ns, st.st_size)
+        try:
+            install_patch(name)
+        except Exception as e:
+            get_logger().error(f"[Patch] Could not install '{name}': {e}")
 
 def func_patch_exist(func_name):
-    if os.path.exists(os.path.join(PATCH_FOLDER, f"{func_name}_patch")):
-        return True
-    else:
-        return False
+    if _generation[0] != _seen_generation:
+        _refresh()
+    return func_name in _patches
+
+def published_patches():
+    if _generation[0] != _seen_generation:
+        _refresh()
+    return list(_patches)
 
 def patched_func(func_name):
-    with open(os.path.join(PATCH_FOLDER, f"{func_name}_patch"), "rb") as f:
-        code_object = marshal.load(f)
-    return code_object
\ No newline at end of file
+    code_object = _patches.get(func_name)
+    if code_object is None:
+        with open(os.path.join(PATCH_FOLDER, f"{func_name}_patch"), "rb") as f:
+            code_object = marshal.load(f)
+        _patches[func_name] = code_object
+    return code_object
+
+def qualified_name(func: FunctionType) -> str:
+    """
+    Patch name of a function the prologue can't reach by its global name
+    (a method, a nested function, a decorated function): 'module.qualname'.
+    """
+    return f"{func.__module__}.{func.__qualname__}"
+
+def is_qualified(name: str) -> bool:
+    return '.' in name
+
+def save_patch_target(name: str, code: CodeType):
+    """Record which code object the patch `name` replaces, for install_patch() in other processes."""
+    target = {"filename": code.co_filename, "firstlineno": code.co_firstlineno, "name": code.co_name}
+    with open(os.path.join(PATCH_FOLDER, f"{name}{TARGET_SUFFIX}"), 'w') as f:
+        json.dump(target, f)
+
+def functions_of(code: CodeType) -> List[FunctionType]:
+    """Every function object running `code`."""
+    return [ref for ref in gc.get_referrers(code) if isinstance(ref, FunctionType) and ref.__code__ is code]
+
+def install_patch(name: str, code: CodeType = None) -> List[Tuple[FunctionType, CodeType]]:
+    """
+    Swap the patch `name` in for the original code `code` (looked up from
+    the patch's target when None), in one pass and without a restart.
+
+    Every function object running it is changed: module functions, methods
+    (bound methods share the class attribute's function), closures and the
+    functions held by functools wrappers and caches. So are the functions
+    creating it, so that closures made from now on run the patch too.
+    Returns the swaps, for revert().
+    """
+    patched = patched_func(name)
+    originals = [code] if code is not None else _target_codes(name)
+    swapped = []
+    try:
+        for original in originals:
+            if patched.co_freevars != original.co_freevars:
+                # closure cells are matched by position
+                raise ValueError(f"patch of '{original.co_name}' has free variables {patched.co_freevars}, "
+                                 f"the original {original.co_freevars}")
+            if hasattr(original, 'co_qualname'):
+                # 3.11+: functions made from the patch take their __qualname__ from it
+                _swap(original, patched.replace(co_qualname=original.co_qualname), swapped)
+            else:
+                _swap(original, patched, swapped)
+    except Exception:
+        revert(swapped)
+        raise
+    if swapped:
+        get_logger().info(f"[Patch] Installed '{name}' in {len(swapped)} function(s)")
+    return swapped
+
+def revert(swapped: List[Tuple[FunctionType, CodeType]]):
+    """Undo install_patch()."""
+    for func, original in reversed(swapped):
+        func.__code__ = original
+
+def _swap(original: CodeType, patched: CodeType, swapped: list):
+    for func in functions_of(original):
+        bind_runtime_globals(func.__globals__)
+        func.__code__ = patched
+        swapped.append((func, original))
+    for parent in _enclosing(original):
+        consts = tuple(patched if const is original else const for const in parent.co_consts)
+        _swap(parent, parent.replace(co_consts=consts), swapped)
+
+def _enclosing(code: CodeType) -> List[CodeType]:
+    """The code of the functions whose `def` makes functions of `code` (module and class bodies don't run again)."""
+    parents = {}
+    for obj in gc.get_objects():
+        if isinstance(obj, FunctionType) and any(const is code for const in obj.__code__.co_consts):
+            parents[id(obj.__code__)] = obj.__code__
+    return list(parents.values())
+
+def _target_codes(name: str) -> List[CodeType]:
+    """The original code objects of the patch `name` still held by a function, or by the code creating one."""
+    with open(os.path.join(PATCH_FOLDER, f"{name}{TARGET_SUFFIX}")) as f:
+        target = json.load(f)
+    key = (target["filename"], target["firstlineno"], target["name"])
+    found = {}
+    for obj in gc.get_objects():
+        if isinstance(obj, FunctionType):
+            for code in _walk(obj.__code__):
+                if (code.co_filename, code.co_firstlineno, code.co_name) == key:
+                    found[id(code)] = code
+    return list(found.values())
+
+def _walk(code: CodeType):
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            yield from _walk(const)
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+from types import CodeType
+from typing import Dict, Optional
+
+from .logger import get_logger
+
+PLAN_ENV = "AXOLOTL_PLAN"                          # plan applied by the instrumenter
+PROFILE_ENV = "AXOLOTL_PROFILE_PLAN"               # profile run: where to write the plan
+HOT_THRESHOLD_ENV = "AXOLOTL_PLAN_HOT_THRESHOLD"
+KEEP_NEVER_RAISED_ENV = "AXOLOTL_PLAN_KEEP_NEVER_RAISED"
+
+PLAN_VERSION = 1
+DEFAULT_HOT_THRESHOLD = 100000
+
+def plan_key(code: CodeType) -> str:
+    """Identity of a code object across runs: 'filename:firstlineno:name'."""
+    return f"{code.co_filename}:{code.co_firstlineno}:{code.co_name}"
+
+class InstrumentationPlan:
+    """
+    Which functions the Instrumenter leaves unwrapped.
+
+    A plan is a JSON file written by a profile run (`python -m axolotl --profile-plan`):
+
+        {
+          "version": 1,
+          "hot_threshold": 100000,        # policy the skip list was derived with
+          "skip_never_raised": true,
+          "functions": {"<filename>:<firstlineno>:<name>": {"calls": 12, "raised": 0}, ...},
+          "skip": ["<filename>:<firstlineno>:<name>", ...]
+        }
+
+    Only "skip" is consulted; it can be edited by hand. Functions the profile run
+    never called are not listed and stay instrumented. A skipped function gets
+    neither the try/except wrapper nor the patch-redirect prologue, so repair
+    coverage for it comes only from its instrumented callers.
+    """
+    def __init__(self, skip=(), functions: Dict[str, dict] = None,
+                 hot_threshold: int = DEFAULT_HOT_THRESHOLD, skip_never_raised: bool = True):
+        self.skip = frozenset(skip)
+        self.functions = functions or {}
+        self.hot_threshold = hot_threshold
+        self.skip_never_raised = skip_never_raised
+
+    @classmethod
+    def from_profile(cls, functions: Dict[str, dict], hot_threshold: int = DEFAULT_HOT_THRESHOLD,
+                     skip_never_raised: bool = True) -> "InstrumentationPlan":
+        skip = [key for key, stats in functions.items()
+                if stats["calls"] >= hot_threshold or (skip_never_raised and not stats["raised"])]
+        return cls(skip, functions, hot_threshold, skip_never_raised)
+
+    @classmethod
+    def load(cls, path: str) -> "InstrumentationPlan":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"unsupported instrumentation plan version: {data.get('version')}")
+        return cls(data.get("skip", ()), data.get("functions", {}),
+                   data.get("hot_threshold", DEFAULT_HOT_THRESHOLD), data.get("skip_never_raised", True))
+
+    @classmethod
+    def from_env(cls) -> Optional["InstrumentationPlan"]:
+        path = os.getenv(PLAN_ENV)
+        if not path:
+            return None
+        try:
+            return cls.load(path)
+        except (OSError, ValueError) as e:
+            get_logger().warning(f"[Plan] Ignoring instrumentation plan {path}: {e}")
+            return None
+
+    def save(self, path: str):
+        data = {
+            "version": PLAN_VERSION,
+            "hot_threshold": self.hot_threshold,
+            "skip_never_raised": self.skip_never_raised,
+            "functions": self.functions,
+            "skip": sorted(self.skip),
+        }
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def should_instrument(self, code: CodeType) -> bool:
+        return plan_key(code) not in self.skip
+
+    def digest(self) -> str:
+        """Short hash of the skip list (part of the code cache key)."""
+        return hashlib.sha1('\n'.join(sorted(self.skip)).encode()).hexdigest()[:16]
+
+class PlanProfiler:
+    """
+    Warm-up run recorder: call and raise counts per target code object.
+
+    Uses sys.settrace, with line events turned off for target frames and no
+    local tracing at all for other code; the run is not instrumented. On exit
+    the counts are turned into an InstrumentationPlan and written to `path`.
+    """
+    def __init__(self, file_matcher, path: str, hot_threshold: int = DEFAULT_HOT_THRESHOLD,
+                 skip_never_raised: bool = True):
+        self.file_matcher = file_matcher
+        self.path = path
+        self.hot_threshold = hot_threshold
+        self.skip_never_raised = skip_never_raised
+        self._targets = {}      # code object -> matched by file_matcher
+        self._calls = {}        # code object -> call count
+        self._raised = {}       # code object -> frames an exception was raised in / passed through
+        self.logger = get_logger()
+
+    @classmethod
+    def from_env(cls, file_matcher) -> Optional["PlanProfiler"]:
+        path = os.getenv(PROFILE_ENV)
+        if not path:
+            return None
+        return cls(file_matcher, path,
+                   int(os.getenv(HOT_THRESHOLD_ENV, DEFAULT_HOT_THRESHOLD)),
+                   not os.getenv(KEEP_NEVER_RAISED_ENV))
+
+    def _trace(self, frame, event, arg):
+        code = frame.f_code
+        hit = self._targets.get(code)
+        if hit is None:
+            hit = self._targets[code] = bool(self.file_matcher.matches(code.co_filename))
+        if not hit:
+            return None
+        self._calls[code] = self._calls.get(code, 0) + 1
+        frame.f_trace_lines = False
+        return self._trace_frame
+
+    def _trace_frame(self, frame, event, arg):
+        if event == 'exception':
+            code = frame.f_code
+            self._raised[code] = self._raised.get(code, 0) + 1
+        return self._trace_frame
+
+    def start(self):
+        threading.settrace(self._trace)
+        sys.settrace(self._trace)
+
+    def stop(self):
+        sys.settrace(None)
+        threading.settrace(None)
+
+    def plan(self) -> InstrumentationPlan:
+        functions = {}
+        for code, calls in self._calls.items():
+            if code.co_name == '<module>':
+                continue
+            stats = functions.setdefault(plan_key(code), {"calls": 0, "raised": 0})
+            stats["calls"] += calls
+            stats["raised"] += self._raised.get(code, 0)
+        return InstrumentationPlan.from_profile(functions, self.hot_threshold, self.skip_never_raised)
+
+    def __enter__(self) -> "PlanProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        plan = self.plan()
+        plan.save(self.path)
+        self.logger.info(f"[Plan] {len(plan.functions)} functions profiled, {len(plan.skip)} skipped, "
+                         f"plan written to {self.path}")
@@ -5,18 +5,23 @@ import inspect
 import traceback
 import marshal
 from types import FrameType, FunctionType, MethodType, CodeType, ModuleType
+from typing import Optional
 
 import ast
 import inspect
 import difflib
+import textwrap
 from pathlib import Path
-from bytecode import Bytecode
+from bytecode import Bytecode, Instr
 
 import axolotl
 import axolotl.mode as mc
+import axolotl.patch as pc
 from .validation import Validater, Mutator
 from .instrumenter import Instrumenter
 from .logger import get_logger, get_reporter
+from .rules import get_exception_rules, REPAIR
+from .resume import resume_enabled, snapshot_args, retry
 from .san2patch.model import BaseModel
 
 PATCH_FOLDER = f"{os.getenv('WDIR')}/patch_file"
@@ -26,19 +31,19 @@ MAX_RECURSION = 3
 def except_handler(e: Exception):
     logger = get_logger()
     reporter = get_reporter()
+    # `e` is rebound (and unbound) by the except clauses below
+    raised = e
     
-    ### origin program except handler blacklist ###
-    IGNORE_EXCEPTIONS = [
-        'SystemExit', 'KeyboardInterrupt', 'GeneratorExit', 'StopIteration',
-        'NotThisMethod', 'SkipTest'
-    ]
-    IGNORE_EXCEPTION_MSG = [
-        'Invalid frequency', 'data type not understood' #pandas exception handler
-    ]
-    ################################################
-
-    except_name = type(e).__name__
-    if (except_name in IGNORE_EXCEPTIONS) or (any(msg in str(e) for msg in IGNORE_EXCEPTION_MSG)):
+    target_source_env = os.getenv("TARGET_SOURCE") 
+    if not target_source_env:
+        target_root = Path(os.getcwd()).resolve()
+    else:
+        target_root = Path(target_source_env).resolve()
+
+    # allow/deny rules and per-site rate limits (see axolotl.rules)
+    verdict = get_exception_rules().check(e, target_root)
+    if verdict != REPAIR:
+        logger.debug(f"Exception {type(e).__name__} not repaired: {verdict}")
         mc.safe_mode()
         return
 
@@ -65,12 +70,6 @@ def except_handler(e: Exception):
     logger.debug(f"{exception_msg}")
     logger.debug("="*96)
 
-    target_source_env = os.getenv("TARGET_SOURCE") 
-    if not target_source_env:
-        target_root = Path(os.getcwd()).resolve()
-    else:
-        target_root = Path(target_source_env).resolve()
-    
     tool_root = Path(axolotl.__file__).parent.resolve()
     innerframes = inspect.getinnerframes(e.__traceback__)
     innerframes.reverse()
@@ -138,9 +137,8 @@ def except_handler(e: Exception):
             final_target_name = outer_func_name
             frame_for_args = found_outer_frame
         else:
-            logger.warning(f"[!] Outer function '{outer_func_name}' is not in the stack (Closure pattern). Skipping this target.")
-            mc.safe_mode()
-            exit(1)
+            # closure pattern: the patch replaces the inner function's code in its function objects
+            logger.info(f"[*] Outer function '{outer_func_name}' is not in the stack (Closure pattern). Repairing '{initial_func_name}' itself.")
     elif outer_func_name:
          logger.info(f"[*] Target '{initial_func_name}' is already a Global Function.")
     else:
@@ -150,25 +148,43 @@ def except_handler(e: Exception):
         raw_frame = getattr(frame_for_args, 'frame', frame_for_args)
         module_globals = raw_frame.f_globals
         
-        if final_target_name in module_globals:
-            real_func_obj = module_globals[final_target_name]
-            save_origin_func_code(real_func_obj, final_target_name)
-            logger.info(f"Successfully saved source code for: {final_target_name}")
+        real_func_obj = module_globals.get(final_target_name)
+        if getattr(real_func_obj, '__code__', None) is raw_frame.f_code:
+            patch_name = final_target_name
         else:
-            logger.error(f"Cannot find '{final_target_name}' in globals. Dynamic extraction required.")
-            return
+            # method, nested function or decorated function: found through its code object
+            real_func_obj = running_function(raw_frame)
+            if real_func_obj is None:
+                logger.error(f"Cannot tell which function object is running '{final_target_name}'.")
+                return
+            patch_name = pc.qualified_name(real_func_obj)
+            pc.save_patch_target(patch_name, raw_frame.f_code)
+            logger.info(f"[*] '{final_target_name}' is not a module global: patching it as '{patch_name}'")
+        save_origin_func_code(real_func_obj, patch_name)
+        logger.info(f"Successfully saved source code for: {patch_name}")
 
     except Exception as exc:
         logger.error(f"Failed to extract/save source code: {exc}")
         return
 
     func_name = final_target_name
+    # a patch of a closure or a method using super() reads the original's closure cells
+    freevars = raw_frame.f_code.co_freevars
+    closure = real_func_obj.__closure__
     
     # 여기서 frame_for_args가 Outer Frame이면 Outer의 인자가, 
     # Inner Frame(Global)이면 본인의 인자가 추출됨 -> Validation 호환성 확보 완료
     args, kwargs = extract_args_kwargs(frame_for_args)
     globals_vars = target_frame.frame.f_globals
 
+    # --resume-in-place: validation runs on copies, the retry gets the failing call's own arguments
+    resume_args = None
+    if resume_enabled():
+        copies = snapshot_args(args, kwargs)
+        if copies is not None:
+            resume_args = (args, kwargs)
+            args, kwargs = copies
+
 
     ## 함수 내부 로컬변수들과 함수에서 사용된 글로벌 변수들 추출
     func_code = target_frame.frame.f_code
@@ -202,7 +218,7 @@ def except_handler(e: Exception):
     model.exception_msg = exception_msg
     model.exception_trace = tb_string
     model.target_line = get_targetline_code(filename, lineno)
-    model.buggy_code = get_origin_func_code(func_name)
+    model.buggy_code = get_origin_func_code(patch_name)
 
     # ablation3: without dynamic context -> run_wo_dc()
     if reporter:
@@ -248,9 +264,9 @@ def except_handler(e: Exception):
             repair_code = patch_code['patched_code']
 
             # orginal validation part 1
-            patch_py = os.path.join(PATCH_FOLDER, f"{func_name}.py")
-            patch_file_path = os.path.join(PATCH_FOLDER, f"{func_name}_patch")
-            patch_val1_file_path = os.path.join(PATCH_FOLDER, f"{func_name}_val1_patch")
+            patch_py = os.path.join(PATCH_FOLDER, f"{patch_name}.py")
+            patch_file_path = os.path.join(PATCH_FOLDER, f"{patch_name}_patch")
+            patch_val1_file_path = os.path.join(PATCH_FOLDER, f"{patch_name}_val1_patch")
             with open(patch_py, 'w') as f:
                 f.write(repair_code)
 
@@ -276,14 +292,7 @@ def except_handler(e: Exception):
 
             try:
                 with open(patch_py, "r") as f:
-                    t = ast.parse(f.read())
-                    p_code = compile(t, str(Path(patch_py).resolve()), "exec").co_consts[0]
-
-                if not isinstance(p_code, CodeType):
-                    for const in compile(t, str(Path(patch_py).resolve()), "exec").co_consts:
-                        if isinstance(const, CodeType) and const.co_name == func_name:
-                            p_code = const
-                            break
+                    p_code = compile_patch(f.read(), str(Path(patch_py).resolve()), func_name, freevars)
                 
                 TE_p_code = sci.insert_try_except_for_patchcode(p_code) #try-except만 넣은거
 
@@ -305,9 +314,9 @@ def except_handler(e: Exception):
             is_valid_part1 = False
             if reporter:
                 with reporter.measure_validation():
-                    is_valid_part1 = val.validate_patch(patch_val1_file_path, func_name, args, kwargs, globals_vars)
+                    is_valid_part1 = val.validate_patch(patch_val1_file_path, func_name, args, kwargs, globals_vars, closure)
             else:
-                is_valid_part1 = val.validate_patch(patch_val1_file_path, func_name, args, kwargs, globals_vars)
+                is_valid_part1 = val.validate_patch(patch_val1_file_path, func_name, args, kwargs, globals_vars, closure)
             
             if is_valid_part1:
                 logger.info(f"Patch_{i}(feedback_{j}) passed validation part1")
@@ -325,9 +334,9 @@ def except_handler(e: Exception):
                 ########################################
                 try:
                     #original_code already compile
-                    og_bc = get_bytecode(model.buggy_code, func_name)
+                    og_bc = get_bytecode(model.buggy_code, func_name, freevars)
                     #patch code already compile
-                    pc_bc = get_bytecode(repair_code, func_name)
+                    pc_bc = get_bytecode(repair_code, func_name, freevars)
                 except Exception as e:
                     logger.error(f"[Val-2] Bytecode conversion failed :{e}")
                     continue
@@ -335,9 +344,9 @@ def except_handler(e: Exception):
                 is_valid_part2 = False
                 if reporter:
                     with reporter.measure_validation():
-                        is_valid_part2 = val.regression_test(func_name, og_bc, pc_bc, args, kwargs, globals_vars)
+                        is_valid_part2 = val.regression_test(func_name, og_bc, pc_bc, args, kwargs, globals_vars, closure)
                 else:
-                    is_valid_part2 = val.regression_test(func_name, og_bc, pc_bc, args, kwargs, globals_vars)
+                    is_valid_part2 = val.regression_test(func_name, og_bc, pc_bc, args, kwargs, globals_vars, closure)
                 
                 if is_valid_part2:
                     logger.info(f"[Val-2] Patch_{i}(feedback_{j}) passed regression tests.")
@@ -378,6 +387,10 @@ def except_handler(e: Exception):
         else:
             logger.error("Max recursion reached.")
 
+    if final_success and resume_args is not None:
+        # CRIU restore stays the fallback if the retry fails
+        retry(patch_name, raw_frame, raised, *resume_args)
+
     if not final_success:
         if ever_pass_validation_part1:
             # L1통과, L2실패
@@ -388,12 +401,70 @@ def except_handler(e: Exception):
         mc.validation_fail_mode()
         sys.exit(1)
 
-def get_bytecode(code_str: str, func_name: str) -> Bytecode:
-    t = ast.parse(code_str)
-    code_obj = compile(t, "<string>", "exec")
-    for const in code_obj.co_consts:
-        if isinstance(const, CodeType) and const.co_name == func_name:
-            return Bytecode.from_code(const)
+def get_bytecode(code_str: str, func_name: str, freevars=()) -> Bytecode:
+    return Bytecode.from_code(compile_patch(code_str, "<string>", func_name, freevars))
+
+_EMPTY = object()
+
+def running_function(frame: FrameType) -> Optional[FunctionType]:
+    """
+    The function object `frame` is running. Closures made by the same `def`
+    share their code, so for a closure it is the one whose cells hold the
+    frame's free variables; None if no function matches, or several with
+    different cells do.
+    """
+    code = frame.f_code
+    functions = pc.functions_of(code)
+    if not code.co_freevars:
+        return functions[0] if functions else None
+    values = frame.f_locals
+    matches = [func for func in functions if _closure_holds(func, values)]
+    if len({tuple(map(id, func.__closure__)) for func in matches}) != 1:
+        return None
+    return matches[0]
+
+def _closure_holds(func: FunctionType, values: dict) -> bool:
+    for name, cell in zip(func.__code__.co_freevars, func.__closure__ or ()):
+        try:
+            contents = cell.cell_contents
+        except ValueError:      # empty cell
+            contents = _EMPTY
+        if values.get(name, _EMPTY) is not contents:
+            return False
+    return True
+
+def compile_patch(source: str, filename: str, func_name: str, freevars=()) -> CodeType:
+    """
+    The code object of `func_name` defined in `source`.
+
+    For a closure or a method (`freevars` of the original) the source is
+    compiled inside a scope defining those names, so the patch reads them
+    from the original's closure cells instead of globals, and its
+    co_freevars are made the original's, in the same order: the code can
+    then replace the original's __code__.
+    """
+    tree = ast.parse(textwrap.dedent(source))
+    if freevars:
+        scope = ast.parse(f"def __ax_scope__():\n    {' = '.join(freevars)} = None\n")
+        scope.body[0].body.extend(tree.body)
+        tree = ast.fix_missing_locations(scope)
+    module = compile(tree, filename, "exec")
+    consts = module.co_consts[0].co_consts if freevars else module.co_consts
+    codes = [const for const in consts if isinstance(const, CodeType)]
+    if not codes:
+        raise ValueError(f"no function '{func_name}' in the patch")
+    const = next((code for code in codes if code.co_name == func_name), codes[0])
+    if const.co_freevars == tuple(freevars):
+        return const
+    unknown = set(const.co_freevars) - set(freevars)
+    if unknown:
+        raise ValueError(f"patch of '{func_name}' uses free variables the original doesn't have: {sorted(unknown)}")
+    bc = Bytecode.from_code(const)
+    bc.freevars = list(freevars)
+    for instr in bc:
+        if isinstance(instr, Instr) and instr.name == 'COPY_FREE_VARS':
+            instr.arg = len(freevars)
+    return bc.to_code()
 
     
 def extract_args_kwargs(frame_info):
@@ -0,0 +1,129 @@
+import os
+import copy
+import inspect
+from types import CodeType, FrameType, FunctionType
+from typing import Any, Dict, Optional, Tuple
+
+import axolotl.mode as mc
+import axolotl.patch as pc
+from . import events
+from .logger import get_logger, get_reporter
+
+RESUME_ENV = "AXOLOTL_RESUME_IN_PLACE"
+# a generator's or coroutine's frame can't hand back a result by returning
+_NOT_RESUMABLE = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+class ResumeSignal:
+    """
+    The result of a repaired call retried in place, on its way to the frame
+    the call failed in. triage.on_exception hands it to that frame's
+    instrumented except path, which returns `value` instead of re-raising.
+    """
+    __slots__ = ('exc', 'frame', 'value')
+
+    def __init__(self, exc: BaseException, frame: FrameType, value: Any):
+        self.exc = exc
+        self.frame = frame
+        self.value = value
+
+_pending: Optional[ResumeSignal] = None
+
+def resume_enabled() -> bool:
+    return os.getenv(RESUME_ENV) == '1'
+
+def resumable(code: CodeType) -> bool:
+    """Whether a frame of `code` can return a retried result (Instrumenter.insert_try_except code)."""
+    return ('__axolotl__' in code.co_consts and 'on_exception' in code.co_names
+            and not code.co_flags & _NOT_RESUMABLE)
+
+def snapshot_args(args: Dict[str, Any], kwargs: Dict[str, Any]) -> Optional[Tuple[dict, dict]]:
+    """Deep copies of a failing call's arguments for validation to use, None if they can't be copied."""
+    try:
+        return copy.deepcopy((args, kwargs))
+    except Exception as e:
+        get_logger().info(f"[Resume] Arguments can't be copied ({type(e).__name__}: {e}), restore only")
+        return None
+
+def retry(patch_name: str, frame: FrameType, exc: BaseException,
+          args: Dict[str, Any], kwargs: Dict[str, Any]) -> bool:
+    """
+    After a validated repair (mode 1): install the patch `patch_name` in
+    this process (patch.install_patch: every function running the failing
+    frame's code) and call it again with the arguments of the failing call.
+
+    On success the patch is published, the process goes back to safe mode
+    and the result is left for the failing `frame` to return (see take()):
+    the program carries on from there without a checkpoint restore. Any
+    failure leaves the process in validation mode, so the exception goes on
+    and the supervisor restores the latest checkpoint as usual.
+    """
+    global _pending
+    logger = get_logger()
+    functions = pc.functions_of(frame.f_code)
+    # closures made by the same `def` share the code: the failing call's one must be the only one
+    if len(functions) != 1 or not resumable(frame.f_code):
+        logger.info(f"[Resume] '{patch_name}' can't be resumed in place, restoring a checkpoint")
+        return False
+
+    func = functions[0]
+    swapped = []
+    try:
+        positional, keywords = _call_args(func, args, kwargs)
+        swapped = pc.install_patch(patch_name, frame.f_code)
+        # still in validation mode: a failure here doesn't start another repair
+        value = func(*positional, **keywords)
+    except Exception as e:
+        pc.revert(swapped)
+        logger.warning(f"[Resume] Retrying '{patch_name}' failed ({type(e).__name__}: {e}), restoring a checkpoint")
+        return False
+
+    pc.publish_patches()
+    mc.safe_mode()
+    # the supervisor tells a resume from a restore by the generation published here
+    events.notify(events.RESUMED)
+    _pending = ResumeSignal(exc, frame, value)
+    logger.info(f"[Resume] '{patch_name}' retried with the patch, resuming in place")
+    reporter = get_reporter()
+    if reporter:
+        reporter.increment_stat("resumed_in_place")
+    return True
+
+def take(exc: BaseException, frame: FrameType) -> Optional[ResumeSignal]:
+    """
+    triage.on_exception, for `exc` propagating through `frame`: the pending
+    ResumeSignal if `frame` is where it goes (the frame then returns its
+    value), None to let the exception go on.
+    """
+    global _pending
+    pending = _pending
+    if pending is None:
+        return None
+    if pending.exc is not exc:
+        # another exception: the resumed one was handled on the way
+        _pending = None
+        return None
+    if pending.frame is not frame:
+        return None
+    _pending = None
+    return pending
+
+def is_pending(exc: BaseException) -> bool:
+    """`exc` is on its way to the frame resuming with a retried result."""
+    return _pending is not None and _pending.exc is exc
+
+def _call_args(func: FunctionType, args: Dict[str, Any], kwargs: Dict[str, Any]):
+    """Positional and keyword arguments that repeat a call from extract_args_kwargs' capture."""
+    positional, keywords = [], {}
+    for name, param in inspect.signature(func).parameters.items():
+        if param.kind == param.VAR_KEYWORD:
+            continue
+        if name not in args:
+            raise ValueError(f"argument '{name}' of the failing call is gone")
+        if param.kind == param.VAR_POSITIONAL:
+            positional.extend(args[name])
+        elif param.kind == param.KEYWORD_ONLY:
+            keywords[name] = args[name]
+        else:
+            positional.append(args[name])
+    keywords.update(kwargs)
+    return positional, keywords
@@ -0,0 +1,132 @@
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .imagestore import ImageStore
+from .logger import get_logger
+
+KEEP_ENV = "AXOLOTL_CHECKPOINT_KEEP"
+MAX_CHAIN_ENV = "AXOLOTL_CHECKPOINT_MAX_CHAIN"
+DISK_BUDGET_ENV = "AXOLOTL_CHECKPOINT_DISK_BUDGET"
+
+DEFAULT_KEEP = 3                # restore points kept
+DEFAULT_MAX_CHAIN = 8           # incremental dumps on top of a full one before the next full dump
+DEFAULT_DISK_BUDGET = 0         # MiB of images, 0 = unlimited
+
+def dir_size(path: str) -> int:
+    """Bytes of the images in one checkpoint directory (the parent symlink not followed)."""
+    try:
+        return sum(p.stat().st_size for p in Path(path).iterdir() if p.is_file() and not p.is_symlink())
+    except OSError:
+        return 0
+
+class CheckpointChain:
+    """
+    Which checkpoints of the ImageStore are kept.
+
+    Incremental dumps (--track-mem --prev-images-dir) only hold the pages
+    dirtied since their parent, so restoring one needs its whole chain down to
+    the last full dump: nothing can be deleted from the middle of a chain and
+    restore time grows with its depth. Instead the chain is rebased: once it
+    is `max_chain` dumps deep the next dump is a full one (no parent), and the
+    dumps older than it become unreferenced once they drop out of the last
+    `keep` restore points. Those are deleted after every dump.
+
+    With a `disk_budget` (bytes), going over it rebases early and drops the
+    oldest restore points, down to the latest one, until the images fit.
+
+    Dropped checkpoints go to `discard` (SnapshotBackend.discard), which
+    removes the directory and whatever else the snapshot holds.
+    """
+    def __init__(self, store: ImageStore, keep: int = DEFAULT_KEEP, max_chain: int = DEFAULT_MAX_CHAIN,
+                 disk_budget: int = DEFAULT_DISK_BUDGET, discard: Optional[Callable[[str], None]] = None):
+        self.store = store
+        self.discard = discard or (lambda images_dir: shutil.rmtree(images_dir, ignore_errors=True))
+        self.keep = max(keep, 1)
+        self.max_chain = max(max_chain, 0)
+        self.disk_budget = disk_budget
+        self.parents: Dict[int, Optional[int]] = {}     # checkpoint -> its parent (None: full dump)
+        self.sizes: Dict[int, int] = {}
+        self.full_dumps = 0
+        self.pruned = 0
+        self.rebase = False
+        self.logger = get_logger()
+
+    @classmethod
+    def from_env(cls, store: ImageStore, discard: Optional[Callable[[str], None]] = None) -> "CheckpointChain":
+        return cls(store, int(os.getenv(KEEP_ENV, DEFAULT_KEEP)),
+                   int(os.getenv(MAX_CHAIN_ENV, DEFAULT_MAX_CHAIN)),
+                   int(float(os.getenv(DISK_BUDGET_ENV, DEFAULT_DISK_BUDGET)) * 1024 * 1024), discard)
+
+    def reset(self):
+        """A new checkpoints<N>/ directory: start over with a full dump."""
+        self.parents.clear()
+        self.sizes.clear()
+        self.rebase = False
+
+    def parent_for(self, num: int) -> Optional[int]:
+        """The checkpoint the dump `num` is taken on top of, None for a full dump."""
+        previous = num - 1
+        if previous not in self.parents or self.rebase or self.depth(previous) >= self.max_chain:
+            return None
+        return previous
+
+    def add(self, num: int, parent: Optional[int]):
+        self.parents[num] = parent
+        self.sizes[num] = dir_size(self.store.path(num))
+        if parent is None:
+            self.full_dumps += 1
+            self.rebase = False
+        self.prune()
+
+    def depth(self, num: int) -> int:
+        """Incremental dumps between `num` and its full dump (0 for a full dump)."""
+        depth = 0
+        parent = self.parents.get(num)
+        while parent is not None:
+            depth += 1
+            parent = self.parents.get(parent)
+        return depth
+
+    def chain(self, num: int) -> List[int]:
+        """`num` and every checkpoint restoring it needs."""
+        chain = []
+        while num is not None:
+            chain.append(num)
+            num = self.parents.get(num)
+        return chain
+
+    def size(self) -> int:
+        return sum(self.sizes.values())
+
+    def prune(self):
+        """Delete the checkpoints no kept restore point needs; enforce the disk budget."""
+        with self.store.lock:
+            self._prune()
+        self.store.committed(list(self.parents))
+
+    def _prune(self):
+        points = sorted(self.parents)[-self.keep:]
+        while True:
+            needed = {n for point in points for n in self.chain(point)}
+            if not self.disk_budget or len(points) == 1 or \
+                    sum(self.sizes[n] for n in needed) <= self.disk_budget:
+                break
+            points = points[1:]
+        if self.disk_budget and sum(self.sizes[n] for n in needed) > self.disk_budget and len(needed) > 1:
+            # only a full dump frees the latest chain
+            self.rebase = True
+
+        for num in sorted(set(self.parents) - needed):
+            self.discard(self.store.path(num))
+            del self.parents[num]
+            del self.sizes[num]
+            self.pruned += 1
+            self.logger.debug(f'[CRIU] Pruned checkpoint {num}')
+
+    def stats(self) -> dict:
+        latest = max(self.parents, default=None)
+        return {"checkpoints": len(self.parents), "chain_depth": self.depth(latest) if latest is not None else 0,
+                "chain_bytes": sum(self.sizes[n] for n in self.chain(latest)) if latest is not None else 0,
+                "total_bytes": self.size(), "full_dumps": self.full_dumps, "pruned": self.pruned}
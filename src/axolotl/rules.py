@@ -0,0 +1,216 @@
+import os
+import json
+import time
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .logger import get_logger, get_reporter
+from .plan import plan_key
+
+RULES_ENV = "AXOLOTL_EXCEPTION_RULES"      # rules file applied by except_handler
+SITES_FILE = "exception_sites.json"        # per-site counters, in WDIR
+
+RULES_VERSION = 1
+DEFAULT_MAX_REPAIRS = 3
+DEFAULT_RATE_LIMIT = {"count": 5, "window": 60.0}
+
+# verdicts
+REPAIR = 'repair'           # run the repair pipeline
+IGNORE = 'ignore'           # a deny rule matched
+DEMOTE = 'demote'           # the site exceeded its rate limit: skipped until the window passes
+QUARANTINE = 'quarantine'   # the site used up its repair attempts: skipped for the rest of the run
+
+# the origin program's own handlers take care of these
+DEFAULT_RULES = [
+    {"action": IGNORE, "type": ["SystemExit", "KeyboardInterrupt", "GeneratorExit", "StopIteration",
+                                "NotThisMethod", "SkipTest"]},
+    {"action": IGNORE, "message": ["Invalid frequency", "data type not understood"]},     # pandas
+]
+
+def init_exception_sites(wdir: str):
+    """Start the run with no site counters (supervisor side)."""
+    with open(os.path.join(wdir, SITES_FILE), 'w') as f:
+        json.dump({}, f)
+    os.chmod(os.path.join(wdir, SITES_FILE), 0o666)
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+class ExceptionRule:
+    """
+    One allow/deny rule. Every given field must match:
+
+        type      exception class name (or module.qualname) of the exception or a base class
+        message   substring of str(exception)
+        file      fnmatch pattern of the raising site's file
+        function  fnmatch pattern of the raising site's function name
+        line      line number of the raising site
+
+    A field given as a list matches if any of its entries does.
+    """
+    def __init__(self, action: str, type=None, message=None, file=None, function=None, line=None):
+        if action not in (REPAIR, IGNORE):
+            raise ValueError(f"unknown exception rule action: {action}")
+        self.action = action
+        self.types = _as_list(type)
+        self.messages = _as_list(message)
+        self.files = _as_list(file)
+        self.functions = _as_list(function)
+        self.lines = _as_list(line)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExceptionRule":
+        return cls(data.get("action", IGNORE), data.get("type"), data.get("message"), data.get("file"),
+                   data.get("function"), data.get("line"))
+
+    def matches(self, e: BaseException, filename: str, function: str, lineno: int) -> bool:
+        if self.types:
+            names = set()
+            for klass in type(e).__mro__:
+                names.add(klass.__name__)
+                names.add(f"{klass.__module__}.{klass.__qualname__}")
+            if not names.intersection(self.types):
+                return False
+        if self.messages and not any(msg in str(e) for msg in self.messages):
+            return False
+        if self.files and not any(fnmatch(filename, pattern) for pattern in self.files):
+            return False
+        if self.functions and not any(fnmatch(function, pattern) for pattern in self.functions):
+            return False
+        if self.lines and lineno not in self.lines:
+            return False
+        return True
+
+class ExceptionRules:
+    """
+    Decides whether an exception that reached except_handler enters repair.
+
+    Each exception is fingerprinted by its type and raising site (code object
+    and line). Rules are checked first, first match wins: an "ignore" rule
+    skips repair, a "repair" rule always repairs. Otherwise a site is demoted
+    while it raises more than `rate_limit` times within its window, and
+    quarantined once it used up `max_repairs` repair attempts.
+
+    Rules come from a JSON file (`python -m axolotl --exception-rules FILE`):
+
+        {
+          "version": 1,
+          "max_repairs": 3,
+          "rate_limit": {"count": 5, "window": 60},
+          "defaults": true,               # keep DEFAULT_RULES after the file's rules
+          "rules": [
+            {"action": "ignore", "type": "ConnectionResetError"},
+            {"action": "ignore", "file": "*/migrations/*"},
+            {"action": "repair", "type": "KeyError", "function": "parse_*"}
+          ]
+        }
+
+    Counters live in WDIR/exception_sites.json rather than in memory, so they
+    survive the checkpoint restores between repair attempts; they are also
+    exported to AxolotlReporter.
+    """
+    def __init__(self, rules: List[ExceptionRule] = None, max_repairs: int = DEFAULT_MAX_REPAIRS,
+                 rate_limit: Optional[dict] = None, sites_path: Optional[str] = None):
+        self.rules = rules if rules is not None else [ExceptionRule.from_dict(r) for r in DEFAULT_RULES]
+        self.max_repairs = max_repairs
+        self.rate_limit = rate_limit if rate_limit is not None else dict(DEFAULT_RATE_LIMIT)
+        self.sites_path = sites_path or os.path.join(os.getenv('WDIR', '.'), SITES_FILE)
+
+    @classmethod
+    def load(cls, path: str) -> "ExceptionRules":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != RULES_VERSION:
+            raise ValueError(f"unsupported exception rules version: {data.get('version')}")
+        rules = [ExceptionRule.from_dict(r) for r in data.get("rules", [])]
+        if data.get("defaults", True):
+            rules += [ExceptionRule.from_dict(r) for r in DEFAULT_RULES]
+        return cls(rules, data.get("max_repairs", DEFAULT_MAX_REPAIRS), data.get("rate_limit", DEFAULT_RATE_LIMIT))
+
+    @classmethod
+    def from_env(cls) -> "ExceptionRules":
+        path = os.getenv(RULES_ENV)
+        if path:
+            try:
+                return cls.load(path)
+            except (OSError, ValueError) as e:
+                get_logger().warning(f"[Rules] Ignoring exception rules {path}: {e}")
+        return cls()
+
+    @staticmethod
+    def site(e: BaseException, target_root: Optional[Path] = None):
+        """(fingerprint, filename, function, lineno) of the frame the exception was raised in.
+
+        That is the innermost traceback frame under `target_root`, or the
+        innermost one if none is.
+        """
+        tb, site_tb, innermost = e.__traceback__, None, None
+        while tb is not None:
+            innermost = tb
+            if target_root is None or target_root in Path(tb.tb_frame.f_code.co_filename).resolve().parents:
+                site_tb = tb
+            tb = tb.tb_next
+        site_tb = site_tb or innermost
+        if site_tb is None:
+            return f"{type(e).__qualname__}@<unknown>", '', '', 0
+        code = site_tb.tb_frame.f_code
+        return f"{type(e).__qualname__}@{plan_key(code)}:{site_tb.tb_lineno}", \
+            code.co_filename, code.co_name, site_tb.tb_lineno
+
+    def check(self, e: BaseException, target_root: Optional[Path] = None) -> str:
+        """Verdict for `e` (REPAIR, IGNORE, DEMOTE or QUARANTINE); updates the site's counters."""
+        fingerprint, filename, function, lineno = self.site(e, target_root)
+        sites = self._load_sites()
+        now = time.time()
+        stats = sites.setdefault(fingerprint, {"seen": 0, "repairs": 0, "ignored": 0, "demoted": 0,
+                                               "quarantined": 0, "first_seen": now, "recent": []})
+        stats["seen"] += 1
+        stats["last_seen"] = now
+        window = self.rate_limit.get("window", 0) if self.rate_limit else 0
+        stats["recent"] = [t for t in stats["recent"] if now - t < window] + [now]
+
+        rule = next((r for r in self.rules if r.matches(e, filename, function, lineno)), None)
+        if rule is not None and rule.action == IGNORE:
+            verdict = IGNORE
+        elif rule is not None:
+            verdict = REPAIR
+        elif self.max_repairs is not None and stats["repairs"] >= self.max_repairs:
+            verdict = QUARANTINE
+        elif window and len(stats["recent"]) > self.rate_limit.get("count", 0):
+            verdict = DEMOTE
+        else:
+            verdict = REPAIR
+
+        stats[{REPAIR: "repairs", IGNORE: "ignored", DEMOTE: "demoted", QUARANTINE: "quarantined"}[verdict]] += 1
+        stats["status"] = verdict
+        self._save_sites(sites)
+
+        reporter = get_reporter()
+        if reporter:
+            reporter.record_exception_sites(sites)
+        return verdict
+
+    def _load_sites(self) -> Dict[str, dict]:
+        try:
+            with open(self.sites_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_sites(self, sites: Dict[str, dict]):
+        try:
+            with open(self.sites_path, 'w') as f:
+                json.dump(sites, f, indent=2)
+        except OSError as e:
+            get_logger().error(f"[Rules] Failed to save exception site counters: {e}")
+
+_rules = None
+
+def get_exception_rules() -> ExceptionRules:
+    global _rules
+    if _rules is None:
+        _rules = ExceptionRules.from_env()
+    return _rules
@@ -0,0 +1,107 @@
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from .logger import get_logger
+
+BUDGET_ENV = "AXOLOTL_CHECKPOINT_BUDGET"
+MIN_INTERVAL_ENV = "AXOLOTL_CHECKPOINT_MIN_INTERVAL"
+MAX_INTERVAL_ENV = "AXOLOTL_CHECKPOINT_MAX_INTERVAL"
+
+DEFAULT_BUDGET = 0.05           # fraction of wall-clock time the target may spend frozen in dumps
+DEFAULT_MIN_INTERVAL = 0.25
+DEFAULT_MAX_INTERVAL = 10.0
+INITIAL_INTERVAL = 1.0
+# a dump writing no more than this is of an idle target: back off
+IDLE_BYTES = 16 * 4096
+SMOOTHING = 0.5                 # weight of the latest dump in the moving averages
+
+def dumped_bytes(images_dir: str) -> int:
+    """Page data written by one dump (with --track-mem only the pages dirtied since the previous one)."""
+    try:
+        return sum(p.stat().st_size for p in Path(images_dir).glob('pages-*.img'))
+    except OSError:
+        return 0
+
+class CheckpointScheduler:
+    """
+    When the supervisor takes the next incremental checkpoint in safe mode.
+
+    The target is frozen while CRIU dumps it, so the interval is chosen to
+    keep dump time within `budget` of wall-clock time: after each dump
+
+        interval = average dump duration / budget
+
+    clamped to [min_interval, max_interval], so a target that dumps cheaply
+    is checkpointed often and an expensive one rarely. A dump that wrote
+    almost no pages means nothing changed since the previous one, and the
+    interval doubles instead. The dirty rate (bytes per second between dumps)
+    is tracked for the logs and the reporter.
+
+    The target can ask for a checkpoint at a good moment, e.g. a request
+    boundary, with axolotl.checkpoint_hint(); the checkpoint is taken as soon
+    as min_interval has passed since the previous one.
+    """
+    def __init__(self, budget: float = DEFAULT_BUDGET, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = DEFAULT_MAX_INTERVAL):
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min(max(INITIAL_INTERVAL, self.min_interval), self.max_interval)
+        self.duration = None        # moving average of dump durations (s)
+        self.dirty_rate = None      # moving average of dumped bytes per second of run time
+        self.last_dump = None       # monotonic time the previous dump finished
+        self.hinted = False
+        self.logger = get_logger()
+
+    @classmethod
+    def from_env(cls) -> "CheckpointScheduler":
+        return cls(float(os.getenv(BUDGET_ENV, DEFAULT_BUDGET)),
+                   float(os.getenv(MIN_INTERVAL_ENV, DEFAULT_MIN_INTERVAL)),
+                   float(os.getenv(MAX_INTERVAL_ENV, DEFAULT_MAX_INTERVAL)))
+
+    def reset(self):
+        """A restored target starts a new checkpoint chain: the next dump is due now."""
+        self.last_dump = None
+        self.hinted = False
+
+    def next_due(self) -> float:
+        """Monotonic time of the next checkpoint (0.0: due now)."""
+        if self.last_dump is None:
+            return 0.0
+        if self.hinted:
+            return self.last_dump + self.min_interval
+        return self.last_dump + self.interval
+
+    def hint(self):
+        self.hinted = True
+
+    def record(self, duration: float, nbytes: Optional[int], finished: Optional[float] = None):
+        """
+        Feed back one dump: how long the target was frozen and how much page
+        data it wrote (None if the snapshot backend writes no pages).
+        """
+        finished = finished if finished is not None else time.monotonic()
+        if self.last_dump is not None and nbytes is not None:
+            elapsed = max(finished - duration - self.last_dump, 1e-3)
+            self.dirty_rate = self._average(self.dirty_rate, nbytes / elapsed)
+        self.duration = self._average(self.duration, duration)
+        self.last_dump = finished
+        self.hinted = False
+
+        if nbytes is not None and nbytes <= IDLE_BYTES:
+            interval = self.interval * 2
+        else:
+            interval = self.duration / self.budget if self.budget > 0 else self.max_interval
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.logger.debug(f"[Checkpoint] dump {duration:.3f}s, {nbytes if nbytes is not None else '-'} bytes, "
+                          f"dirty rate {self.dirty_rate or 0:.0f} B/s -> next in {self.interval:.2f}s")
+
+    @staticmethod
+    def _average(current: Optional[float], value: float) -> float:
+        return value if current is None else SMOOTHING * value + (1 - SMOOTHING) * current
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "avg_dump_duration": self.duration, "dirty_rate": self.dirty_rate,
+                "budget": self.budget}
@@ -0,0 +1,36 @@
+import os
+import sys
+import mmap
+
+class SharedWord:
+    """
+    A single signed 64-bit integer kept in a MAP_SHARED file mapping.
+
+    The supervisor and the target map the same file, so reads are plain memory
+    loads. Because the mapping is file-backed, CRIU re-maps the file on restore
+    instead of restoring a stale copy, and writes stay visible across dump/restore.
+    """
+    SIZE = 8
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'r+b') as f:
+            self._map = mmap.mmap(f.fileno(), self.SIZE)
+        self.view = memoryview(self._map).cast('q')
+
+    @classmethod
+    def create(cls, path: str, value: int = 0) -> "SharedWord":
+        with open(path, 'wb') as f:
+            f.write(value.to_bytes(cls.SIZE, sys.byteorder, signed=True))
+        os.chmod(path, 0o666)
+        return cls(path)
+
+    def get(self) -> int:
+        return self.view[0]
+
+    def set(self, value: int):
+        self.view[0] = value
+
+    def close(self):
+        self.view.release()
+        self._map.close()
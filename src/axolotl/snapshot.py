@@ -0,0 +1,361 @@
+import os
+import time
+import ctypes
+import shutil
+import signal
+import threading
+import subprocess
+from typing import Optional
+
+import psutil
+
+import axolotl.mode as mc
+from . import events
+from .logger import get_logger
+from .metrics import read_criu_stats, STATS_DUMP, STATS_RESTORE
+from .scheduler import dumped_bytes
+
+# upper bound for a restore to bring the target back
+RESTORE_TIMEOUT = 30.0
+# how long a cancelled `criu dump` gets to clean up before it is killed
+DUMP_CANCEL_TIMEOUT = 5.0
+
+# snapshot backends selectable from `python -m axolotl --snapshot-backend ...`
+SNAPSHOT_BACKENDS = ('criu', 'fork')
+SNAPSHOT_BACKEND_ENV = "AXOLOTL_SNAPSHOT_BACKEND"
+
+# criu backend: in WDIR, the root pid of the restored tree
+RESTORE_PIDFILE = 'restore.pid'
+
+# fork backend: sent by the supervisor to the target to take a snapshot
+SNAPSHOT_SIGNAL = signal.SIGUSR2
+SNAPSHOT_REQUEST = 'snapshot_request'   # in WDIR: the images directory the next snapshot goes to
+SNAPSHOT_PID = 'snapshot.pid'           # in the images directory: the paused snapshot process
+RESTORED_PID = 'restored.pid'           # in the images directory: the target the last restore forked off
+# the target installs its SNAPSHOT_SIGNAL handler at startup; until then the signal would kill it
+READY_TIMEOUT = 10.0
+PR_SET_CHILD_SUBREAPER = 36
+
+class SnapshotError(Exception):
+    pass
+
+def become_subreaper():
+    """
+    Make orphaned descendants (a `criu restore --restore-detached` tree, the
+    fork snapshots of a dead target) children of the supervisor, so their
+    exit can be waited for and reaped.
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    except (OSError, AttributeError):
+        get_logger().warning('[Snapshot] Could not become child subreaper')
+
+def reap_children():
+    """Reap exited targets and snapshots re-parented to the supervisor."""
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+class SnapshotBackend:
+    """
+    How the supervisor (Checkpoint) snapshots and restores the target.
+
+    A snapshot lives in an images directory. dump() only starts it: it
+    returns a process whose exit means the dump finished, or None when the
+    target reports completion itself with an events.DUMP datagram; either
+    way Checkpoint calls dump_done() on the DUMP event. restore() brings a
+    snapshot back stopped and returns its pid; Checkpoint installs patches
+    and resumes it.
+    """
+    name = None
+    # dumps can be taken on top of a parent snapshot (see CheckpointChain)
+    incremental = False
+    # images directories can be moved between tiers (see ImageStore)
+    movable_images = False
+
+    def dump(self, proc: psutil.Process, images_dir: str,
+             prev_images_dir: Optional[str]) -> Optional[subprocess.Popen]:
+        raise NotImplementedError
+
+    def dump_done(self, handle, images_dir: str) -> Optional[bool]:
+        """True once the dump finished, False if it failed, None while it is still running."""
+        raise NotImplementedError
+
+    def cancel(self, handle, proc: psutil.Process, images_dir: str):
+        raise NotImplementedError
+
+    def restore(self, images_dir: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def dumped_bytes(self, images_dir: str) -> Optional[int]:
+        """Page data the dump wrote (see CheckpointScheduler), None if it writes none."""
+        return None
+
+    def dump_stats(self, images_dir: str) -> dict:
+        """What the backend measured of a finished dump (see CheckpointMetrics), {} if nothing."""
+        return {}
+
+    def restore_stats(self, images_dir: str) -> dict:
+        """What the backend measured of the last restore of `images_dir`, {} if nothing."""
+        return {}
+
+    def discard(self, images_dir: str):
+        """Drop a snapshot that is no longer kept."""
+        shutil.rmtree(images_dir, ignore_errors=True)
+
+    def close(self, images_dirs):
+        """End of the run: release what the kept snapshots hold besides their files."""
+        reap_children()
+
+class CriuBackend(SnapshotBackend):
+    """
+    `criu dump` / `criu restore` of the whole process tree. Needs root and a
+    CRIU install; incremental dumps (--track-mem) only write dirtied pages.
+
+    Restores are detached (--restore-detached): criu exits once the tree is
+    back, stopped, and leaves the root pid in a pidfile. The tree is then
+    re-parented to the supervisor, its subreaper.
+    """
+    name = 'criu'
+    incremental = True
+    movable_images = True
+
+    def __init__(self, wdir: str, main_pid: int):
+        # the supervisor's time namespace is external to the dumped tree
+        self.main_pid = main_pid
+        self.pidfile = os.path.join(wdir, RESTORE_PIDFILE)
+        become_subreaper()
+
+    def dump(self, proc, images_dir, prev_images_dir):
+        cmd = ['criu', 'dump','--tree',str(proc.pid),
+               '--images-dir',images_dir,
+               '--leave-running', '--track-mem','--shell-job','-v1','--tcp-established']
+
+        cmd.append('--external')
+        cmd.append(f'/proc/{self.main_pid}/ns/time')
+
+        if prev_images_dir is not None:
+            cmd.append('--prev-images-dir')
+            cmd.append(prev_images_dir)
+        return subprocess.Popen(cmd)
+
+    def dumped_bytes(self, images_dir):
+        return dumped_bytes(images_dir)
+
+    def dump_stats(self, images_dir):
+        return read_criu_stats(os.path.join(images_dir, STATS_DUMP))
+
+    def restore_stats(self, images_dir):
+        return read_criu_stats(os.path.join(images_dir, STATS_RESTORE))
+
+    def dump_done(self, handle, images_dir):
+        returncode = handle.poll()
+        return None if returncode is None else returncode == 0
+
+    def cancel(self, handle, proc, images_dir):
+        if handle.poll() is None:
+            handle.terminate()
+            try:
+                handle.wait(DUMP_CANCEL_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                handle.kill()
+                handle.wait()
+            # a criu killed half way may leave the tree stopped
+            try:
+                os.kill(proc.pid, signal.SIGCONT)
+            except ProcessLookupError:
+                pass
+        shutil.rmtree(images_dir, ignore_errors=True)
+
+    def restore(self, images_dir):
+        cmd=['criu','restore','-v1','--shell-job','-D',images_dir,
+             '--tcp-established'
+            ]
+
+        cmd.append('-J')
+        cmd.append(f'time:/proc/{self.main_pid}/ns/time')
+
+        # the target comes back stopped once it is fully restored
+        cmd.append('--leave-stopped')
+        cmd += ['--restore-detached', '--pidfile', self.pidfile]
+
+        try:
+            os.remove(self.pidfile)
+        except OSError:
+            pass
+        try:
+            res = subprocess.run(cmd, timeout=RESTORE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            return None
+        if res.returncode != 0:
+            return None
+        try:
+            with open(self.pidfile) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+class ForkBackend(SnapshotBackend):
+    """
+    Copy-on-write snapshots with os.fork(), no privileges needed.
+
+    On SNAPSHOT_SIGNAL the target forks; the child writes its pid to the
+    images directory, reports events.DUMP and stops itself. The stopped child
+    shares all memory with the target copy-on-write, so a snapshot costs
+    about a fork. Restoring resumes the snapshot, which forks once more and
+    stops again: the new child returns from the signal handler and carries
+    on from the snapshot point as the target, and the snapshot can be
+    restored again, like a CRIU image.
+
+    Only the thread that handles the signal (the main thread) is snapshotted,
+    and nothing outside the process (files, sockets, child processes) is:
+    meant for single-process, single-threaded targets.
+
+    The supervisor becomes the child subreaper, so the snapshots of a target
+    that died are re-parented to it and can be resumed and reaped.
+    """
+    name = 'fork'
+
+    def __init__(self, wdir: str):
+        self.request_path = os.path.join(wdir, SNAPSHOT_REQUEST)
+        become_subreaper()
+
+    def dump(self, proc, images_dir, prev_images_dir):
+        if not self._wait_ready(proc.pid):
+            raise SnapshotError(f'process {proc.pid} does not handle {SNAPSHOT_SIGNAL.name}')
+        tmp = f'{self.request_path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(images_dir)
+        os.replace(tmp, self.request_path)
+        os.kill(proc.pid, SNAPSHOT_SIGNAL)
+        return None
+
+    def dump_done(self, handle, images_dir):
+        return True if os.path.exists(os.path.join(images_dir, SNAPSHOT_PID)) else None
+
+    def cancel(self, handle, proc, images_dir):
+        try:
+            os.remove(self.request_path)
+        except OSError:
+            pass
+        # a snapshot taken from now on finds no images directory and exits
+        self.discard(images_dir)
+
+    def restore(self, images_dir):
+        pid = self._snapshot_pid(images_dir)
+        if pid is None or not events.wait_until_stopped(pid, RESTORE_TIMEOUT):
+            return None
+        restored_path = os.path.join(images_dir, RESTORED_PID)
+        try:
+            os.remove(restored_path)
+        except OSError:
+            pass
+        os.kill(pid, signal.SIGCONT)
+        deadline = time.monotonic() + RESTORE_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                with open(restored_path) as f:
+                    return int(f.read())
+            except (OSError, ValueError):
+                time.sleep(0.001)
+        return None
+
+    def discard(self, images_dir):
+        self._kill(self._snapshot_pid(images_dir))
+        shutil.rmtree(images_dir, ignore_errors=True)
+        reap_children()
+
+    def close(self, images_dirs):
+        for images_dir in images_dirs:
+            self._kill(self._snapshot_pid(images_dir))
+        reap_children()
+
+    @staticmethod
+    def _kill(pid: Optional[int]):
+        if pid is None:
+            return
+        try:
+            os.kill(pid, signal.SIGKILL)
+            # only a child of the supervisor once its target died; reaped by reap_children after that
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    @staticmethod
+    def _snapshot_pid(images_dir: str) -> Optional[int]:
+        try:
+            with open(os.path.join(images_dir, SNAPSHOT_PID)) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _wait_ready(pid: int) -> bool:
+        """Wait for the target to catch SNAPSHOT_SIGNAL (the SigCgt mask in /proc/PID/status)."""
+        bit = 1 << (SNAPSHOT_SIGNAL - 1)
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    caught = next((int(line.split()[1], 16) for line in f if line.startswith('SigCgt:')), 0)
+            except OSError:
+                return False
+            if caught & bit:
+                return True
+            time.sleep(0.005)
+        return False
+
+def get_snapshot_backend(wdir: str, main_pid: int) -> SnapshotBackend:
+    name = os.getenv(SNAPSHOT_BACKEND_ENV, 'criu')
+    if name == 'fork':
+        return ForkBackend(wdir)
+    return CriuBackend(wdir, main_pid)
+
+# ---- target side (fork backend) -------------------------------------------
+
+def install_snapshot_handler():
+    """Take fork snapshots on SNAPSHOT_SIGNAL (target side, main thread)."""
+    if os.getenv(SNAPSHOT_BACKEND_ENV) == 'fork' and threading.current_thread() is threading.main_thread():
+        signal.signal(SNAPSHOT_SIGNAL, _on_snapshot_signal)
+
+def _on_snapshot_signal(signum, frame):
+    # a request cancelled by repair is gone: no snapshot of the failing state
+    if mc.mode_check() != '0':
+        return
+    request_path = os.path.join(os.getenv('WDIR', '.'), SNAPSHOT_REQUEST)
+    try:
+        with open(request_path) as f:
+            images_dir = f.read()
+        os.remove(request_path)
+    except OSError:
+        return
+
+    if os.fork() != 0:
+        return
+    try:
+        _write_pid(os.path.join(images_dir, SNAPSHOT_PID), os.getpid())
+    except OSError:
+        os._exit(0)
+    events.notify(events.DUMP)
+    while True:
+        # paused until the supervisor restores this snapshot (or kills it)
+        os.kill(os.getpid(), signal.SIGSTOP)
+        pid = os.fork()
+        if pid == 0:
+            # the restored target: stopped until the supervisor resumes it
+            os.kill(os.getpid(), signal.SIGSTOP)
+            return
+        try:
+            _write_pid(os.path.join(images_dir, RESTORED_PID), pid)
+        except OSError:
+            os.kill(pid, signal.SIGKILL)
+
+def _write_pid(path: str, pid: int):
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(str(pid))
+    os.replace(f'{path}.tmp', path)
@@ -5,11 +5,17 @@ from typing import Any, Dict
 import os
 import runpy
 import pickle
+import atexit
 import traceback
 
-from axolotl.instrumenter import Instrumenter
+from axolotl.instrumenter import Instrumenter, bind_runtime_globals
 from axolotl.loader import RuntimeAPRFileMatcher, RuntimeAPRImportManager
-from axolotl.logger import setup_logger, get_logger
+from axolotl.cache import InstrumentedCodeCache
+from axolotl.monitoring import MonitoringBackend, monitoring_available, BACKEND_ENV
+from axolotl.plan import InstrumentationPlan, PlanProfiler, PROFILE_ENV
+from axolotl.lazy import lazy_enabled, set_instrumenter
+from axolotl.snapshot import install_snapshot_handler
+from axolotl.logger import setup_logger, get_logger, get_reporter
 
 INST_BLACKLIST = ['test', 'blib2to3', '__init__', 'tests',
                   'managers', # pandas
@@ -23,10 +29,38 @@ def load_file_matcher():
             return pickle.load(f)
     return RuntimeAPRFileMatcher() 
 
+def load_code_cache(sci):
+    code_cache = InstrumentedCodeCache.from_env(sci)
+    if code_cache is not None:
+        atexit.register(report_code_cache, code_cache)
+    return code_cache
+
+def report_code_cache(code_cache):
+    reporter = get_reporter()
+    if reporter:
+        reporter.record_code_cache(code_cache.stats())
+
+def use_monitoring_backend():
+    backend = os.getenv(BACKEND_ENV, 'bytecode')
+    if backend == 'monitoring' and not monitoring_available():
+        get_logger().warning("[!] sys.monitoring needs Python 3.12+, falling back to the bytecode backend")
+        return False
+    return backend == 'monitoring'
+
+def profiling_plan():
+    return bool(os.getenv(PROFILE_ENV))
+
+def capture_backend(sci, file_matcher):
+    if profiling_plan():
+        return PlanProfiler.from_env(file_matcher)
+    if use_monitoring_backend():
+        return MonitoringBackend(file_matcher)
+    return RuntimeAPRImportManager(sci, file_matcher, code_cache=load_code_cache(sci))
+
 def run_script_mode(file_path):
     logger = get_logger()
     file_matcher = load_file_matcher()
-    sci = Instrumenter()
+    sci = Instrumenter(plan=InstrumentationPlan.from_env(), lazy=lazy_enabled())
 
     sci.throw_exception_when_error = True
     sci.is_script_mode = True
@@ -38,28 +72,31 @@ def run_script_mode(file_path):
     script_globals['__name__'] = '__main__'
     script_globals['__file__'] = file_path
     script_globals['axolotl'] = sys.modules.get('axolotl')
+    bind_runtime_globals(script_globals)
     
     with open(file_path, "r") as f:
         t = ast.parse(f.read())
         code = compile(t, str(Path(file_path).resolve()), "exec")
 
+    if not use_monitoring_backend() and not profiling_plan():
+        set_instrumenter(sci)
         code = sci.insert_try_except(code)
         logger.debug("Instrumentation complete for script.")
 
-    with RuntimeAPRImportManager(sci, file_matcher):
+    with capture_backend(sci, file_matcher):
         exec(code, script_globals)
 
 def run_module_mode(module_name):
     logger=get_logger()
     file_matcher = load_file_matcher()
-    sci = Instrumenter()
+    sci = Instrumenter(plan=InstrumentationPlan.from_env(), lazy=lazy_enabled())
 
     sys.argv = sys.argv[3:]
     for kw in INST_BLACKLIST:
         file_matcher.addExcludeKeyword(kw)
 
     try:
-        with RuntimeAPRImportManager(sci, file_matcher):
+        with capture_backend(sci, file_matcher):
             runpy.run_module(module_name, run_name='__main__', alter_sys=True)
     except Exception as e:
         logger.error(f"[Module Mode] Execution failed: ")
@@ -75,6 +112,8 @@ if __name__ == '__main__':
         setup_logger(wdir)
     
     logger = get_logger()
+    # fork snapshot backend: snapshots are taken on the supervisor's signal
+    install_snapshot_handler()
     
     if len(sys.argv) < 3:
         logger.error("Invalid arguments passed to submodule.")
@@ -0,0 +1,364 @@
+import sys
+import dis
+from bisect import bisect_right
+from collections import OrderedDict
+from types import CodeType, FrameType
+
+import axolotl.mode as mc
+from . import resume
+
+PYTHON_VERSION = sys.version_info[:2]
+USE_EXCEPTION_TABLE = PYTHON_VERSION >= (3, 11)
+MAX_HANDLER_HOPS = 32
+
+# marks an exception with (frame, f_lasti) of the handler predicted to catch it
+HANDLER_ATTR = '__ax_handler__'
+
+# handler kinds
+_CATCH = 'catch'        # except clauses: their type expressions
+_ANY = 'any'            # bare except (an error boundary, see should_repair)
+_RERAISE = 'reraise'    # finally / with / generator cleanup: runs and re-raises
+
+# _handled_in verdicts
+_HANDLED = 'handled'
+_BOUNDARY = 'boundary'
+
+_UNKNOWN = object()
+_CATCH_ALL = (Exception, BaseException)
+# instructions an except clause's type expression is made of
+_EXPR_OPS = {'LOAD_GLOBAL', 'LOAD_NAME', 'LOAD_FAST', 'LOAD_FAST_CHECK', 'LOAD_DEREF', 'LOAD_CLASSDEREF',
+             'LOAD_ATTR', 'LOAD_METHOD', 'LOAD_CONST', 'BUILD_TUPLE', 'NOP', 'PUSH_NULL'}
+
+# keyed by id(code): hashing a code object hashes its whole contents every time;
+# the entries hold the code object, so the ids can't be reused while cached.
+# Least recently used first: exec/template-heavy targets make new code all the time
+CACHE_SIZE = 1024
+_instructions = OrderedDict()   # id(code) -> (code, instructions, offset -> index, offsets)
+_handlers = OrderedDict()       # id(code) -> (code, handler table, {offset: handler chain})
+# (id(raising code), f_lasti, id(handler code), handler f_lasti, exception type) ->
+#     (raising code, handler code, verdict)
+_verdicts = OrderedDict()
+
+def _cached(cache: OrderedDict, code: CodeType):
+    return _lookup(cache, id(code))
+
+def _cache(cache: OrderedDict, code: CodeType, entry):
+    return _store(cache, id(code), entry)
+
+def _lookup(cache: OrderedDict, key):
+    entry = cache.get(key)
+    if entry is not None:
+        try:
+            cache.move_to_end(key)
+        except KeyError:    # evicted by another thread meanwhile
+            pass
+    return entry
+
+def _store(cache: OrderedDict, key, entry):
+    cache[key] = entry
+    if len(cache) > CACHE_SIZE:
+        try:
+            cache.popitem(last=False)
+        except KeyError:
+            pass
+    return entry
+
+def on_exception(exc: BaseException):
+    """
+    Except path of instrumented code, called with the exception propagating
+    through the calling frame: starts repair only for an exception nothing
+    above will handle. Prints nothing.
+
+    Returns a resume.ResumeSignal when the calling frame is to return the
+    result of its repaired call retried in place (--resume-in-place) instead
+    of re-raising, None otherwise.
+    """
+    # the common case first: an exception on its way to the handler found for it
+    handler = getattr(exc, HANDLER_ATTR, None)
+    if handler is not None and handler[0].f_lasti == handler[1]:
+        return None
+    if resume.is_pending(exc):
+        return resume.take(exc, sys._getframe(1))
+    if mc.mode_check() != '0' or not should_repair(exc, sys._getframe(1)):
+        return None
+    from .repair import except_handler
+    mc.repair_mode()
+    except_handler(exc)
+    return resume.take(exc, sys._getframe(1))
+
+def should_repair(exc: BaseException, frame: FrameType) -> bool:
+    """
+    False if the exception propagating out of `frame` will be caught by a
+    non-axolotl handler in one of its callers.
+
+    The callers' handlers are found from the code objects (exception table on
+    3.11+, SETUP_* blocks before) and except clauses are matched by evaluating
+    their type expressions against the frame's namespaces. Catch-all handlers
+    (bare except, `except Exception`) are error boundaries - the module-mode
+    runner, test runners, event loops logging a failed callback - not control
+    flow, so reaching one means repair, and handlers that can't be analysed
+    don't count: the result errs towards repairing.
+
+    The handler frame and its position are stored on the exception, so the
+    frames the exception still passes through on its way there only check
+    that the handler hasn't moved on. Verdicts are memoised per raising site,
+    handler site and exception type, so a site that keeps raising into the
+    same handler doesn't evaluate its except clauses again (rebinding the
+    names they use isn't noticed).
+    """
+    handler = getattr(exc, HANDLER_ATTR, None)
+    if handler is not None and handler[0].f_lasti == handler[1]:
+        return False
+
+    if isinstance(exc, (StopIteration, StopAsyncIteration)) and _is_iteration_protocol(frame):
+        return False
+
+    handlers = _handlers
+    f = frame.f_back
+    while f is not None:
+        # the walk is the hot part: frames without a handler - most of them -
+        # are looked up inline and keep their place in the LRU order
+        code = f.f_code
+        entry = handlers.get(id(code))
+        if entry is None:
+            entry = _cache(handlers, code, (code, _handler_table(code), {}))
+        if not entry[1]:
+            f = f.f_back
+            continue
+        verdict = _verdict(frame, f, entry, exc)
+        if verdict is _HANDLED:
+            try:
+                setattr(exc, HANDLER_ATTR, (f, f.f_lasti))
+            except (AttributeError, TypeError):
+                pass
+            return False
+        if verdict is _BOUNDARY:
+            return True
+        f = f.f_back
+    return True
+
+def _verdict(frame: FrameType, handler_frame: FrameType, entry, exc: BaseException):
+    """_handled_in(handler_frame, entry, exc), memoised per raising and handler site."""
+    raising, offset = frame.f_code, handler_frame.f_lasti
+    key = (id(raising), frame.f_lasti, id(entry[0]), offset, type(exc))
+    memo = _lookup(_verdicts, key)
+    if memo is None:
+        memo = _store(_verdicts, key, (raising, entry[0], _handled_in(handler_frame, entry, exc)))
+    return memo[2]
+
+def _is_iteration_protocol(frame: FrameType) -> bool:
+    if frame.f_code.co_name in ('__next__', '__anext__'):
+        return True
+    caller = frame.f_back
+    if caller is None:
+        return False
+    instr = _instruction_at(caller.f_code, caller.f_lasti)
+    return instr is not None and instr.opname in ('FOR_ITER', 'SEND', 'END_ASYNC_FOR')
+
+def _get_instructions(code: CodeType):
+    """(code, instructions, offset -> index, offsets) of `code`."""
+    entry = _cached(_instructions, code)
+    if entry is None:
+        instrs = list(dis.get_instructions(code))
+        entry = _cache(_instructions, code, (code, instrs, {instr.offset: i for i, instr in enumerate(instrs)},
+                                             [instr.offset for instr in instrs]))
+    return entry
+
+def _instruction_at(code: CodeType, offset: int):
+    """The instruction at `offset` (f_lasti may point into its inline caches on 3.11+)."""
+    _, instrs, _, offsets = _get_instructions(code)
+    i = bisect_right(offsets, offset) - 1
+    return instrs[i] if i >= 0 else None
+
+def _handled_in(frame: FrameType, entry, exc: BaseException):
+    """
+    _HANDLED / _BOUNDARY if a handler of `frame` (`entry` in _handlers), at its
+    current instruction, catches `exc`, None if the exception passes through.
+    """
+    code, table, chains = entry
+    offset = frame.f_lasti
+    chain = chains.get(offset)
+    if chain is None:
+        chain = chains[offset] = _handler_chain(code, table, offset)
+    for kind, types in chain:
+        if kind is _ANY:
+            return _BOUNDARY
+        for expr in types:
+            exc_type = _evaluate(frame, expr)
+            try:
+                if exc_type is _UNKNOWN or not isinstance(exc, exc_type):
+                    continue
+            except TypeError:
+                continue
+            if exc_type in _CATCH_ALL or (isinstance(exc_type, tuple) and any(t in _CATCH_ALL for t in exc_type)):
+                return _BOUNDARY
+            return _HANDLED
+    return None
+
+def _handler_chain(code: CodeType, table, offset: int) -> tuple:
+    """The except clauses an exception raised at `offset` meets, innermost first."""
+    chain = []
+    for _ in range(MAX_HANDLER_HOPS):
+        target = _covering_handler(table, offset)
+        if target is None:
+            break
+        kind, types = _classify(code, target)
+        if kind is not _RERAISE:
+            chain.append((kind, types))
+            if kind is _ANY:
+                break
+        # the handler re-raises: continue from there (3.11+ handlers are covered
+        # by their cleanup entry, which is covered by the enclosing try, if any)
+        if USE_EXCEPTION_TABLE:
+            offset = target
+        else:
+            table = [block for block in table if block[1] != target]
+    return tuple(chain)
+
+# ---- handler tables -------------------------------------------------------
+
+def _parse_varint(it):
+    b = next(it)
+    val = b & 63
+    while b & 64:
+        val <<= 6
+        b = next(it)
+        val |= b & 63
+    return val
+
+def _handler_table(code: CodeType):
+    """
+    3.11+ : [(start, end, target)] from co_exceptiontable, axolotl's handler left out.
+    <=3.10: [(start, target)] ranges of SETUP_FINALLY / SETUP_WITH blocks, which
+            the compiler lays out as the protected body followed by the handler.
+
+    In instrumented code axolotl's handler is the one placed last (highest
+    target among entries that don't push lasti / the first SETUP_FINALLY).
+    """
+    instrumented = '__axolotl__' in code.co_consts and code.co_name != '<module>'
+    if USE_EXCEPTION_TABLE:
+        entries = []
+        it = iter(code.co_exceptiontable)
+        try:
+            while True:
+                start = _parse_varint(it) * 2
+                end = start + _parse_varint(it) * 2
+                target = _parse_varint(it) * 2
+                lasti = _parse_varint(it) & 1
+                entries.append((start, end, target, lasti))
+        except StopIteration:
+            pass
+        ours = max((target for _, _, target, lasti in entries if not lasti), default=None) \
+            if instrumented else None
+        # axolotl's handler and its cleanup entry come after all of the function's code
+        return [(start, end, target) for start, end, target, _ in entries
+                if ours is None or (target != ours and start < ours)]
+
+    _, instrs, _, _ = _get_instructions(code)
+    blocks = [(instr.offset + 2, instr.argval) for instr in instrs
+              if instr.opname in ('SETUP_FINALLY', 'SETUP_WITH', 'SETUP_ASYNC_WITH')]
+    if instrumented and blocks:
+        ours = max(target for _, target in blocks)
+        blocks = [block for block in blocks if block[1] != ours]
+    return blocks
+
+def _covering_handler(table, offset: int):
+    if USE_EXCEPTION_TABLE:
+        for start, end, target in table:
+            if start <= offset < end:
+                return target
+        return None
+    # innermost block containing the offset
+    best = None
+    for start, target in table:
+        if start <= offset < target and (best is None or start > best[0]):
+            best = (start, target)
+    return best[1] if best else None
+
+def _classify(code: CodeType, target: int):
+    """
+    Read the except clauses starting at a handler: (kind, type expressions), an
+    expression being a global's name or its instructions.
+    """
+    _, instrs, index, _ = _get_instructions(code)
+    i = index.get(target)
+    if i is None:
+        return _RERAISE, ()
+
+    if USE_EXCEPTION_TABLE:
+        if instrs[i].opname != 'PUSH_EXC_INFO':
+            return _RERAISE, ()
+        i += 1
+        if instrs[i].opname == 'POP_TOP':
+            return _ANY, ()
+        match_op = 'CHECK_EXC_MATCH'
+    else:
+        if instrs[i].opname == 'POP_TOP':
+            return _ANY, ()
+        if instrs[i].opname != 'DUP_TOP':
+            return _RERAISE, ()
+        i += 1
+        match_op = 'JUMP_IF_NOT_EXC_MATCH' if PYTHON_VERSION >= (3, 9) else 'COMPARE_OP'
+
+    types = []
+    while i < len(instrs):
+        expr = []
+        while i < len(instrs) and instrs[i].opname in _EXPR_OPS:
+            expr.append(instrs[i])
+            i += 1
+        # anything else before the match (with / finally bodies, except*) isn't an except clause
+        if i >= len(instrs) or instrs[i].opname != match_op or not expr:
+            return _RERAISE, ()
+        expr = [instr for instr in expr if instr.opname not in ('NOP', 'PUSH_NULL')]
+        types.append(expr[0].argval if len(expr) == 1 and expr[0].opname == 'LOAD_GLOBAL' else expr)
+
+        # next clause: where the failed match jumps to
+        jump = instrs[i] if match_op == 'JUMP_IF_NOT_EXC_MATCH' else instrs[i + 1] if i + 1 < len(instrs) else None
+        if jump is None or 'JUMP' not in jump.opname or jump.argval not in index:
+            break
+        i = index[jump.argval]
+        if USE_EXCEPTION_TABLE:
+            if instrs[i].opname == 'RERAISE':
+                break
+        else:
+            if instrs[i].opname != 'DUP_TOP':
+                break
+            i += 1
+    return _CATCH, tuple(types)
+
+def _evaluate(frame: FrameType, expr):
+    """Evaluate an except clause's type expression (names, attributes, tuples)."""
+    if isinstance(expr, str):
+        # plain `except Name:` on a global
+        try:
+            return frame.f_globals[expr]
+        except KeyError:
+            return frame.f_builtins.get(expr, _UNKNOWN)
+    stack = []
+    try:
+        for instr in expr:
+            op = instr.opname
+            if op in ('LOAD_GLOBAL', 'LOAD_NAME'):
+                name = instr.argval
+                if op == 'LOAD_NAME' and name in frame.f_locals:
+                    stack.append(frame.f_locals[name])
+                elif name in frame.f_globals:
+                    stack.append(frame.f_globals[name])
+                else:
+                    stack.append(frame.f_builtins[name])
+            elif op in ('LOAD_FAST', 'LOAD_FAST_CHECK', 'LOAD_DEREF', 'LOAD_CLASSDEREF'):
+                stack.append(frame.f_locals[instr.argval])
+            elif op in ('LOAD_ATTR', 'LOAD_METHOD'):
+                stack.append(getattr(stack.pop(), instr.argval))
+            elif op == 'LOAD_CONST':
+                stack.append(instr.argval)
+            elif op == 'BUILD_TUPLE':
+                n = instr.argval
+                items = tuple(stack[-n:]) if n else ()
+                del stack[len(stack) - n:]
+                stack.append(items)
+            elif op not in ('NOP', 'PUSH_NULL'):
+                return _UNKNOWN
+    except Exception:
+        return _UNKNOWN
+    return stack[-1] if len(stack) == 1 else _UNKNOWN
@@ -17,6 +17,7 @@ from enum import Enum
 import time
 
 from .logger import get_logger, get_reporter
+from .instrumenter import bind_runtime_globals
 
 BRANCH_PATH = f"{os.getenv('WDIR')}/mutation"
 PATCH_FOLDER = f"{os.getenv('WDIR')}/patch_file"
@@ -37,7 +38,7 @@ class Validater:
         self.validation_exception = ''
 
     # validation part 1
-    def validate_patch(self, patch_file_path, func_name, args, kwargs, globals_vars):
+    def validate_patch(self, patch_file_path, func_name, args, kwargs, globals_vars, closure=None):
         """
         Validate a patch using the saved bytecode file.
         
@@ -46,6 +47,7 @@ class Validater:
         :param args: Positional arguments of the original function call.
         :param kwargs: Keyword arguments of the original function call.
         :param globals_vars: Global variables from the original function scope.
+        :param closure: Closure cells of the original function (closures and methods using super()).
         :return: True if the patch is valid, False otherwise.
         """
         self.logger.info(f"[Val-1] Validating patch for '{func_name}'...")
@@ -53,7 +55,8 @@ class Validater:
         try:
             with open(patch_file_path, 'rb') as patch_file:
                 patched_code = marshal.load(patch_file)
-            patched_func = FunctionType(patched_code, globals_vars, func_name)
+            bind_runtime_globals(globals_vars)
+            patched_func = FunctionType(patched_code, globals_vars, func_name, None, closure)
             sig = inspect.signature(patched_func)
             args_list = [args[key] for key in sig.parameters if key in args]
             valid_kwargs = {k: v for k, v in kwargs.items() if k not in sig.parameters}
@@ -70,7 +73,7 @@ class Validater:
             self.logger.debug(f"Traceback:\n{tb}")
             return False
     
-    def regression_test(self, func_name, origin_code, patch_code, args, kwargs, globals_vars):
+    def regression_test(self, func_name, origin_code, patch_code, args, kwargs, globals_vars, closure=None):
         start_time = time.time()
         mutator = Mutator()
 
@@ -87,7 +90,7 @@ class Validater:
             # - if pass -> interesting input
             # - if fail -> keep mutating
             try:
-                origin_result = self.input_test(origin_code, func_name, mutated_args, mutated_kwargs, globals_vars)
+                origin_result = self.input_test(origin_code, func_name, mutated_args, mutated_kwargs, globals_vars, closure)
             except Exception:
                 # If Exception occur, continue mutating (mutation 기록할까? -> mutator에서 어차피 만든 muated input 저장함)
                 continue
@@ -96,7 +99,7 @@ class Validater:
             interesting_inputs.append((mutated_args, mutated_kwargs))
 
             try:
-                patch_result = self.input_test(patch_code, func_name, mutated_args, mutated_kwargs, globals_vars)
+                patch_result = self.input_test(patch_code, func_name, mutated_args, mutated_kwargs, globals_vars, closure)
             except Exception as e:
                 # 4. If patched function fail -> validation part2 fail
                 if len(interesting_inputs) > 0:
@@ -121,9 +124,10 @@ class Validater:
         self.logger.info(f"[Val-2] Regression Test Passed for all {mutator.input_count} mutated inputs within duration.(or no interesting input found)")
         return True
     
-    def input_test(self, bytecode, func_name, args, kwargs, globals_vars):
+    def input_test(self, bytecode, func_name, args, kwargs, globals_vars, closure=None):
         # 1. Function Reconstruction
-        test_func = FunctionType(bytecode, globals_vars, func_name)
+        bind_runtime_globals(globals_vars)
+        test_func = FunctionType(bytecode, globals_vars, func_name, None, closure)
         
         # 2. Argument Mapping
         sig = inspect.signature(test_func)
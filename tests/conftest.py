@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests run against the source tree, installed or not
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,208 @@
+"""
+Instrumentation round trip, run by tests/test_instrumenter.py under each
+interpreter (it only needs axolotl and bytecode, not pytest).
+
+Every case is a module whose main() is run twice: compiled as is, and
+through Instrumenter.insert_try_except with repair.except_handler replaced
+by a counter. Prints {case: {"plain", "instrumented", "repairs"}} as JSON.
+"""
+import os
+import sys
+import json
+import tempfile
+
+CASES = {}
+
+def case(name, repairs):
+    def register(source):
+        CASES[name] = (source, repairs)
+    return register
+
+case('nested_functions', 0)('''
+def outer(n):
+    def middle(m):
+        def inner(k):
+            return k * 2
+        return [inner(i) for i in range(m)]
+    return middle(n) + [len(middle(1))]
+
+def main():
+    return outer(3)
+''')
+
+case('closures', 0)('''
+def counter():
+    count = 0
+    def bump(step=1):
+        nonlocal count
+        count += step
+        return count
+    return bump
+
+def main():
+    bump = counter()
+    bump()
+    bump(2)
+    adders = [(lambda x, i=i: x + i) for i in range(3)]
+    return bump(), [add(10) for add in adders]
+''')
+
+case('generators', 0)('''
+def inner():
+    yield 1
+    yield 2
+    return 'done'
+
+def delegating():
+    result = yield from inner()
+    yield result
+
+def guarded():
+    for i in range(3):
+        try:
+            yield 10 // (1 - i)
+        except ZeroDivisionError:
+            yield 'caught'
+
+def echo():
+    received = yield 'ready'
+    while received is not None:
+        received = yield received * 2
+
+def main():
+    e = echo()
+    first = next(e)
+    return list(delegating()), list(guarded()), first, e.send(21)
+''')
+
+case('coroutines', 0)('''
+import asyncio
+
+async def fetch(x):
+    await asyncio.sleep(0)
+    if x < 0:
+        raise ValueError(x)
+    return x * 3
+
+async def collect():
+    try:
+        await fetch(-1)
+    except ValueError:
+        pass
+    return await asyncio.gather(fetch(1), fetch(2))
+
+def main():
+    return asyncio.run(collect())
+''')
+
+case('class_bodies', 0)('''
+class Grid:
+    size = 3
+    cells = [n * n for n in range(size)]
+    labels = {n: str(n) for n in range(2)}
+    odd = {n for n in range(5) if n % 2}
+
+    @staticmethod
+    def scale(v, k=2):
+        return v * k
+
+    @classmethod
+    def build(cls):
+        return cls.scale(cls.size)
+
+    def total(self):
+        return sum(self.cells)
+
+def main():
+    return Grid.cells, Grid.labels, sorted(Grid.odd), Grid.scale(4), Grid.build(), Grid().total()
+''')
+
+case('caught', 0)('''
+class Store:
+    @staticmethod
+    def get(d, k):
+        return d[k]
+
+def lookup(d, k):
+    def read():
+        return Store.get(d, k)
+    try:
+        return read()
+    except KeyError:
+        return 'missing'
+
+def main():
+    return lookup({}, 'x')
+''')
+
+case('uncaught', 1)('''
+def leaf(d, k):
+    def read():
+        return d[k]
+    return read()
+
+def main():
+    return leaf({}, 'x')
+''')
+
+case('uncaught_generator', 1)('''
+def numbers():
+    yield 1
+    yield from broken()
+
+def broken():
+    yield 2
+    raise IndexError('gen')
+
+def main():
+    return list(numbers())
+''')
+
+case('uncaught_coroutine', 1)('''
+import asyncio
+
+async def fail():
+    await asyncio.sleep(0)
+    raise LookupError('coro')
+
+def main():
+    return asyncio.run(fail())
+''')
+
+def _run(code, namespace):
+    exec(code, namespace)
+    try:
+        return repr(namespace['main']())
+    except BaseException as e:
+        return f'raised {type(e).__name__}'
+
+def main():
+    wdir = tempfile.mkdtemp()
+    os.environ['WDIR'] = wdir
+    os.makedirs(os.path.join(wdir, 'patch_file'))
+
+    import axolotl.mode as mc
+    import axolotl.patch as pc
+    import axolotl.repair as rp
+    from axolotl.instrumenter import Instrumenter, bind_runtime_globals
+
+    mc.init_mode(wdir)
+    pc.init_patch_generation(wdir)
+    repairs = []
+    rp.except_handler = repairs.append
+
+    results = {}
+    for name, (source, _) in CASES.items():
+        code = compile(source, f'{name}.py', 'exec')
+        plain = _run(code, {'__name__': name})
+
+        namespace = {'__name__': name}
+        bind_runtime_globals(namespace)
+        mc.safe_mode()
+        repairs.clear()
+        instrumented = _run(Instrumenter().insert_try_except(code), namespace)
+        results[name] = {"plain": plain, "instrumented": instrumented, "repairs": len(repairs)}
+    json.dump(results, sys.stdout)
+
+if __name__ == '__main__':
+    main()
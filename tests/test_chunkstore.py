@@ -0,0 +1,104 @@
+import os
+import json
+
+import pytest
+
+from axolotl.chunkstore import ChunkStore, MANIFEST_SUFFIX, PARENT_LINK, DEFAULT_CHUNK_SIZE, available_codec
+
+PAGE = 4096
+
+def _images(path, pages, other=b'core'):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'pages-1.img'), 'wb') as f:
+        f.write(pages)
+    with open(os.path.join(path, 'core-1.img'), 'wb') as f:
+        f.write(other)
+    return path
+
+def _pages(seed, n):
+    # one incompressible page per chunk, and zero pages: both encodings get used
+    return b''.join(os.urandom(PAGE) if (seed + i) % 2 else b'\0' * PAGE for i in range(n))
+
+@pytest.mark.parametrize('codec', ['auto', 'zlib', 'none'])
+def test_pack_unpack_round_trip(tmp_path, codec):
+    store = ChunkStore(str(tmp_path / 'chunks'), codec, chunk_size=PAGE)
+    pages = _pages(0, 9) + b'tail'
+    images = _images(str(tmp_path / '0'), pages)
+    store.pack(images)
+
+    assert sorted(os.listdir(images)) == ['core-1.img', f'pages-1.img{MANIFEST_SUFFIX}']
+    with open(os.path.join(images, f'pages-1.img{MANIFEST_SUFFIX}'), 'rb') as f:
+        assert json.loads(f.readline())["size"] == len(pages)
+
+    store.unpack(images)
+    with open(os.path.join(images, 'pages-1.img'), 'rb') as f:
+        assert f.read() == pages
+    # unpack is idempotent, drop_unpacked leaves the manifest
+    store.unpack(images)
+    store.drop_unpacked(images)
+    assert sorted(os.listdir(images)) == ['core-1.img', f'pages-1.img{MANIFEST_SUFFIX}']
+
+def test_dedup_across_checkpoints(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'), 'zlib', chunk_size=PAGE)
+    pages = _pages(1, 4)
+    store.pack(_images(str(tmp_path / '0'), pages))
+    store.pack(_images(str(tmp_path / '1'), pages))
+    stats = store.stats()
+    assert stats["logical_bytes"] == 2 * len(pages)
+    # 2 random pages and one zero page stored once
+    assert store.new_bytes == 3 * PAGE
+    assert stats["dedup_ratio"] == pytest.approx(8 / 3)
+    assert stats["compression_ratio"] > 1
+
+def test_unpack_chain_follows_parents(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'), 'zlib', chunk_size=PAGE)
+    contents = {num: _pages(num, 3) for num in range(3)}
+    for num, pages in contents.items():
+        images = _images(str(tmp_path / str(num)), pages)
+        if num:
+            os.symlink(f'../{num - 1}', os.path.join(images, PARENT_LINK))
+        store.pack(images)
+
+    chain = store.unpack_chain(str(tmp_path / '2'))
+    assert chain == [os.path.realpath(str(tmp_path / str(num))) for num in (2, 1, 0)]
+    for num, pages in contents.items():
+        with open(tmp_path / str(num) / 'pages-1.img', 'rb') as f:
+            assert f.read() == pages
+
+def test_missing_chunk_drops_partial_chain(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'), 'none', chunk_size=PAGE)
+    _images(str(tmp_path / '0'), os.urandom(2 * PAGE))
+    store.pack(str(tmp_path / '0'))
+    _images(str(tmp_path / '1'), os.urandom(2 * PAGE))
+    os.symlink('../0', str(tmp_path / '1' / PARENT_LINK))
+    store.pack(str(tmp_path / '1'))
+    # lose one chunk of the parent
+    with open(tmp_path / '0' / f'pages-1.img{MANIFEST_SUFFIX}', 'rb') as f:
+        f.readline()
+        digest = f.read(20).hex()
+    os.remove(store._chunk_path(digest))
+
+    with pytest.raises(OSError):
+        store.unpack_chain(str(tmp_path / '1'))
+    for num in ('0', '1'):
+        assert sorted(os.listdir(tmp_path / num)) == sorted(
+            ['core-1.img', f'pages-1.img{MANIFEST_SUFFIX}'] + ([PARENT_LINK] if num == '1' else []))
+
+def test_unknown_manifest_version(tmp_path):
+    store = ChunkStore(str(tmp_path / 'chunks'))
+    images = _images(str(tmp_path / '0'), b'')
+    os.remove(os.path.join(images, 'pages-1.img'))
+    with open(os.path.join(images, f'pages-1.img{MANIFEST_SUFFIX}'), 'wb') as f:
+        f.write(json.dumps({"version": 99}).encode() + b'\n')
+    with pytest.raises(ValueError):
+        store.unpack(images)
+
+def test_codec_fallback(tmp_path, monkeypatch):
+    import axolotl.chunkstore as cs
+    monkeypatch.setattr(cs, 'zstandard', None)
+    monkeypatch.setattr(cs, 'lz4', None)
+    assert available_codec('auto') == 'zlib'
+    assert available_codec('zstd') == 'zlib'
+    monkeypatch.setenv(cs.CHUNK_STORE_ENV, str(tmp_path))
+    store = ChunkStore.from_env()
+    assert (store.codec, store.chunk_size) == ('zlib', DEFAULT_CHUNK_SIZE)
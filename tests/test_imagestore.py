@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from axolotl.imagestore import ImageStore, PARENT_LINK
+
+def _dump(store, num, parent=None):
+    """What a dump leaves behind: page data and CRIU's `parent` link to --prev-images-dir."""
+    path = store.create(num)
+    with open(os.path.join(path, 'pages-1.img'), 'wb') as f:
+        f.write(bytes([num]) * 4096)
+    if parent is not None:
+        os.symlink(store.parent_link(num, parent), os.path.join(path, PARENT_LINK))
+    return path
+
+def _resolves(store, num, parent):
+    link = os.path.join(store.path(num), PARENT_LINK)
+    return os.path.realpath(link) == os.path.realpath(store.path(parent))
+
+def _tiered(tmp_path):
+    # laid out like ImageStore.from_env: <hot dir>/axolotl-<pid>/<checkpoints dir>
+    store = ImageStore(str(tmp_path / 'checkpoints0'), str(tmp_path / 'shm' / 'axolotl-1' / 'checkpoints0'),
+                       hot_keep=1)
+    store.reset()
+    return store
+
+@pytest.fixture
+def store(tmp_path):
+    store = _tiered(tmp_path)
+    yield store
+    store.flush()
+
+def _tier(store, num):
+    return os.path.dirname(store.path(num))
+
+def test_spill_relinks_across_tiers(store):
+    _dump(store, 0)
+    _dump(store, 1, 0)
+    assert os.readlink(os.path.join(store.path(1), PARENT_LINK)) == '../0'
+    store.committed([0, 1])
+    _dump(store, 2, 1)
+    store.committed([0, 1, 2])
+    store.flush()
+
+    assert _tier(store, 0) == _tier(store, 1) == store.root
+    assert _tier(store, 2) == store.hot_root
+    # same tier: relative, across tiers: absolute
+    assert os.readlink(os.path.join(store.path(1), PARENT_LINK)) == '../0'
+    assert os.readlink(os.path.join(store.path(2), PARENT_LINK)) == os.path.abspath(store.path(1))
+    assert _resolves(store, 1, 0) and _resolves(store, 2, 1)
+    assert store.stats()["spilled"] == 2
+    # a new dump on top of a spilled parent links across tiers from the start
+    assert store.parent_link(3, 1) == os.path.abspath(store.path(1))
+
+def test_newest_checkpoint_stays_hot(store):
+    _dump(store, 0)
+    store.committed([0])
+    store.flush()
+    assert _tier(store, 0) == store.hot_root
+
+def test_no_spill_during_a_dump(store):
+    _dump(store, 0)
+    _dump(store, 1, 0)
+    store.begin_dump()
+    try:
+        # dump 2 reads 1 and 0 through the parent links: neither may move meanwhile
+        _dump(store, 2, 1)
+        store.committed([0, 1, 2])
+        time.sleep(0.2)
+        assert _tier(store, 0) == _tier(store, 1) == store.hot_root
+        assert _resolves(store, 2, 1) and _resolves(store, 1, 0)
+    finally:
+        store.end_dump()
+    store.flush()
+    assert _tier(store, 0) == _tier(store, 1) == store.root
+    assert _resolves(store, 2, 1) and _resolves(store, 1, 0)
+
+def test_close_moves_everything(tmp_path):
+    store = _tiered(tmp_path)
+    _dump(store, 0)
+    _dump(store, 1, 0)
+    store.close()
+    assert sorted(os.listdir(store.root)) == ['0', '1']
+    assert not os.path.exists(os.path.dirname(store.hot_root))
+    assert os.readlink(os.path.join(store.root, '1', PARENT_LINK)) == '../0'
+
+def test_single_tier(tmp_path):
+    store = ImageStore(str(tmp_path))
+    path = _dump(store, 0)
+    assert path == store.path(0) == os.path.join(str(tmp_path), '0')
+    assert store.parent_link(1, 0) == '../0'
+    store.committed([0])
+    store.flush()
+    store.close()
@@ -0,0 +1,52 @@
+import os
+import glob
+import json
+import shutil
+import subprocess
+from functools import lru_cache
+
+import pytest
+
+from roundtrip import CASES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSIONS = ['3.8', '3.10', '3.11', '3.12']
+
+def _candidates(version):
+    yield shutil.which(f'python{version}')
+    pyenv = os.getenv('PYENV_ROOT', os.path.expanduser('~/.pyenv'))
+    yield from sorted(glob.glob(os.path.join(pyenv, 'versions', f'{version}.*', 'bin', 'python')))
+
+@lru_cache(maxsize=None)
+def _interpreter(version):
+    """An interpreter of `version` that has bytecode installed, None if there is none."""
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+    for python in _candidates(version):
+        if python and subprocess.run([python, '-c', 'import bytecode'], env=env,
+                                     capture_output=True).returncode == 0:
+            return python
+    return None
+
+@lru_cache(maxsize=None)
+def _round_trip(version):
+    python = _interpreter(version)
+    if python is None:
+        pytest.skip(f'no Python {version} with bytecode installed')
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+    out = subprocess.run([python, os.path.join(ROOT, 'tests', 'roundtrip.py')], env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout)
+
+@pytest.mark.parametrize('name', list(CASES))
+@pytest.mark.parametrize('version', VERSIONS)
+def test_round_trip(version, name):
+    result = _round_trip(version)[name]
+    assert result["instrumented"] == result["plain"]
+
+@pytest.mark.parametrize('name', list(CASES))
+@pytest.mark.parametrize('version', VERSIONS)
+def test_repairs(version, name):
+    """A caught exception never reaches repair, an uncaught one exactly once."""
+    expected = CASES[name][1]
+    assert _round_trip(version)[name]["repairs"] == expected
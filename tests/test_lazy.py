@@ -0,0 +1,90 @@
+import inspect
+
+import pytest
+
+pytest.importorskip('bytecode')
+
+import axolotl.mode as mc
+import axolotl.patch as pc
+from axolotl import lazy
+from axolotl.instrumenter import Instrumenter, bind_runtime_globals
+
+SOURCE = '''
+def defaults(a, b=2, *args, c=3, **kw):
+    "keeps its docstring"
+    return a, b, args, c, kw
+
+def kwonly(a, *, b, c=10):
+    return a + b + c
+
+def posonly(a, b=5, /, c=1):
+    return a * b + c
+
+def closure():
+    x = 1
+    def inner():
+        return x
+    return inner
+
+def gen():
+    yield 1
+'''
+
+@pytest.fixture
+def module(tmp_path, monkeypatch):
+    wdir = str(tmp_path)
+    monkeypatch.setenv('WDIR', wdir)
+    (tmp_path / 'patch_file').mkdir()
+    monkeypatch.setattr(pc, 'PATCH_FOLDER', str(tmp_path / 'patch_file'))
+    mc.init_mode(wdir)
+    pc.init_patch_generation(wdir)
+    mc.safe_mode()
+
+    original = compile(SOURCE, 'lazy_case.py', 'exec')
+    namespace = {'__name__': 'lazy_case'}
+    bind_runtime_globals(namespace)
+    exec(Instrumenter(lazy=True).insert_try_except(original), namespace)
+    codes = {c.co_name: c for c in original.co_consts if inspect.iscode(c)}
+    return namespace, codes
+
+def _instrumented(func):
+    return '__axolotl__' in func.__code__.co_consts
+
+def test_only_plain_module_functions_are_stubbed(module):
+    namespace, _ = module
+    for name in ('defaults', 'kwonly', 'posonly', 'closure'):
+        assert not _instrumented(namespace[name])
+    assert _instrumented(namespace['gen'])
+    assert not lazy.is_stub_candidate(namespace['closure']().__code__)
+
+@pytest.mark.parametrize('name', ['defaults', 'kwonly', 'posonly'])
+def test_stub_keeps_signature(module, name):
+    namespace, codes = module
+    stub = namespace[name]
+    plain = {}
+    exec(compile(SOURCE, 'lazy_case.py', 'exec'), plain)
+    assert inspect.signature(stub) == inspect.signature(plain[name])
+    assert stub.__code__.co_name == codes[name].co_name
+    assert stub.__code__.co_firstlineno == codes[name].co_firstlineno
+
+def test_stub_calls(module):
+    namespace, _ = module
+    assert namespace['defaults'].__doc__ == "keeps its docstring"
+    assert namespace['defaults'](1) == (1, 2, (), 3, {})
+    assert namespace['defaults'](1, 4, 5, 6, c=7, d=8) == (1, 4, (5, 6), 7, {'d': 8})
+    assert namespace['kwonly'](1, b=2) == 13
+    with pytest.raises(TypeError):
+        namespace['kwonly'](1, 2)
+    assert namespace['posonly'](2) == 11
+    assert namespace['posonly'](2, 3, c=0) == 6
+    with pytest.raises(TypeError):
+        namespace['posonly'](a=2)
+    assert namespace['closure']()() == 1
+
+def test_first_call_installs_instrumented_code(module):
+    namespace, codes = module
+    kwonly = namespace['kwonly']
+    kwonly(1, b=2)
+    assert _instrumented(kwonly)
+    assert kwonly(1, b=2, c=0) == 3
+    assert lazy._instrumented[id(codes['kwonly'])][1] is kwonly.__code__
@@ -0,0 +1,149 @@
+import os
+import sys
+import random
+import importlib
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from axolotl.instrumenter import Instrumenter
+from axolotl.loader import RuntimeAPRFileMatcher, RuntimeAPRLoader, RuntimeAPRMetaPathFinder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _legacy_matcher_class():
+    spec = importlib.util.spec_from_file_location('bench_matcher', os.path.join(ROOT, 'scripts', 'bench_matcher.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.LegacyFileMatcher
+
+PARTS = ['proj', 'pkg', 'vendored', 'site-packages', 'tests', 'a', 'b', '..', '.', '', 'mod_pb2.py', 'x.py', 'ext.so']
+
+def _random_path(rng, cwd):
+    parts = [rng.choice(PARTS) for _ in range(rng.randint(1, 6))] + [rng.choice(['m.py', 'ext.so', 'x_pb2.py'])]
+    path = '/'.join(parts)
+    kind = rng.random()
+    if kind < 0.4:
+        return str(cwd) + '/' + path
+    if kind < 0.6:
+        return '/' + path
+    if kind < 0.7:
+        return '//' + path
+    if kind < 0.8:
+        return Path(cwd, path)
+    return path
+
+def _matcher(cwd, sources=(), omit=(), keywords=()):
+    matcher = RuntimeAPRFileMatcher()
+    matcher.cwd = Path(cwd)
+    for source in sources:
+        matcher.addSource(source)
+    for pattern in omit:
+        matcher.addOmit(pattern)
+    for keyword in keywords:
+        matcher.addExcludeKeyword(keyword)
+    return matcher
+
+@pytest.mark.parametrize('config', [
+    dict(),
+    dict(sources=['proj/pkg', '/abs/a']),
+    dict(omit=['*/vendored/*', '*_pb2.py', 'proj/tests/*'], keywords=['site-packages']),
+    dict(sources=['proj'], omit=['*/b/*'], keywords=['tests']),
+])
+def test_compiled_matcher_agrees_with_legacy(config, tmp_path):
+    cwd = tmp_path / 'cwd'
+    matcher = _matcher(cwd, **config)
+    matcher.pylib_paths = [cwd / 'proj' / 'site-packages', Path('/usr/lib/python3')]
+    legacy = _legacy_matcher_class()(matcher)
+    rng = random.Random(11)
+    for _ in range(3000):
+        path = _random_path(rng, cwd)
+        assert matcher.matches(path) == legacy.matches(path), path
+        # memoised answer
+        assert matcher.matches(path) == legacy.matches(path), path
+
+def test_matcher_edge_cases(tmp_path):
+    matcher = _matcher(tmp_path, sources=[tmp_path / 'src'])
+    assert matcher.matches(None) is False
+    assert matcher.matches('built-in') is False
+    assert matcher.matches(str(tmp_path / 'src' / 'ext.so')) is False
+    assert matcher.matches(str(tmp_path / 'src' / 'm.py')) is True
+    assert matcher.matches('src/m.py') is True
+    assert matcher.matches(str(tmp_path / 'other' / 'm.py')) is False
+
+def test_matcher_change_drops_memo(tmp_path):
+    matcher = _matcher(tmp_path)
+    path = str(tmp_path / 'pkg' / 'm.py')
+    assert matcher.matches(path)
+    matcher.addExcludeKeyword('pkg')
+    assert not matcher.matches(path)
+
+def test_matcher_memo_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(RuntimeAPRFileMatcher, 'MEMO_SIZE', 10)
+    matcher = _matcher(tmp_path)
+    for i in range(50):
+        matcher.matches(str(tmp_path / f'm{i}.py'))
+    assert len(matcher._memo) == 10
+
+def test_matcher_pickles_without_compiled_state(tmp_path):
+    import pickle
+    matcher = _matcher(tmp_path, omit=['*_pb2.py'])
+    path = str(tmp_path / 'x_pb2.py')
+    assert not matcher.matches(path)
+    clone = pickle.loads(pickle.dumps(matcher))
+    assert not clone._memo and not clone._compiled
+    assert not clone.matches(path)
+    assert clone.matches(str(tmp_path / 'x.py'))
+
+class _Matcher:
+    def __init__(self, root):
+        self.root = str(root)
+
+    def matches(self, filename):
+        return filename is not None and str(filename).startswith(self.root + os.sep + 'mine')
+
+@pytest.fixture
+def finder(tmp_path, monkeypatch):
+    (tmp_path / 'mine').mkdir()
+    (tmp_path / 'theirs').mkdir()
+    (tmp_path / 'mine' / 'ax_mine_mod.py').write_text('X = 1\n')
+    (tmp_path / 'theirs' / 'ax_their_mod.py').write_text('X = 2\n')
+    monkeypatch.syspath_prepend(str(tmp_path / 'mine'))
+    monkeypatch.syspath_prepend(str(tmp_path / 'theirs'))
+    return RuntimeAPRMetaPathFinder(Instrumenter(), _Matcher(tmp_path))
+
+def test_find_spec_skips_rejected_modules(finder):
+    spec = finder.find_spec('ax_mine_mod', None)
+    assert isinstance(spec.loader, RuntimeAPRLoader)
+    assert ('ax_mine_mod', None) not in finder._skip
+
+    spec = finder.find_spec('ax_their_mod', None)
+    assert spec is not None and not isinstance(spec.loader, RuntimeAPRLoader)
+    assert ('ax_their_mod', None) in finder._skip
+    assert finder.find_spec('ax_their_mod', None) is None
+    # per (fullname, path)
+    assert finder.find_spec('ax_their_mod', ['elsewhere']) is None
+    assert ('ax_their_mod', ('elsewhere',)) not in finder._skip
+
+    finder.invalidate_caches()
+    assert finder.find_spec('ax_their_mod', None) is not None
+
+def test_find_spec_retries_modules_not_found(finder, tmp_path):
+    assert finder.find_spec('ax_late_mod', None) is None
+    assert not finder._skip
+    # becomes importable later
+    (tmp_path / 'mine' / 'ax_late_mod.py').write_text('X = 3\n')
+    importlib.invalidate_caches()
+    assert isinstance(finder.find_spec('ax_late_mod', None).loader, RuntimeAPRLoader)
+
+def test_find_spec_leaves_wrapped_specs(finder, monkeypatch):
+    wrapped = finder.find_spec('ax_mine_mod', None)
+
+    class Finder:
+        def find_spec(self, fullname, path, target=None):
+            return wrapped if fullname == 'ax_mine_mod' else None
+
+    monkeypatch.setattr(sys, 'meta_path', [Finder()] + sys.meta_path)
+    spec = finder.find_spec('ax_mine_mod', None)
+    assert spec is wrapped and not isinstance(spec.loader.orig_loader, RuntimeAPRLoader)
@@ -0,0 +1,81 @@
+import json
+import struct
+
+import pytest
+
+from axolotl.metrics import read_criu_stats, CheckpointMetrics, EVENTS_FILE
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _message(fields):
+    """Varint fields, and nested messages (bytes) as length-delimited ones."""
+    out = b''
+    for number, value in fields.items():
+        if isinstance(value, bytes):
+            out += _varint(number << 3 | 2) + _varint(len(value)) + value
+        else:
+            out += _varint(number << 3) + _varint(value)
+    return out
+
+def _stats_image(path, entry):
+    # CRIU magic (two 32-bit words), 32-bit size, StatsEntry
+    body = _message(entry)
+    path.write_bytes(struct.pack('<II', 0x57474424, 0x57474424) + struct.pack('<I', len(body)) + body)
+    return str(path)
+
+def test_dump_stats(tmp_path):
+    dump = _message({1: 1500, 2: 250000, 3: 10, 4: 20, 5: 4096, 6: 3000, 7: 1096})
+    # a fixed64 field before it is skipped
+    entry = _message({1: dump}) + _varint(9 << 3 | 1) + b'\0' * 8
+    path = tmp_path / 'stats-dump'
+    path.write_bytes(struct.pack('<III', 1, 2, len(entry)) + entry)
+    stats = read_criu_stats(str(path))
+    assert stats == {"freezing_time": 0.0015, "frozen_time": 0.25, "memdump_time": 0.00001,
+                     "memwrite_time": 0.00002, "pages_scanned": 4096, "pages_skipped_parent": 3000,
+                     "pages_written": 1096}
+
+def test_restore_stats(tmp_path):
+    restore = _message({1: 7, 3: 2000, 4: 3_000_000, 5: 300})
+    stats = read_criu_stats(_stats_image(tmp_path / 'stats-restore', {2: restore}))
+    # pages_skipped_cow isn't in the image: left out
+    assert stats == {"pages_compared": 7, "forking_time": 0.002, "restore_time": 3.0, "pages_restored": 300}
+
+@pytest.mark.parametrize('content', [None, b'', b'\0' * 11, struct.pack('<III', 0, 0, 4) + b'\x08\x01',
+                                     struct.pack('<III', 0, 0, 2) + b'\x0f\x00'])
+def test_unreadable_stats(tmp_path, content):
+    path = tmp_path / 'stats-dump'
+    if content is not None:
+        path.write_bytes(content)
+    assert read_criu_stats(str(path)) == {}
+
+def test_running_totals(tmp_path):
+    metrics = CheckpointMetrics(str(tmp_path))
+    metrics.emit("dump", num=0, wall_time=0.5, frozen_time=None, pages_written=10, image_bytes=100, chain_depth=0)
+    metrics.emit("dump", num=1, wall_time=0.25, frozen_time=0.1, pages_written=5, image_bytes=50, chain_depth=1)
+    metrics.emit("dump_cancelled", num=2, reason="mode -1", wall_time=0.1)
+    metrics.emit("restore", num=1, restore_time=1.0, resume_time=0.5, unpack_time=0.25)
+    metrics.emit("restore_failed", num=1, unpack_time=0.1)
+    metrics.emit("resume_in_place")
+
+    summary = metrics.summary()
+    assert (summary["dumps"], summary["dumps_cancelled"], summary["restores"], summary["restores_failed"],
+            summary["resumed_in_place"]) == (2, 1, 1, 1, 1)
+    assert summary["dump_wall_time"] == 0.75 and summary["dump_wall_time_max"] == 0.5
+    assert summary["frozen_time"] == 0.1 and summary["pages_written"] == 15 and summary["image_bytes"] == 150
+    assert summary["pages_skipped"] is None
+    assert summary["chain_depth_max"] == 1
+    # failed restores don't count towards the restore totals
+    assert (summary["restore_time"], summary["resume_time"], summary["unpack_time"]) == (1.0, 0.5, 0.25)
+
+    with open(tmp_path / EVENTS_FILE) as f:
+        events = [json.loads(line)["event"] for line in f]
+    assert events == ["dump", "dump", "dump_cancelled", "restore", "restore_failed", "resume_in_place"]
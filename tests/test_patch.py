@@ -0,0 +1,198 @@
+import os
+import sys
+import marshal
+import itertools
+import importlib.util
+
+import pytest
+
+pytest.importorskip('bytecode')
+
+import axolotl.patch as pc
+from axolotl.repair import compile_patch, running_function
+
+TARGET = '''
+import sys
+import functools
+
+def traced(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+    return wrapper
+
+class Shape:
+    def area(self, h):
+        return 10 / h
+
+class Square(Shape):
+    def __init__(self, side):
+        self.side = side
+
+    def area(self, h):
+        return super().area(h) * self.side
+
+def make_scaler(k):
+    def scale(x):
+        return x / k
+    return scale
+
+def make_pair(a, b):
+    def combine(x):
+        return (x - a) / b
+    return combine
+
+def make_probe(k):
+    def probe():
+        return sys._getframe(), k
+    return probe
+
+def make_probes(k):
+    def probe():
+        return sys._getframe(), k
+    def other():
+        return k
+    return probe, other
+
+@traced
+def ratio(a, b):
+    return a / b
+
+@functools.lru_cache(maxsize=None)
+def inv(x):
+    return 1 / x
+'''
+
+_names = itertools.count()
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    folder = tmp_path / 'patch_file'
+    folder.mkdir()
+    monkeypatch.setenv('WDIR', str(tmp_path))
+    monkeypatch.setattr(pc, 'PATCH_FOLDER', str(folder))
+    monkeypatch.setattr(pc, '_patches', {})
+    monkeypatch.setattr(pc, '_installed', {})
+    # a module of its own per test: patches stay where they were installed
+    name = f'ax_patch_target_{next(_names)}'
+    path = tmp_path / f'{name}.py'
+    path.write_text(TARGET)
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    yield module
+    del sys.modules[name]
+
+def _save(func, source, freevars=None):
+    """What repair saves for a validated patch of `func`; the patch name."""
+    code = func.__code__
+    name = pc.qualified_name(func)
+    patch = compile_patch(source, code.co_filename, code.co_name,
+                          code.co_freevars if freevars is None else freevars)
+    with open(os.path.join(pc.PATCH_FOLDER, f'{name}_patch'), 'wb') as f:
+        marshal.dump(patch, f)
+    pc.save_patch_target(name, code)
+    return name
+
+SCALE = '''
+    def scale(x):
+        return x / k if k else x
+'''
+
+def test_compile_patch_keeps_free_variable_order(target):
+    code = target.make_pair(1, 2).__code__
+    # the patch reads b before a
+    patch = compile_patch("def combine(x):\n    return x / b - a / b\n", 'p.py', 'combine', code.co_freevars)
+    assert patch.co_freevars == code.co_freevars == ('a', 'b')
+    # a free variable the patch doesn't use any more is kept
+    patch = compile_patch("def combine(x):\n    return x / b\n", 'p.py', 'combine', code.co_freevars)
+    assert patch.co_freevars == ('a', 'b')
+
+def test_compile_patch_method_using_super(target):
+    code = target.Square.area.__code__
+    patch = compile_patch("def area(self, h):\n    return super().area(h) if h else 0\n", 'p.py', 'area',
+                          code.co_freevars)
+    assert patch.co_freevars == ('__class__',)
+
+def test_compile_patch_needs_the_function():
+    with pytest.raises(ValueError):
+        compile_patch("x = 1\n", 'p.py', 'scale')
+
+def test_install_closures(target):
+    s1, s2 = target.make_scaler(0), target.make_scaler(2)
+    original = s1.__code__
+    swapped = pc.install_patch(_save(s1, SCALE))
+    # the existing closures keep their cells, new ones get the patch too
+    assert s1(5) == 5 and s2(5) == 2.5
+    assert target.make_scaler(0)(7) == 7
+    assert target.make_scaler(0).__qualname__ == 'make_scaler.<locals>.scale'
+
+    pc.revert(swapped)
+    assert s1.__code__ is original
+    with pytest.raises(ZeroDivisionError):
+        target.make_scaler(0)(7)
+
+def test_install_methods(target):
+    square = target.Square(3)
+    bound = square.area
+    pc.install_patch(_save(target.Square.area, "def area(self, h):\n    return super().area(h) * self.side if h else 0\n"))
+    assert bound(0) == 0 and square.area(2) == 15 and target.Square(4).area(0) == 0
+
+def test_install_wrapped_functions(target):
+    pc.install_patch(_save(target.ratio.__wrapped__, "def ratio(a, b):\n    return a / b if b else 0\n"))
+    pc.install_patch(_save(target.inv.__wrapped__, "def inv(x):\n    return 1 / x if x else 0\n"))
+    assert target.ratio(1, 0) == 0 and target.inv(0) == 0
+
+def test_install_rejects_other_free_variables(target):
+    combine = target.make_pair(1, 0)
+    original = combine.__code__
+    name = _save(combine, "def combine(x):\n    return (x - a) / b if b else x\n", freevars=('b', 'a'))
+    with pytest.raises(ValueError):
+        pc.install_patch(name)
+    assert combine.__code__ is original
+
+def test_running_function_picks_the_closure_by_its_cells(target):
+    p1, p2 = target.make_probe([1]), target.make_probe([2])
+    frame, _ = p2()
+    assert running_function(frame) is p2
+    frame, _ = p1()
+    assert running_function(frame) is p1
+
+def test_running_function_refuses_ambiguous_closures(target):
+    cell = [0]
+    p1, p2 = target.make_probe(cell), target.make_probe(cell)
+    frame, _ = p1()
+    # same contents, different cells: either could be running
+    assert running_function(frame) is None
+    # the functions of one scope share their cells
+    probe, _ = target.make_probes(cell)
+    frame, _ = probe()
+    assert running_function(frame) is probe
+    # no free variables: the function of the code
+    assert running_function(sys._getframe()) is test_running_function_refuses_ambiguous_closures
+
+def test_refresh_installs_each_patch_file_once(target, monkeypatch):
+    installed = []
+    install = pc.install_patch
+    monkeypatch.setattr(pc, 'install_patch', lambda name: installed.append(name) or install(name))
+    generation = [1]
+    monkeypatch.setattr(pc, '_attached', True)
+    monkeypatch.setattr(pc, '_generation', generation)
+    monkeypatch.setattr(pc, '_seen_generation', 0)
+
+    s1 = target.make_scaler(0)
+    name = _save(s1, SCALE)
+    assert name in pc.published_patches()
+    assert installed == [name] and s1(5) == 5
+
+    generation[0] += 1
+    pc.published_patches()
+    assert installed == [name]
+
+    # a new patch for the same function
+    _save(s1, SCALE.replace('else x', 'else -x'))
+    os.utime(os.path.join(pc.PATCH_FOLDER, f'{name}_patch'), ns=(1, 1))
+    generation[0] += 1
+    pc.published_patches()
+    assert installed == [name, name] and s1(5) == -5
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from axolotl.plan import InstrumentationPlan, PLAN_ENV, plan_key
+
+def hot():
+    return 1
+
+def cold():
+    return 2
+
+def test_from_profile_skip():
+    functions = {
+        plan_key(hot.__code__): {"calls": 500, "raised": 3},
+        plan_key(cold.__code__): {"calls": 2, "raised": 1},
+        "m.py:1:quiet": {"calls": 2, "raised": 0},
+    }
+    plan = InstrumentationPlan.from_profile(functions, hot_threshold=100)
+    assert plan.skip == {plan_key(hot.__code__), "m.py:1:quiet"}
+    assert not plan.should_instrument(hot.__code__)
+    assert plan.should_instrument(cold.__code__)
+
+    kept = InstrumentationPlan.from_profile(functions, hot_threshold=100, skip_never_raised=False)
+    assert kept.skip == {plan_key(hot.__code__)}
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / 'plan.json')
+    plan = InstrumentationPlan.from_profile({"m.py:3:f": {"calls": 9, "raised": 0}}, hot_threshold=5)
+    plan.save(path)
+    loaded = InstrumentationPlan.load(path)
+    assert loaded.skip == plan.skip
+    assert loaded.functions == plan.functions
+    assert (loaded.hot_threshold, loaded.skip_never_raised) == (5, True)
+    assert loaded.digest() == plan.digest()
+
+def test_hand_written_skip_list(tmp_path):
+    path = tmp_path / 'plan.json'
+    path.write_text(json.dumps({"version": 1, "skip": [plan_key(hot.__code__)]}))
+    plan = InstrumentationPlan.load(str(path))
+    assert not plan.should_instrument(hot.__code__)
+    assert plan.should_instrument(cold.__code__)
+
+def test_digest_follows_skip_list():
+    assert InstrumentationPlan(["a", "b"]).digest() == InstrumentationPlan(["b", "a"]).digest()
+    assert InstrumentationPlan(["a"]).digest() != InstrumentationPlan(["a", "b"]).digest()
+
+def test_load_rejects_other_versions(tmp_path):
+    path = tmp_path / 'plan.json'
+    path.write_text(json.dumps({"version": 2, "skip": []}))
+    with pytest.raises(ValueError):
+        InstrumentationPlan.load(str(path))
+
+def test_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv(PLAN_ENV, raising=False)
+    assert InstrumentationPlan.from_env() is None
+    monkeypatch.setenv(PLAN_ENV, str(tmp_path / 'missing.json'))
+    assert InstrumentationPlan.from_env() is None
+    InstrumentationPlan(["m.py:1:f"]).save(str(tmp_path / 'plan.json'))
+    monkeypatch.setenv(PLAN_ENV, str(tmp_path / 'plan.json'))
+    assert InstrumentationPlan.from_env().skip == {"m.py:1:f"}
+
+def test_instrumenter_leaves_skipped_functions_unwrapped():
+    pytest.importorskip('bytecode')
+    from axolotl.instrumenter import Instrumenter
+    module = compile("def hot():\n    return 1\n\ndef cold():\n    return 2\n", 'm.py', 'exec')
+    plan = InstrumentationPlan(["m.py:1:hot"])
+    instrumented = Instrumenter(plan=plan).insert_try_except(module)
+    funcs = {c.co_name: c for c in instrumented.co_consts if hasattr(c, 'co_name')}
+    assert '__axolotl__' not in funcs['hot'].co_consts
+    assert '__axolotl__' in funcs['cold'].co_consts
@@ -0,0 +1,69 @@
+import os
+
+from axolotl.imagestore import ImageStore
+from axolotl.retention import CheckpointChain
+
+def _dump(chain, num, size=100):
+    """What Checkpoint.store_checkpoint does for dump `num`: returns its parent."""
+    parent = chain.parent_for(num)
+    path = chain.store.create(num)
+    with open(os.path.join(path, 'pages-1.img'), 'wb') as f:
+        f.write(b'\0' * size)
+    chain.add(num, parent)
+    return parent
+
+def _on_disk(store):
+    return sorted(int(name) for name in os.listdir(store.root) if name.isdigit())
+
+def test_rebase_after_max_chain(tmp_path):
+    store = ImageStore(str(tmp_path))
+    chain = CheckpointChain(store, keep=2, max_chain=2)
+    parents = [_dump(chain, num) for num in range(7)]
+    assert parents == [None, 0, 1, None, 3, 4, None]
+    assert chain.full_dumps == 3
+    # checkpoints 5 (needs 3, 4) and 6 are the kept restore points
+    assert sorted(chain.parents) == [3, 4, 5, 6] == _on_disk(store)
+    assert chain.chain(5) == [5, 4, 3]
+    assert chain.depth(5) == 2 and chain.depth(6) == 0
+
+def test_keep_holds_whole_chains(tmp_path):
+    store = ImageStore(str(tmp_path))
+    chain = CheckpointChain(store, keep=1, max_chain=8)
+    for num in range(4):
+        _dump(chain, num)
+    # nothing can go from the middle of a chain
+    assert _on_disk(store) == [0, 1, 2, 3]
+    assert chain.pruned == 0
+
+def test_disk_budget_drops_old_points_and_rebases(tmp_path):
+    store = ImageStore(str(tmp_path))
+    chain = CheckpointChain(store, keep=3, max_chain=0, disk_budget=250)
+    for num in range(3):
+        _dump(chain, num)
+    # full dumps only: the budget fits the newest two
+    assert _on_disk(store) == [1, 2]
+
+    chain = CheckpointChain(ImageStore(str(tmp_path / 'incremental')), keep=3, max_chain=8, disk_budget=250)
+    parents = [_dump(chain, num) for num in range(4)]
+    # over budget with a single chain: the next dump starts a new one
+    assert parents == [None, 0, 1, None]
+    assert sorted(chain.parents) == [3]
+    assert chain.stats() == {"checkpoints": 1, "chain_depth": 0, "chain_bytes": 100, "total_bytes": 100,
+                             "full_dumps": 2, "pruned": 3}
+
+def test_discard_and_reset(tmp_path):
+    discarded = []
+    store = ImageStore(str(tmp_path))
+    chain = CheckpointChain(store, keep=1, max_chain=0, discard=discarded.append)
+    for num in range(3):
+        _dump(chain, num)
+    assert discarded == [store.path(0), store.path(1)]
+    chain.reset()
+    assert chain.parent_for(3) is None and not chain.parents
+
+def test_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('AXOLOTL_CHECKPOINT_KEEP', '5')
+    monkeypatch.setenv('AXOLOTL_CHECKPOINT_MAX_CHAIN', '0')
+    monkeypatch.setenv('AXOLOTL_CHECKPOINT_DISK_BUDGET', '1.5')
+    chain = CheckpointChain.from_env(ImageStore(str(tmp_path)))
+    assert (chain.keep, chain.max_chain, chain.disk_budget) == (5, 0, 1536 * 1024)
@@ -0,0 +1,102 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from axolotl.rules import (ExceptionRule, ExceptionRules, init_exception_sites, REPAIR, IGNORE, DEMOTE,
+                           QUARANTINE, SITES_FILE)
+
+class NotThisMethod(Exception):
+    pass
+
+def raised(exc):
+    try:
+        raise exc
+    except BaseException as e:
+        return e
+
+def parse_header(d):
+    return d['missing']
+
+def raised_in_parse():
+    try:
+        parse_header({})
+    except KeyError as e:
+        return e
+
+@pytest.fixture
+def sites(tmp_path):
+    init_exception_sites(str(tmp_path))
+    return str(tmp_path / SITES_FILE)
+
+def test_rule_fields():
+    e = raised_in_parse()
+    filename = parse_header.__code__.co_filename
+    assert ExceptionRule(IGNORE, type='LookupError').matches(e, filename, 'parse_header', 5)
+    assert ExceptionRule(IGNORE, type='builtins.KeyError').matches(e, filename, 'parse_header', 5)
+    assert not ExceptionRule(IGNORE, type='ValueError').matches(e, filename, 'parse_header', 5)
+    assert ExceptionRule(IGNORE, message='missing').matches(e, filename, 'parse_header', 5)
+    assert ExceptionRule(IGNORE, file='*/test_rules.py', function='parse_*').matches(e, filename, 'parse_header', 5)
+    assert not ExceptionRule(IGNORE, file='*/migrations/*').matches(e, filename, 'parse_header', 5)
+    assert ExceptionRule(IGNORE, line=[4, 5]).matches(e, filename, 'parse_header', 5)
+    # every given field must match
+    assert not ExceptionRule(IGNORE, type='KeyError', line=6).matches(e, filename, 'parse_header', 5)
+    with pytest.raises(ValueError):
+        ExceptionRule('retry')
+
+def test_site_is_the_raising_frame():
+    fingerprint, filename, function, lineno = ExceptionRules.site(raised_in_parse())
+    assert function == 'parse_header'
+    assert fingerprint.startswith('KeyError@') and fingerprint.endswith(f':{lineno}')
+    # frames outside the target root don't count
+    fingerprint, _, function, _ = ExceptionRules.site(raised_in_parse(), Path('/nonexistent'))
+    assert function == 'parse_header'
+
+def test_default_rules(sites):
+    rules = ExceptionRules(sites_path=sites)
+    assert rules.check(raised(StopIteration())) == IGNORE
+    assert rules.check(raised(NotThisMethod())) == IGNORE
+    assert rules.check(raised(ValueError('Invalid frequency: 3X'))) == IGNORE
+    assert rules.check(raised(ValueError('bad'))) == REPAIR
+
+def test_first_matching_rule_wins(sites):
+    rules = ExceptionRules([ExceptionRule(REPAIR, type='KeyError', function='parse_*'),
+                            ExceptionRule(IGNORE, type='LookupError')], sites_path=sites)
+    assert rules.check(raised_in_parse()) == REPAIR
+    assert rules.check(raised(IndexError())) == IGNORE
+
+def test_quarantine_after_max_repairs(sites):
+    rules = ExceptionRules([], max_repairs=2, rate_limit={}, sites_path=sites)
+    verdicts = [rules.check(raised_in_parse()) for _ in range(4)]
+    assert verdicts == [REPAIR, REPAIR, QUARANTINE, QUARANTINE]
+    # per site: another raising site still repairs
+    assert rules.check(raised(KeyError())) == REPAIR
+
+def test_demote_above_rate_limit(sites, monkeypatch):
+    import axolotl.rules as rules_module
+    now = [1000.0]
+    monkeypatch.setattr(rules_module.time, 'time', lambda: now[0])
+    rules = ExceptionRules([], max_repairs=None, rate_limit={"count": 2, "window": 10}, sites_path=sites)
+    assert [rules.check(raised_in_parse()) for _ in range(3)] == [REPAIR, REPAIR, DEMOTE]
+    now[0] += 11
+    assert rules.check(raised_in_parse()) == REPAIR
+
+def test_counters_survive_a_new_instance(sites):
+    # counters live in WDIR, so they survive checkpoint restores
+    ExceptionRules([], max_repairs=1, sites_path=sites).check(raised_in_parse())
+    assert ExceptionRules([], max_repairs=1, sites_path=sites).check(raised_in_parse()) == QUARANTINE
+    with open(sites) as f:
+        (stats,) = json.load(f).values()
+    assert (stats["seen"], stats["repairs"], stats["quarantined"], stats["status"]) == (2, 1, 1, QUARANTINE)
+
+def test_load(tmp_path, sites):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps({"version": 1, "max_repairs": 7, "defaults": False,
+                                "rules": [{"action": "ignore", "type": "ConnectionResetError"}]}))
+    rules = ExceptionRules.load(str(path))
+    assert rules.max_repairs == 7 and len(rules.rules) == 1
+    path.write_text(json.dumps({"version": 1, "rules": [{"action": "ignore", "type": "OSError"}]}))
+    assert len(ExceptionRules.load(str(path)).rules) == 3
+    path.write_text(json.dumps({"version": 9}))
+    with pytest.raises(ValueError):
+        ExceptionRules.load(str(path))
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+import psutil
+import pytest
+
+import axolotl.mode as mc
+from axolotl.events import wait_until_stopped, EVENT_SOCKET_ENV
+from axolotl.snapshot import ForkBackend, SNAPSHOT_BACKEND_ENV, RESTORE_TIMEOUT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# counts forever; every step leaves "pid count" in WDIR/progress
+TARGET = '''
+import os, time
+from axolotl.snapshot import install_snapshot_handler
+install_snapshot_handler()
+progress = os.path.join(os.environ['WDIR'], 'progress')
+count = 0
+while True:
+    count += 1
+    with open(progress + '.tmp', 'w') as f:
+        f.write(f'{os.getpid()} {count}')
+    os.replace(progress + '.tmp', progress)
+    time.sleep(0.01)
+'''
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='fork snapshots need /proc')
+
+def _progress(wdir):
+    try:
+        with open(os.path.join(wdir, 'progress')) as f:
+            pid, count = f.read().split()
+        return int(pid), int(count)
+    except (OSError, ValueError):
+        return None, 0
+
+def _wait_for(predicate, timeout=RESTORE_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def _dead(pid):
+    try:
+        return psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return True
+
+def _leftovers():
+    """Stopped or zombie processes under this one."""
+    left = []
+    for child in psutil.Process().children(recursive=True):
+        try:
+            if child.status() in (psutil.STATUS_STOPPED, psutil.STATUS_ZOMBIE):
+                left.append(child.pid)
+        except psutil.NoSuchProcess:
+            pass
+    return left
+
+def test_fork_snapshot_restore(tmp_path, monkeypatch):
+    wdir = str(tmp_path)
+    monkeypatch.setenv('WDIR', wdir)
+    mc.init_mode(wdir)
+    env = dict(os.environ, WDIR=wdir, PYTHONPATH=os.path.join(ROOT, 'src'))
+    env[SNAPSHOT_BACKEND_ENV] = 'fork'
+    env.pop(EVENT_SOCKET_ENV, None)
+
+    backend = ForkBackend(wdir)
+    target = subprocess.Popen([sys.executable, '-c', TARGET], env=env)
+    images_dir = os.path.join(wdir, 'images', '1')
+    os.makedirs(images_dir)
+    restored = None
+    try:
+        assert _wait_for(lambda: _progress(wdir)[0] == target.pid)
+        assert backend.dump(psutil.Process(target.pid), images_dir, None) is None
+        assert _wait_for(lambda: backend.dump_done(None, images_dir))
+
+        target.kill()
+        target.wait()
+        killed_at = _progress(wdir)[1]
+
+        restored = backend.restore(images_dir)
+        assert restored is not None and restored != target.pid
+        assert wait_until_stopped(restored, RESTORE_TIMEOUT)
+        os.kill(restored, signal.SIGCONT)
+
+        # the restored target carries on counting from the snapshot point
+        assert _wait_for(lambda: _progress(wdir)[0] == restored)
+        assert _progress(wdir)[1] <= killed_at + 1
+        assert _wait_for(lambda: _progress(wdir)[1] > killed_at + 1)
+    finally:
+        if target.poll() is None:
+            target.kill()
+            target.wait()
+        if restored is not None:
+            try:
+                os.kill(restored, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            # a child of the stopped snapshot: a zombie until close() kills that and reaps it
+            _wait_for(lambda: _dead(restored), timeout=5.0)
+        backend.close([images_dir])
+
+    assert _wait_for(lambda: not _leftovers(), timeout=5.0), _leftovers()
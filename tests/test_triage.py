@@ -0,0 +1,51 @@
+import sys
+
+from axolotl import triage
+
+def _verdict(exc):
+    """should_repair for `exc` propagating out of the caller of this function."""
+    return triage.should_repair(exc, sys._getframe(1))
+
+def raiser(exc):
+    return _verdict(exc)
+
+def test_caught_by_caller():
+    try:
+        verdict = raiser(KeyError('k'))
+    except KeyError:
+        verdict = 'unreachable'
+    assert verdict is False
+
+def test_not_caught():
+    def caller():
+        try:
+            return raiser(ValueError('v'))
+        except KeyError:
+            return 'unreachable'
+    assert caller() is True
+
+def test_catch_all_is_a_boundary():
+    try:
+        verdict = raiser(KeyError('k'))
+    except Exception:
+        verdict = 'unreachable'
+    assert verdict is True
+
+def test_verdict_is_memoised_per_site_and_type():
+    def caller(exc):
+        try:
+            return raiser(exc)
+        except LookupError:
+            return 'unreachable'
+
+    def memoised():
+        return sorted(key[4].__name__ for key, (_, handler, _) in triage._verdicts.items()
+                      if handler is caller.__code__)
+
+    assert caller(KeyError('a')) is False
+    assert caller(KeyError('b')) is False
+    assert memoised() == ['KeyError']
+    # one entry per exception type, whatever the verdict
+    assert caller(ZeroDivisionError()) is True
+    assert caller(IndexError()) is False
+    assert memoised() == ['IndexError', 'KeyError', 'ZeroDivisionError']